@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Compares htbapi.serialization with pickle and JSON.
+The htbapi row is the built in codec, the fast row uses msgpack if it is
+installed.
+Run from the repository root: python benchmarks/serialization.py
+"""
+import json
+import pickle
+import random
+import timeit
+
+from htbapi import serialization
+from htbapi.machines import HTBMachine
+from htbapi.profiles import HTBProfile
+
+
+def machine(i):
+    m = HTBMachine({
+        "id": i, "name": f"Machine{i}", "os": random.choice(["Linux", "Windows"]),
+        "active": i % 5 == 0, "retired": i % 5 != 0, "points": 20,
+        "static_points": 20, "release": "2020-07-25T19:00:00.000000Z",
+        "user_owns_count": random.randint(0, 20000),
+        "root_owns_count": random.randint(0, 20000), "free": False,
+        "authUserInUserOwns": False, "authUserInRootOwns": False,
+        "authUserHasReviewed": False, "stars": 4.5, "difficulty": 42,
+        "avatar": f"/storage/avatars/{i:032x}.png",
+        "feedbackForChart": {f"counter{n}": random.randint(0, 500)
+                             for n in range(10)},
+        "difficultyText": "Medium", "isCompleted": False,
+        "last_reset_time": "2 hours ago",
+        "playInfo": {"isSpawned": None, "isSpawning": None, "isActive": None,
+                     "active_player_count": None, "expires_at": None},
+        "maker": {"id": i * 7, "name": f"maker{i}", "avatar": None,
+                  "isRespected": False},
+        "maker2": None,
+        "userBlood": {"user": {"id": i * 3, "name": f"blood{i}",
+                               "avatar": None},
+                      "blood_difference": "1H 2M 3S"},
+        "rootBlood": {"user": {"id": i * 5, "name": f"root{i}",
+                               "avatar": None},
+                      "blood_difference": "2H 3M 4S"},
+        "recommended": 0,
+    })
+    m.isloaded = True
+    return m
+
+
+def profile(i):
+    p = HTBProfile({
+        "id": i, "name": f"user{i}", "timezone": "Europe/London",
+        "isVip": True, "avatar": None, "points": random.randint(0, 500),
+        "system_owns": 10, "user_owns": 12, "system_bloods": 0,
+        "user_bloods": 1, "respects": 3, "country_name": "United Kingdom",
+        "country_code": "GB", "team": {"id": 1, "name": "team", "ranking": 5,
+                                       "avatar": None},
+        "university_name": None, "description": None, "github": None,
+        "linkedin": None, "twitter": None, "website": None,
+        "isRespected": False, "isFollowed": False, "rank": "Hacker",
+        "rank_id": 4, "current_rank_progress": 12.5, "next_rank": "Pro Hacker",
+        "next_rank_points": 45.0, "rank_ownership": "30.5",
+        "rank_requirement": 25, "ranking": random.randint(1, 100000),
+    })
+    p.isloaded = True
+    return p
+
+
+def jsondumps(objects):
+    return json.dumps([o.__dict__ for o in objects]).encode()
+
+
+def jsonloads(data):
+    return [HTBMachine(values) for values in json.loads(data)]
+
+
+def bench(name, objects, number=20):
+    codecs = {
+        "pickle": (lambda o: pickle.dumps(o, pickle.HIGHEST_PROTOCOL),
+                   pickle.loads),
+        "json": (jsondumps, jsonloads),
+        "htbapi": (serialization.dumps, serialization.loads),
+    }
+    if serialization.msgpack is not None:
+        codecs["fast"] = (lambda o: serialization.dumps(o, fast=True),
+                          serialization.loads)
+    print(f"{name} ({len(objects)} objects)")
+    print(f"  {'format':<10}{'bytes':>10}{'dumps ms':>12}{'loads ms':>12}")
+    for codec, (dump, load) in codecs.items():
+        data = dump(objects)
+        dumptime = timeit.timeit(lambda: dump(objects), number=number)
+        loadtime = timeit.timeit(lambda: load(data), number=number)
+        print(f"  {codec:<10}{len(data):>10}"
+              f"{dumptime / number * 1000:>12.2f}"
+              f"{loadtime / number * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    bench("single machine", [machine(1)], number=2000)
+    bench("machines", [machine(i) for i in range(1000)])
+    bench("profiles", [profile(i) for i in range(1000)])
@@ -7,6 +7,8 @@ import logging
 from . import client
 from . import exceptions
 from .client import Client
+from .client import Deadline
+from .priority import Priority
 from .client import session
 from .challenges import HTBChallenge
 from .machines import HTBMachine
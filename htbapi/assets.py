@@ -0,0 +1,372 @@
+"""Contains a fetcher for avatars and other images served by HTB.
+
+Assets are downloaded concurrently over a pool of kept alive connections
+and stored in an on disk cache. Files are named by the sha256 of their
+content, so an image used by many objects (ie. the default avatar) is
+stored once. The cache is bounded in size and evicts the least recently
+used assets. Cached assets older than :maxage: are revalidated with
+If-None-Match / If-Modified-Since, which costs a 304 instead of a
+download when they haven't changed.
+
+ie.
+    fetcher = AssetFetcher(AssetCache("~/.cache/htbapi/assets"))
+    paths = fetcher.prefetchavatars(findmachines("a"))
+    path = fetcher.fetch(machine.avatar)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .client import DEFAULTTIMEOUT, Timeout
+from .exceptions import HTBException, HTBRequestException
+from .models import HTBObject
+
+ASSETURL = "https://www.hackthebox.eu"
+"""The URL asset paths are relative to."""
+
+AVATARFIELDS = ("avatar", "avatar_thumb", "userBloodAvatar",
+                "rootBloodAvatar", "creator_avatar", "creator2_avatar",
+                "first_blood_user_avatar")
+"""The fields that hold the path of an avatar image."""
+
+INDEXVERSION = 1
+
+
+def asseturl(path: str) -> str:
+    """Returns the full URL of an asset path, ie. /storage/avatars/1.png."""
+    if path.startswith(("http://", "https://")):
+        return path
+    if not path.startswith("/"):
+        path = "/" + path
+    return ASSETURL + path
+
+
+def avatarpaths(objects: Iterable[HTBObject]) -> List[str]:
+    """Returns the avatar paths of objects without loading them.
+
+    Nested objects, ie. a machine's maker or a profile's team, are included
+    if their data is already present.
+
+    Args:
+        objects: The objects to collect avatars from.
+    Returns:
+        The unique avatar paths in the order they were found.
+    """
+
+    paths: Dict[str, None] = {}
+
+    def collect(values: dict):
+        for key, value in values.items():
+            if isinstance(value, dict):
+                collect(value)
+            elif isinstance(value, str) and value and key in AVATARFIELDS:
+                paths.setdefault(value)
+
+    for obj in objects:
+        collect(obj.__dict__)
+    return list(paths)
+
+
+class AssetCache:
+    """A size bounded, content addressed cache of assets on disk.
+
+    The index mapping URLs to content is kept in memory and written to
+    index.json by save.
+    """
+
+    def __init__(self, directory: str, maxsize: int = 256 * 1024 * 1024):
+        """Initializes the cache, loading the index if one exists.
+
+        Args:
+            directory: The directory to store assets in.
+            maxsize: The maximum number of bytes of assets to keep.
+        """
+        self.directory = os.path.expanduser(directory)
+        self.maxsize = maxsize
+        self.size = 0
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+        self._load()
+
+    @property
+    def indexpath(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def path(self, digest: str) -> str:
+        """Returns the file path of content with sha256 :digest:."""
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._entries
+
+    def _load(self):
+        try:
+            with open(self.indexpath, encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logging.warning(f"Ignoring corrupt asset index {self.indexpath}")
+            return
+        if index.get("version") != INDEXVERSION:
+            return
+        for url, entry in index["entries"]:
+            if os.path.exists(self.path(entry["digest"])):
+                self._add(url, entry)
+
+    def _add(self, url: str, entry: dict):
+        digest = entry["digest"]
+        self._entries[url] = entry
+        refs = self._refs.get(digest, 0)
+        if not refs:
+            self._sizes[digest] = entry["size"]
+            self.size += entry["size"]
+        self._refs[digest] = refs + 1
+
+    def _discard(self, url: str):
+        digest = self._entries.pop(url)["digest"]
+        self._refs[digest] -= 1
+        if self._refs[digest]:
+            return
+        del self._refs[digest]
+        self.size -= self._sizes.pop(digest)
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, url: str) -> Optional[dict]:
+        """Returns the cache entry of a URL and marks it as recently used.
+
+        The entry holds the digest, size, etag, lastmodified and the time
+        it was last fetched or revalidated. Entries whose file is missing
+        (ie. removed by hand) are dropped and None is returned.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if not os.path.exists(self.path(entry["digest"])):
+                self._discard(url)
+                return None
+            self._entries.move_to_end(url)
+            return entry
+
+    def touch(self, url: str) -> Optional[str]:
+        """Marks the entry of a URL as revalidated now.
+
+        Returns:
+            The path of the cached file, or None if it is no longer cached.
+        """
+        with self._lock:
+            entry = self.lookup(url)
+            if entry is None:
+                return None
+            entry["fetched"] = time.time()
+            return self.path(entry["digest"])
+
+    def put(self, url: str, content: bytes, etag: Optional[str] = None,
+            lastmodified: Optional[str] = None) -> str:
+        """Stores the content of a URL, evicting old assets if needed.
+
+        Args:
+            url: The URL the content was fetched from.
+            content: The asset.
+            etag: The ETag header of the response.
+            lastmodified: The Last-Modified header of the response.
+        Returns:
+            The path of the stored file.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.path(digest)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            stored = digest in self._refs and os.path.exists(path)
+        if not stored:
+            # The file is written outside the lock, only moving it into
+            # place has to happen together with the index update.
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(content)
+        with self._lock:
+            if url in self._entries:
+                self._discard(url)
+            if not stored:
+                os.replace(tmp, path)
+            elif not os.path.exists(path):
+                # Evicted since it was checked.
+                with open(tmp, "wb") as f:
+                    f.write(content)
+                os.replace(tmp, path)
+            self._add(url, {"digest": digest, "size": len(content),
+                            "etag": etag, "lastmodified": lastmodified,
+                            "fetched": time.time()})
+            self.evict()
+        return path
+
+    def evict(self):
+        """Drops the least recently used assets until the cache fits."""
+        with self._lock:
+            while self.size > self.maxsize and len(self._entries) > 1:
+                self._discard(next(iter(self._entries)))
+
+    def save(self):
+        """Writes the index to disk."""
+        with self._lock:
+            index = {"version": INDEXVERSION,
+                     "entries": [[url, dict(entry)]
+                                 for url, entry in self._entries.items()]}
+        tmp = f"{self.indexpath}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.indexpath)
+
+
+class AssetFetcher:
+    """Downloads assets concurrently into an AssetCache."""
+
+    def __init__(self, cache: AssetCache, workers: int = 8,
+                 maxage: float = 86400.0,
+                 timeout: Timeout = DEFAULTTIMEOUT):
+        """Initializes the fetcher.
+
+        Args:
+            cache: The cache to store assets in.
+            workers: The number of concurrent downloads. The connection
+                pool is sized to match.
+            maxage: The number of seconds a cached asset is used before it
+                is revalidated.
+            timeout: The requests timeout of every download.
+                Defaults to the client's DEFAULTTIMEOUT.
+        """
+        self.cache = cache
+        self.workers = workers
+        self.maxage = maxage
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.http.headers["User-Agent"] = "Python HTB API"
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, path: str, refresh: bool = False) -> str:
+        """Returns the local file of an asset, downloading it if needed.
+
+        Concurrent fetches of the same asset share one download.
+
+        Args:
+            path: The asset path or full URL.
+            refresh: Whether to revalidate the asset even if it's fresh.
+        Returns:
+            The path of the cached file.
+        Raises:
+            HTBRequestException: If the asset can't be downloaded.
+        """
+        url = asseturl(path)
+        while True:
+            with self._lock:
+                pending = self._inflight.get(url)
+                if pending is None:
+                    done = self._inflight[url] = threading.Event()
+                    break
+            pending.wait()
+            refresh = False
+        try:
+            return self._fetch(url, refresh)
+        finally:
+            with self._lock:
+                del self._inflight[url]
+            done.set()
+
+    def _fetch(self, url: str, refresh: bool) -> str:
+        entry = self.cache.lookup(url)
+        headers = {}
+        if entry is not None:
+            if not refresh and time.time() - entry["fetched"] < self.maxage:
+                return self.cache.path(entry["digest"])
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("lastmodified"):
+                headers["If-Modified-Since"] = entry["lastmodified"]
+        resp = self.http.get(url, headers=headers, timeout=self.timeout)
+        if resp.status_code == 304 and entry is not None:
+            path = self.cache.touch(url)
+            if path is not None:
+                return path
+            # Evicted while revalidating.
+            resp = self.http.get(url, timeout=self.timeout)
+        if resp.status_code != 200:
+            raise HTBRequestException(resp)
+        return self.cache.put(url, resp.content, resp.headers.get("ETag"),
+                              resp.headers.get("Last-Modified"))
+
+    def read(self, path: str) -> bytes:
+        """Returns the content of an asset, downloading it if needed."""
+        with open(self.fetch(path), "rb") as f:
+            return f.read()
+
+    def fetchmany(self, paths: Iterable[str], refresh: bool = False) \
+            -> Dict[str, Optional[str]]:
+        """Fetches many assets concurrently and saves the cache index.
+
+        Args:
+            paths: The asset paths or full URLs.
+            refresh: Whether to revalidate assets even if they're fresh.
+        Returns:
+            The cached file of every path, or None if it couldn't be
+            downloaded.
+        """
+        paths = list(dict.fromkeys(paths))
+
+        def fetch(path: str) -> Optional[str]:
+            try:
+                return self.fetch(path, refresh)
+            except (HTBException, requests.RequestException, OSError) as e:
+                logging.warning(f"Failed to fetch asset {path}: {e}")
+                return None
+
+        if not paths:
+            return {}
+        with ThreadPoolExecutor(min(self.workers, len(paths))) as pool:
+            files = dict(zip(paths, pool.map(fetch, paths)))
+        self.cache.save()
+        return files
+
+    def prefetchavatars(self, objects: Iterable[HTBObject],
+                        refresh: bool = False) -> Dict[str, Optional[str]]:
+        """Fetches the avatars of objects, and the objects nested in them.
+
+        The objects aren't loaded, only avatars that are already known are
+        fetched.
+
+        Args:
+            objects: The objects to fetch avatars for.
+            refresh: Whether to revalidate avatars even if they're fresh.
+        Returns:
+            The cached file of every avatar path, or None if it couldn't be
+            downloaded.
+        """
+        return self.fetchmany(avatarpaths(objects), refresh)
+
+    def close(self):
+        """Saves the cache index and closes the connection pool."""
+        self.cache.save()
+        self.http.close()
@@ -0,0 +1,218 @@
+"""Contains circuit breakers that stop requests to degraded endpoints.
+
+Every endpoint family (the first path segment of an endpoint, ie. "machine"
+for /machine/profile/1) has its own CircuitBreaker. A breaker tracks the
+error rate and the rate of slow calls over a rolling window. When either
+gets too high the breaker opens and calls fail fast with HTBCircuitOpen
+(or are served from the last good response) instead of piling more load on
+the endpoint. After a cooldown the breaker lets a few probe calls through
+(half open) and closes again if they succeed.
+
+ie.
+    htbapi.session.breakers.states()
+    {'machine': {'state': 'open', 'calls': 20, 'errorrate': 0.65, ...}}
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from .exceptions import HTBCircuitOpen
+
+CLOSED = "closed"
+OPEN = "open"
+HALFOPEN = "halfopen"
+
+
+def endpointfamily(path: str) -> str:
+    """Returns the family of an endpoint path, ie. "machine" for
+    "/machine/profile/1"."""
+
+    return path.lstrip("/").split("/", 1)[0].split("?", 1)[0]
+
+
+class CircuitBreaker:
+    """A circuit breaker for a single endpoint family."""
+
+    def __init__(self, name: str, window: float = 30.0,
+                 minimumcalls: int = 10, errorthreshold: float = 0.5,
+                 slowcall: Optional[float] = 10.0,
+                 slowthreshold: float = 0.8, cooldown: float = 15.0,
+                 probes: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        """Initializes a closed breaker.
+
+        Args:
+            name: The endpoint family.
+            window: The number of seconds of calls the rates are based on.
+            minimumcalls: The number of calls in the window needed before
+                the breaker can open.
+            errorthreshold: The error rate that opens the breaker.
+            slowcall: The number of seconds after which a call is slow.
+                Latency is ignored if None.
+            slowthreshold: The rate of slow calls that opens the breaker.
+            cooldown: The number of seconds the breaker stays open.
+            probes: The number of successful probe calls that close a half
+                open breaker.
+            clock: The monotonic clock used for timing.
+        """
+        self.name = name
+        self.window = window
+        self.minimumcalls = minimumcalls
+        self.errorthreshold = errorthreshold
+        self.slowcall = slowcall
+        self.slowthreshold = slowthreshold
+        self.cooldown = cooldown
+        self.probes = probes
+        self.clock = clock
+        self.state = CLOSED
+        self.openedat: Optional[float] = None
+        self.trips = 0
+        self.rejected = 0
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+        self._failures = 0
+        self._slow = 0
+        self._probing = 0
+        self._probesucceeded = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window:
+            _, failed, slow = self._calls.popleft()
+            self._failures -= failed
+            self._slow -= slow
+
+    def _transition(self, state: str, now: float):
+        if state == self.state:
+            return
+        logging.warning(f"Circuit for /{self.name} endpoints is now {state}")
+        self.state = state
+        if state == OPEN:
+            self.openedat = now
+            self.trips += 1
+        elif state == CLOSED:
+            self._calls.clear()
+            self._failures = self._slow = 0
+        self._probing = self._probesucceeded = 0
+
+    def retryafter(self) -> float:
+        """The number of seconds until an open breaker lets probes through."""
+        if self.state != OPEN or self.openedat is None:
+            return 0.0
+        return max(0.0, self.openedat + self.cooldown - self.clock())
+
+    def allow(self) -> bool:
+        """Returns whether a call may be sent.
+
+        A call that is allowed must be followed by record or abandon.
+        """
+        with self._lock:
+            now = self.clock()
+            if self.state == OPEN:
+                if now - self.openedat < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self._transition(HALFOPEN, now)
+            if self.state == HALFOPEN:
+                if self._probing >= self.probes:
+                    self.rejected += 1
+                    return False
+                self._probing += 1
+            return True
+
+    def check(self):
+        """Like allow but raises if the call may not be sent.
+
+        Raises:
+            HTBCircuitOpen: If the breaker doesn't allow the call.
+        """
+        if not self.allow():
+            raise HTBCircuitOpen(self.name, self.retryafter())
+
+    def record(self, success: bool, latency: float):
+        """Records the outcome of an allowed call.
+
+        Args:
+            success: Whether the call succeeded.
+            latency: The number of seconds the call took.
+        """
+        with self._lock:
+            now = self.clock()
+            slow = self.slowcall is not None and latency >= self.slowcall
+            if self.state == HALFOPEN:
+                self._probing -= 1
+                if not success or slow:
+                    self._transition(OPEN, now)
+                    return
+                self._probesucceeded += 1
+                if self._probesucceeded >= self.probes:
+                    self._transition(CLOSED, now)
+                return
+            if self.state == OPEN:
+                # A call that was allowed before the breaker opened.
+                return
+            self._calls.append((now, not success, slow))
+            self._failures += not success
+            self._slow += slow
+            self._prune(now)
+            calls = len(self._calls)
+            if calls >= self.minimumcalls and (
+                    self._failures / calls >= self.errorthreshold
+                    or self._slow / calls >= self.slowthreshold):
+                self._transition(OPEN, now)
+
+    def abandon(self):
+        """Releases an allowed call that finished without an outcome."""
+        with self._lock:
+            if self.state == HALFOPEN:
+                self._probing = max(0, self._probing - 1)
+
+    def stats(self) -> dict:
+        """Returns the state and rolling statistics of the breaker."""
+        with self._lock:
+            self._prune(self.clock())
+            calls = len(self._calls)
+            return {
+                "state": self.state,
+                "calls": calls,
+                "errorrate": self._failures / calls if calls else 0.0,
+                "slowrate": self._slow / calls if calls else 0.0,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retryafter": self.retryafter(),
+            }
+
+
+class CircuitBreakers:
+    """The circuit breakers of a client, created per family on demand."""
+
+    def __init__(self, **settings):
+        """Initializes the registry.
+
+        Args:
+            settings: Passed on to every CircuitBreaker that is created.
+        """
+        self.settings = settings
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, family: str) -> CircuitBreaker:
+        """Returns the breaker of an endpoint family."""
+        breaker = self._breakers.get(family)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    family, CircuitBreaker(family, **self.settings))
+        return breaker
+
+    def states(self) -> Dict[str, dict]:
+        """Returns the stats of every breaker keyed by endpoint family."""
+        return {family: breaker.stats()
+                for family, breaker in list(self._breakers.items())}
+
+    def reset(self):
+        """Closes every breaker and forgets their statistics."""
+        with self._lock:
+            self._breakers.clear()
@@ -0,0 +1,444 @@
+"""Contains an indexed in-memory catalog of machines and challenges.
+
+The HTBCatalog holds loaded objects and keeps secondary indexes on their
+fields so common filters can be answered locally instead of searching the
+API or scanning lists. Categorical fields get hash indexes and numeric or
+date fields get sorted indexes.
+
+ie.
+    catalog = HTBCatalog()
+    catalog.addall(machines)
+    easy = (catalog.query(HTBMachine)
+            .where(os="Linux", retired=False)
+            .between("points", 20, 30)
+            .orderby("stars", descending=True)
+            .limit(10)
+            .all())
+"""
+
+import bisect
+import heapq
+import itertools
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .exceptions import HTBException
+from .models import HTBObject, objectkey, parsetimestamp
+
+Key = Tuple[str, Any]
+
+HASHFIELDS = ("os", "difficultyText", "retired", "free", "category_name")
+"""The fields that get hash indexes by default."""
+
+SORTEDFIELDS = ("points", "stars", "release")
+"""The fields that get sorted indexes by default."""
+
+
+def fieldvalue(obj: HTBObject, field: str) -> Any:
+    """Returns the value of :field: used for indexing :obj:.
+
+    The "release" field is the release timestamp of a machine or the
+    release date of a challenge in seconds since the epoch.
+    Only values already present on the object are used so this never
+    triggers a load.
+
+    Args:
+        obj: The object.
+        field: The name of the field.
+    Returns:
+        The value, or None if the object doesn't have it.
+    """
+
+    values = obj.__dict__
+    if field == "release":
+        released = parsetimestamp(
+            values.get("release") or values.get("release_date"))
+        return released.timestamp() if released is not None else None
+    return values.get(field)
+
+
+def numericvalue(obj: HTBObject, field: str) -> Optional[float]:
+    """Returns the value of :field: as a number for sorted indexes.
+
+    Numeric strings (ie. "30") are converted, other values become None.
+    """
+
+    value = fieldvalue(obj, field)
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _ordered(value: Any) -> tuple:
+    """Returns a sort key grouping values by type, so fields holding
+    numbers on some classes and strings on others (ie. difficulty) can be
+    ordered. Numbers come before strings."""
+
+    if isinstance(value, (int, float)):
+        return (0, "", value)
+    if isinstance(value, str):
+        return (1, "", value)
+    return (2, type(value).__name__, value)
+
+
+def _bound(field: str, value: Any) -> Any:
+    if field == "release" and value is not None \
+            and not isinstance(value, (int, float)):
+        parsed = parsetimestamp(value)
+        if parsed is None:
+            raise HTBException(f"Invalid release bound {value!r}")
+        return parsed.timestamp()
+    return value
+
+
+class SortedIndex:
+    """A sorted index mapping the values of a field to object keys."""
+
+    def __init__(self):
+        self.values: List[tuple] = []
+        self.keys: List[Key] = []
+
+    def add(self, value: Any, order: int, key: Key):
+        entry = (value, order)
+        position = bisect.bisect_left(self.values, entry)
+        self.values.insert(position, entry)
+        self.keys.insert(position, key)
+
+    def remove(self, value: Any, order: int):
+        position = bisect.bisect_left(self.values, (value, order))
+        del self.values[position]
+        del self.keys[position]
+
+    def range(self, low: Any = None, high: Any = None) -> List[Key]:
+        """Returns the keys whose value is between :low: and :high:
+        inclusive, in ascending order."""
+        start = 0 if low is None \
+            else bisect.bisect_left(self.values, (low, -1))
+        end = len(self.values) if high is None \
+            else bisect.bisect_right(self.values, (high, float("inf")))
+        return self.keys[start:end]
+
+
+class HTBCatalog:
+    """An in-memory store of HTB objects with secondary indexes."""
+
+    def __init__(self, hashfields: Iterable[str] = HASHFIELDS,
+                 sortedfields: Iterable[str] = SORTEDFIELDS):
+        """Initializes an empty catalog.
+
+        Args:
+            hashfields: The fields to keep hash indexes for.
+            sortedfields: The fields to keep sorted indexes for.
+        """
+        self.objects: Dict[Key, HTBObject] = {}
+        self.hashindexes: Dict[str, Dict[Any, Set[Key]]] = {
+            field: {} for field in hashfields}
+        self.sortedindexes: Dict[str, SortedIndex] = {
+            field: SortedIndex() for field in sortedfields}
+        self._types: Dict[str, Set[Key]] = {}
+        self._indexed: Dict[Key, Tuple[int, Dict[str, Any]]] = {}
+        self._order = itertools.count()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def __contains__(self, obj: HTBObject) -> bool:
+        return self.key(obj) in self.objects
+
+    def __iter__(self) -> Iterator[HTBObject]:
+        return iter(list(self.objects.values()))
+
+    @staticmethod
+    def key(obj: HTBObject) -> Key:
+        """Returns the key of an object in the catalog."""
+        return objectkey(obj)
+
+    def get(self, cls: type, id: Any) -> Optional[HTBObject]:
+        """Returns the object of class :cls: with id :id:, if any."""
+        return self.objects.get((cls.__name__, id))
+
+    def add(self, obj: HTBObject):
+        """Adds an object, or re-indexes it if it is already present.
+
+        Args:
+            obj: The object to add. Only values already present on the
+                object are indexed.
+        """
+        key = self.key(obj)
+        with self._lock:
+            self._unindex(key)
+            order = next(self._order)
+            values = {}
+            for field, index in self.hashindexes.items():
+                value = fieldvalue(obj, field)
+                values[field] = value
+                index.setdefault(value, set()).add(key)
+            for field, index in self.sortedindexes.items():
+                value = numericvalue(obj, field)
+                values[field] = value
+                if value is not None:
+                    index.add(value, order, key)
+            self._types.setdefault(key[0], set()).add(key)
+            self._indexed[key] = (order, values)
+            self.objects[key] = obj
+
+    def addall(self, objects: Iterable[HTBObject]):
+        """Adds every object in :objects:."""
+        with self._lock:
+            for obj in objects:
+                self.add(obj)
+
+    def remove(self, obj: HTBObject):
+        """Removes an object from the catalog."""
+        with self._lock:
+            self._unindex(self.key(obj))
+
+    def _unindex(self, key: Key):
+        indexed = self._indexed.pop(key, None)
+        if indexed is None:
+            return
+        order, values = indexed
+        for field, index in self.hashindexes.items():
+            keys = index.get(values[field])
+            keys.discard(key)
+            if not keys:
+                del index[values[field]]
+        for field, index in self.sortedindexes.items():
+            if values[field] is not None:
+                index.remove(values[field], order)
+        self._types[key[0]].discard(key)
+        del self.objects[key]
+
+    def query(self, cls: Optional[type] = None) -> "CatalogQuery":
+        """Starts a query.
+
+        Args:
+            cls: The class of objects to return. Returns any class if None.
+        Returns:
+            A CatalogQuery.
+        """
+        return CatalogQuery(self, cls)
+
+
+class CatalogQuery:
+    """A query against a HTBCatalog.
+
+    Filters are combined with AND. Every method returns the query itself so
+    calls can be chained.
+    """
+
+    def __init__(self, catalog: HTBCatalog, cls: Optional[type] = None):
+        self.catalog = catalog
+        self.cls = cls
+        self.equals: Dict[str, Any] = {}
+        self.ranges: Dict[str, Tuple[Any, Any]] = {}
+        self.order: Optional[Tuple[str, bool]] = None
+        self.count: Optional[int] = None
+
+    def where(self, **equals) -> "CatalogQuery":
+        """Only returns objects whose fields equal the given values.
+
+        ie. where(os="Linux", retired=False)
+        """
+        self.equals.update(equals)
+        return self
+
+    def between(self, field: str, low: Any = None,
+                high: Any = None) -> "CatalogQuery":
+        """Only returns objects whose :field: is between :low: and :high:.
+
+        Bounds are inclusive and omitted if None. Bounds for "release" can
+        be timestamps, datetimes or date strings.
+        """
+        self.ranges[field] = (_bound(field, low), _bound(field, high))
+        return self
+
+    def orderby(self, field: str, descending: bool = False) -> "CatalogQuery":
+        """Sorts the results by :field:. Objects without it come last.
+
+        Fields that aren't indexed are sorted by their raw values. If they
+        are of different types (ie. difficulty is a number on machines and
+        a string on challenges) numbers are ordered before strings.
+        """
+        self.order = (field, descending)
+        return self
+
+    def limit(self, count: int) -> "CatalogQuery":
+        """Returns at most :count: results."""
+        self.count = count
+        return self
+
+    def _plan(self) -> Tuple[Optional[Iterable[Key]], List[tuple]]:
+        """Plans the query.
+
+        The hash indexed filters are intersected first. The result, or the
+        smallest indexed range if that is even more selective, drives the
+        query and every other filter is checked per key.
+
+        Returns:
+            The keys to scan (None meaning all keys) and the checks each key
+            has to pass.
+        """
+        catalog = self.catalog
+        sets: List[Set[Key]] = []
+        ranges: List[Tuple[List[Key], tuple]] = []
+        checks: List[tuple] = []
+        if self.cls is not None:
+            sets.append(catalog._types.get(self.cls.__name__, set()))
+        for field, value in self.equals.items():
+            if field in catalog.hashindexes:
+                sets.append(catalog.hashindexes[field].get(value, set()))
+            else:
+                checks.append(("eq", field, value))
+        for field, bounds in self.ranges.items():
+            if field in catalog.sortedindexes:
+                keys = catalog.sortedindexes[field].range(*bounds)
+                ranges.append((keys, ("between", field, bounds)))
+            else:
+                checks.append(("range", field, bounds))
+        driver: Optional[Iterable[Key]] = None
+        if sets:
+            sets.sort(key=len)
+            driver = sets[0].intersection(*sets[1:]) if len(sets) > 1 \
+                else sets[0]
+        ranges.sort(key=lambda r: len(r[0]))
+        if ranges and (driver is None or len(ranges[0][0]) < len(driver)):
+            if driver is not None:
+                checks.insert(0, ("in", None, driver))
+            driver = ranges.pop(0)[0]
+        checks = [check for _, check in ranges] + checks
+        return driver, checks
+
+    def _matches(self, key: Key, checks: List[tuple]) -> bool:
+        catalog = self.catalog
+        indexed = catalog._indexed[key][1]
+        for kind, field, expected in checks:
+            if kind == "in":
+                if key not in expected:
+                    return False
+            elif kind == "eq":
+                if fieldvalue(catalog.objects[key], field) != expected:
+                    return False
+            else:
+                value = indexed[field] if kind == "between" \
+                    else numericvalue(catalog.objects[key], field)
+                low, high = expected
+                if value is None or (low is not None and value < low) \
+                        or (high is not None and value > high):
+                    return False
+        return True
+
+    def __iter__(self) -> Iterator[HTBObject]:
+        return iter(self.all())
+
+    def _walk(self, index: SortedIndex, descending: bool,
+              checks: List[tuple], count: int,
+              budget: int) -> Optional[List[Key]]:
+        """Returns the first :count: keys of :index: passing :checks:, or
+        None if that takes more than :budget: keys."""
+        ordered = reversed(index.keys) if descending else index.keys
+        matches = []
+        for scanned, key in enumerate(ordered):
+            if scanned >= budget:
+                return None
+            if self._matches(key, checks):
+                matches.append(key)
+                if len(matches) >= count:
+                    break
+        return matches
+
+    def _keys(self) -> List[Key]:
+        catalog = self.catalog
+        driver, checks = self._plan()
+        if driver is None:
+            driver = catalog.objects
+        field, descending = self.order or (None, False)
+        count = self.count
+
+        if field is None:
+            matches = []
+            for key in driver:
+                if self._matches(key, checks):
+                    matches.append(key)
+                    if count is not None and len(matches) >= count:
+                        break
+            return matches
+
+        if field in catalog.sortedindexes:
+            index = catalog.sortedindexes[field]
+            # Walking the index in order finds about len(driver) matches
+            # per len(index) keys, so with a small limit it is cheaper than
+            # sorting every match. The walk is abandoned if the filters
+            # turn out to be correlated with the order.
+            if count is not None \
+                    and count * len(index.keys) < len(driver) ** 2:
+                members = driver if isinstance(driver, (set, dict)) \
+                    else set(driver)
+                walkchecks = checks if driver is catalog.objects \
+                    else [("in", None, members)] + checks
+                matches = self._walk(index, descending, walkchecks, count,
+                                     budget=2 * len(driver))
+                if matches is not None:
+                    for key in driver:
+                        if len(matches) >= count:
+                            break
+                        if catalog._indexed[key][1][field] is None \
+                                and self._matches(key, checks):
+                            matches.append(key)
+                    return matches
+
+            def sortkey(key: Key):
+                return (catalog._indexed[key][1][field],
+                        catalog._indexed[key][0])
+            def hasvalue(key: Key) -> bool:
+                return catalog._indexed[key][1][field] is not None
+        else:
+            def sortkey(key: Key):
+                return _ordered(fieldvalue(catalog.objects[key], field))
+
+            def hasvalue(key: Key) -> bool:
+                return fieldvalue(catalog.objects[key], field) is not None
+
+        present, absent = [], []
+        for key in driver:
+            if self._matches(key, checks):
+                (present if hasvalue(key) else absent).append(key)
+        try:
+            if count is not None and count < len(present):
+                pick = heapq.nlargest if descending else heapq.nsmallest
+                present = pick(count, present, key=sortkey)
+            else:
+                present.sort(key=sortkey, reverse=descending)
+        except TypeError as e:
+            raise HTBException(f"Can't order by {field}, "
+                               f"its values aren't comparable: {e}") from e
+        return present + absent
+
+    def all(self) -> List[HTBObject]:
+        """Runs the query and returns the matching objects."""
+        with self.catalog._lock:
+            keys = self._keys()
+            if self.count is not None:
+                keys = keys[:self.count]
+            return [self.catalog.objects[key] for key in keys]
+
+    def first(self) -> Optional[HTBObject]:
+        """Returns the first matching object, if any."""
+        results = self.limit(1).all()
+        return results[0] if results else None
+
+    def size(self) -> int:
+        """Returns the number of matching objects, ignoring the limit."""
+        with self.catalog._lock:
+            driver, checks = self._plan()
+            if driver is None:
+                driver = self.catalog.objects
+            return sum(1 for key in driver if self._matches(key, checks))
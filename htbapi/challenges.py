@@ -5,7 +5,7 @@ on HTB.
 """
 
 
-from . import session
+from . import prefetch, session
 from .models import HTBObject
 from typing import List, Optional
 import json
@@ -67,6 +67,7 @@ def findchallenges(name: str) -> List[HTBChallenge]:
     results = resp.json()
     searchresults = results["challenges"] if "challenges" in results else []
     matches = [HTBChallenge(res) for res in searchresults]
+    prefetch.results(matches)
     return matches
 
 def findchallenge(name: str) -> Optional[HTBChallenge]:
@@ -8,27 +8,129 @@ respective to what object you are working with.
 
 ie. Use the htb.machines module when working with a Machine
 
+A Client can limit the number of requests it has in flight across all
+threads, with further requests waiting for a free slot in order of their
+priority. The limit is opt-in: set MAXINFLIGHT before clients are created,
+or give an existing client a scheduler, ie.
+    session.scheduler = RequestScheduler(10)
+
 TODO: Improve exception handling. 
 TODO: Make more specific Exception types and messages.
 """
-from typing import Optional
+from collections import OrderedDict
+import copy
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple, Union
 import requests
 from requests import Session, Request, Response
 from requests.models import PreparedRequest
 from urllib3.exceptions import InsecureRequestWarning
+from urllib.parse import urlparse
 import json
+import threading
+import time
 
 
 from .exceptions import HTBException
 from .exceptions import HTBRequestException
 from .exceptions import HTBFurtherAuthRequired
+from .exceptions import HTBTimeout
+from .exceptions import HTBCancelled
+from .exceptions import HTBCircuitOpen
+from .breaker import CircuitBreakers, endpointfamily
+from .priority import Priority, RequestScheduler
 
 BASEURL = "https://www.hackthebox.eu/api/v4"
+DEFAULTTIMEOUT = (3.05, 30)
+"""The default (connect, read) timeouts in seconds for every request."""
+STALECACHESIZE = 256
+"""The number of GET responses kept to serve while a circuit is open, if
+Client.servestale is set."""
+MAXINFLIGHT: Optional[int] = None
+"""The default number of requests a Client sends at once, None for no
+limit."""
+
+Timeout = Union[None, float, Tuple[float, float]]
+
 def disablesslwarnings():
     """This is just for debugging purposes so I could use Burp"""
     requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning) # pylint: disable=no-member
 
+class Deadline:
+    """A point in time by which a call has to complete.
+
+    A deadline can also be cancelled from another thread, which makes any
+    request that is sent under it afterwards raise HTBCancelled.
+    Deadlines can be nested, a child expires or is cancelled together with
+    its parents.
+    """
+
+    def __init__(self, seconds: Optional[float] = None,
+                 parent: Optional["Deadline"] = None):
+        """
+        Initializes the deadline.
+
+        Args:
+            seconds: The number of seconds from now until the deadline.
+                The deadline never expires if None.
+            parent: An enclosing deadline.
+        """
+        self.expires = None if seconds is None \
+            else time.monotonic() + seconds
+        self.parents = (parent,) if parent is not None else ()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Cancels every call running under this deadline."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether this deadline, or one of its parents, was cancelled."""
+        return self._cancelled.is_set() \
+            or any(parent.cancelled for parent in self.parents)
+
+    def remaining(self) -> Optional[float]:
+        """
+        Returns the number of seconds left until the deadline, or None
+        if there is no time limit.
+        """
+        remaining = None if self.expires is None \
+            else self.expires - time.monotonic()
+        for parent in self.parents:
+            outer = parent.remaining()
+            if outer is not None:
+                remaining = outer if remaining is None \
+                    else min(remaining, outer)
+        return remaining
+
+    @property
+    def expired(self) -> bool:
+        """Whether the deadline has passed."""
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self):
+        """
+        Raises:
+            HTBCancelled: If the deadline was cancelled.
+            HTBTimeout: If the deadline has passed.
+        """
+        if self.cancelled:
+            raise HTBCancelled()
+        if self.expired:
+            raise HTBTimeout()
+
+
 class Client(Session):
+    """A Session for the HTB API.
+
+    Requests may be sent from multiple threads. If scheduler is set at
+    most scheduler.maxinflight of them are in flight at once, the others
+    wait for a slot in order of priority. By default every request is sent
+    immediately, unless MAXINFLIGHT is set.
+    """
+
     @staticmethod
     def url(endpoint: str) -> str:
         """
@@ -43,6 +145,49 @@ class Client(Session):
             endpoint = "/" + endpoint
         return BASEURL + endpoint
 
+    @staticmethod
+    def family(url: str) -> str:
+        """
+        Takes a full URL and returns its endpoint family, ie. "machine"
+        for the URL of /machine/profile/1.
+
+        Args:
+            url: The URL of a request.
+        Returns:
+            The first path segment of the endpoint.
+        """
+        if url.startswith(BASEURL):
+            return endpointfamily(url[len(BASEURL):])
+        return endpointfamily(urlparse(url).path)
+
+    @property
+    def _request(self) -> Optional[PreparedRequest]:
+        """The last request sent by the current thread."""
+        return getattr(self._local, "request", None)
+
+    @_request.setter
+    def _request(self, request: Optional[PreparedRequest]):
+        self._local.request = request
+
+    @property
+    def _response(self) -> Optional[Response]:
+        """The last response received by the current thread."""
+        return getattr(self._local, "response", None)
+
+    @_response.setter
+    def _response(self, response: Optional[Response]):
+        self._local.response = response
+
+    @property
+    def currentdeadline(self) -> Optional[Deadline]:
+        """The deadline the current thread's requests run under."""
+        return getattr(self._local, "deadline", None)
+
+    @property
+    def currentpriority(self) -> Priority:
+        """The priority the current thread's requests are sent with."""
+        return getattr(self._local, "priority", Priority.NORMAL)
+
     @property
     def needsOTP(self) -> bool:
         """
@@ -94,6 +239,19 @@ class Client(Session):
         properly store the session.
         """
         super().__init__()
+        # Requests may be sent from multiple threads at once so the last
+        # request and response are tracked per thread.
+        self._local = threading.local()
+        self._refreshlock = threading.RLock()
+        self.timeout: Timeout = DEFAULTTIMEOUT
+        self.scheduler: Optional[RequestScheduler] = None \
+            if MAXINFLIGHT is None else RequestScheduler(MAXINFLIGHT)
+        self.breakers: Optional[CircuitBreakers] = CircuitBreakers()
+        # Serving stale responses is opt-in, since objects loaded from
+        # them silently hold outdated values.
+        self.servestale = False
+        self._stale: "OrderedDict[str, Response]" = OrderedDict()
+        self._stalelock = threading.Lock()
         self.headers['User-Agent'] = "Python HTB API"
         self.headers['Accept'] = "application/json, text/plain, */*"
         self.accesstoken = None
@@ -101,10 +259,105 @@ class Client(Session):
         self.is2faEnabled = False
         self.tokenHas2FA = False
 
+    @contextmanager
+    def deadline(self, limit: Union[None, float, Deadline]) \
+            -> Iterator[Optional[Deadline]]:
+        """
+        Runs every request the current thread sends inside the block
+        under a deadline. This includes retries and token refreshes.
+        A deadline nested inside another one never outlives it.
+
+        ie.
+            with session.deadline(5):
+                machine.load()
+
+        Args:
+            limit: The number of seconds the block may take or an existing
+                Deadline to share, ie. to cancel it from another thread.
+                If None the enclosing deadline (if any) is kept.
+        Returns:
+            A context manager yielding the deadline in effect.
+        """
+        outer = self.currentdeadline
+        if limit is None:
+            yield outer
+            return
+        if not isinstance(limit, Deadline):
+            limit = Deadline(limit, outer)
+        elif outer is not None and limit is not outer:
+            limit = Deadline(None, limit)
+            limit.parents += (outer,)
+        self._local.deadline = limit
+        try:
+            yield limit
+        finally:
+            self._local.deadline = outer
+
+    @contextmanager
+    def priority(self, priority: Optional[Priority]) -> Iterator[Priority]:
+        """
+        Sends every request the current thread sends inside the block
+        with :priority:.
+
+        ie.
+            with session.priority(Priority.INTERACTIVE):
+                machine = findmachine("Blunder")
+
+        Args:
+            priority: The priority class. If None the enclosing priority
+                is kept.
+        Returns:
+            A context manager yielding the priority in effect.
+        """
+        outer = self.currentpriority
+        if priority is None:
+            yield outer
+            return
+        self._local.priority = priority
+        try:
+            yield priority
+        finally:
+            self._local.priority = outer
+
+    def calltimeout(self, timeout: Timeout = None) -> Timeout:
+        """
+        Returns the requests timeout to use for the next request.
+        The timeouts are capped by the time left until the current deadline.
+
+        Args:
+            timeout: A timeout overriding the client's default timeout.
+        Returns:
+            A (connect, read) tuple, a number of seconds or None.
+        Raises:
+            HTBCancelled: If the current deadline was cancelled.
+            HTBTimeout: If the current deadline has passed.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = self.currentdeadline
+        if deadline is None:
+            return timeout
+        deadline.check()
+        remaining = deadline.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return (remaining, remaining)
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining)
+                         for t in timeout)
+        return min(timeout, remaining)
+
     def send(self, request: PreparedRequest, store=True, **kwargs) -> Response:
         """
         Sends the prepared request that is stored in self._request
         and stores the response in self._response.
+        If the client has a scheduler the request first waits for a slot
+        according to the current priority. If the circuit breaker of the
+        endpoint family is open the request isn't sent, instead the last
+        good response to the same GET request is returned or
+        HTBCircuitOpen is raised. Retries and token refreshes
+        reuse the slot of the request that triggered them.
 
         Args:
             request: The prepared Request to send.
@@ -113,44 +366,212 @@ class Client(Session):
             The Response object.
         Raises:
             HTBRequestException: If the request fails.
+            HTBTimeout: If the current deadline passes.
+            HTBCancelled: If the current deadline is cancelled.
+            HTBCircuitOpen: If the circuit of the endpoint family is open
+                and no stale response can be served.
         """
+        with self.slot():
+            return self._send(request, store, **kwargs)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """
+        Holds a scheduler slot for the current priority while the block
+        runs. Every request the current thread sends inside the block uses
+        it instead of waiting for one of its own.
+
+        ie.
+            with session.priority(Priority.BULK), session.slot():
+                machine.load()
+
+        Returns:
+            A context manager.
+        Raises:
+            HTBTimeout: If the current deadline passes while waiting.
+            HTBCancelled: If the current deadline is cancelled.
+        """
+        scheduler = self.scheduler
+        if scheduler is None or getattr(self._local, "slot", False):
+            yield
+            return
+        priority = self.currentpriority
+        scheduler.acquire(priority, self.currentdeadline)
+        self._local.slot = True
+        try:
+            yield
+        finally:
+            self._local.slot = False
+            scheduler.release(priority)
+
+    def _send(self, request: PreparedRequest, store=True,
+              **kwargs) -> Response:
+        kwargs["timeout"] = self.calltimeout(kwargs.get("timeout"))
         if store:
             self._request = request
-        self._response = super().send(request, **kwargs)
-        self.checkresponse()
+        breaker = None
+        if self.breakers is not None:
+            breaker = self.breakers.get(Client.family(request.url))
+            if not breaker.allow():
+                self._response = self.stale(request)
+                if self._response is None:
+                    raise HTBCircuitOpen(breaker.name, breaker.retryafter())
+                return self._response
+        start = time.monotonic()
+        try:
+            self._response = super().send(request, **kwargs)
+        except requests.exceptions.RequestException as e:
+            deadline = self.currentdeadline
+            if isinstance(e, requests.exceptions.Timeout) \
+                    and deadline is not None and deadline.expired:
+                # The caller ran out of time, which says nothing about the
+                # health of the endpoint.
+                if breaker is not None:
+                    breaker.abandon()
+                raise HTBTimeout() from e
+            if breaker is not None:
+                breaker.record(False, time.monotonic() - start)
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.abandon()
+            raise
+        if breaker is not None:
+            code = self._response.status_code
+            breaker.record(code < 500 and code != 429,
+                           time.monotonic() - start)
+            if code == 200 and request.method == "GET" \
+                    and not kwargs.get("stream"):
+                self.remember(request, self._response)
+        self.checkresponse(stream=kwargs.get("stream", False))
         return self._response
 
-    def get(self, endpoint: str, **kwargs) -> Response:
+    def remember(self, request: PreparedRequest, response: Response):
+        """
+        Keeps a successful GET response to serve while the circuit of its
+        endpoint family is open. The least recently used responses are
+        dropped once STALECACHESIZE are kept.
+
+        Args:
+            request: The GET request.
+            response: Its successful response.
+        """
+        if not self.servestale:
+            return
+        with self._stalelock:
+            self._stale[request.url] = response
+            self._stale.move_to_end(request.url)
+            while len(self._stale) > STALECACHESIZE:
+                self._stale.popitem(last=False)
+
+    def stale(self, request: PreparedRequest) -> Optional[Response]:
+        """
+        Returns the last successful response to a GET request if stale
+        responses are served, else None.
+
+        Args:
+            request: The request that can't be sent.
+        Returns:
+            The stale Response, its `stale` attribute is set to True.
+        """
+        if not self.servestale or request.method != "GET":
+            return None
+        with self._stalelock:
+            response = self._stale.get(request.url)
+            if response is not None:
+                self._stale.move_to_end(request.url)
+        if response is None:
+            return None
+        response = copy.copy(response)
+        response.stale = True
+        return response
+
+    def breakerstates(self) -> dict:
+        """
+        Returns the state and rolling statistics of the circuit breaker
+        of every endpoint family that was used.
+
+        Returns:
+            A dict of breaker stats keyed by endpoint family.
+        """
+        if self.breakers is None:
+            return {}
+        return self.breakers.states()
+
+    def get(self, endpoint: str, deadline: Union[None, float, Deadline]=None,
+            priority: Optional[Priority]=None,
+            **kwargs) -> Response:
         """
         Issue a GET request to the endpoint with the query params specified
         using the shared session.
 
         Args:
             endpoint: The api endpoint to send request to (ie /user/info).
+            deadline: The number of seconds, or Deadline, the call
+                including retries may take.
+            priority: The priority class of the call.
         Returns:
             The Response object.
         Raises:
             HTBRequestException: If the request fails.
+            HTBTimeout: If the deadline passes.
+            HTBCancelled: If the deadline is cancelled.
         """
         req = self.prepare_request(
             Request("GET", Client.url(endpoint), **kwargs))
-        return self.send(req)
+        with self.deadline(deadline), self.priority(priority):
+            return self.send(req)
 
-    def post(self, endpoint: str, **kwargs) -> Response:
+    def getstream(self, endpoint: str,
+                  deadline: Union[None, float, Deadline]=None,
+                  priority: Optional[Priority]=None,
+                  **kwargs) -> Response:
+        """
+        Issue a GET request to the endpoint without reading the body.
+        The body can then be parsed incrementally as it arrives,
+        ie. with streaming.iterresponse. The caller must read or close the
+        response to release the connection.
+
+        Args:
+            endpoint: The api endpoint to send request to (ie /user/info).
+            deadline: The number of seconds, or Deadline, the call
+                including retries may take until the body starts.
+            priority: The priority class of the call.
+        Returns:
+            The Response object with an unread body.
+        Raises:
+            HTBRequestException: If the request fails.
+            HTBTimeout: If the deadline passes.
+            HTBCancelled: If the deadline is cancelled.
+        """
+        req = self.prepare_request(
+            Request("GET", Client.url(endpoint), **kwargs))
+        with self.deadline(deadline), self.priority(priority):
+            return self.send(req, stream=True)
+
+    def post(self, endpoint: str, deadline: Union[None, float, Deadline]=None,
+             priority: Optional[Priority]=None,
+             **kwargs) -> Response:
         """
         Issue a POST request to the endpoint with the JSON data specified
         and the query params specified using the shared session.
 
         Args:
             endpoint: The api endpoint to send request to (ie /user/info).
+            deadline: The number of seconds, or Deadline, the call
+                including retries may take.
+            priority: The priority class of the call.
         Returns:
             The Response object.
         Raises:
             HTBRequestException: If the request fails.
+            HTBTimeout: If the deadline passes.
+            HTBCancelled: If the deadline is cancelled.
         """
         req = self.prepare_request(
             Request("POST", Client.url(endpoint), **kwargs))
-        return self.send(req)
+        with self.deadline(deadline), self.priority(priority):
+            return self.send(req)
 
     def login(self, email: str, password: str, ignore2fa=False):
         """
@@ -208,7 +629,7 @@ class Client(Session):
             raise HTBException("Invalid Two Factor Authorization Code")
 
         req = self.prepare_request(Request("POST", url, json=data))
-        resp = super().send(req)
+        resp = super().send(req, timeout=self.calltimeout())
         if resp.status_code == 200:
             self.tokenHas2FA = True
 
@@ -248,22 +669,27 @@ class Client(Session):
         self.accesstoken = None
         self.refreshtoken = None
 
-    def checkresponse(self):
+    def checkresponse(self, stream=False):
         """
         Checks the response for errors and raises an Exception
         when one is found.
 
+        Args:
+            stream: Whether the body of a successful response is left
+                unread for the caller to stream.
         Raises:
             HTBRequestException: If the request contains errors.
         """
         if self._response is not None:
             if self._response.status_code > 400:
                 exception = HTBRequestException(self._response)
-                if (exception.code == 401 and self.refreshtoken is not None):
-                    self.refreshsession()
-                    self.retry()
+                if (exception.code == 401
+                        and self.refreshstale(self._response.request)):
+                    self.retry(stream=stream)
                 else:
                     raise exception
+            if stream:
+                return
             try:
                 r = self._response.json()
                 if "error" in r:
@@ -273,15 +699,44 @@ class Client(Session):
         else:
             raise HTBRequestException(None)
 
-    def retry(self):
+    def refreshstale(self, request: PreparedRequest) -> bool:
+        """
+        Refreshes the session after :request: was rejected as unauthorized.
+        If another thread already refreshed the session since :request:
+        was sent the session is not refreshed again.
+
+        Args:
+            request: The request that was rejected.
+        Returns:
+            Whether the request can be retried with a fresh token.
+        Raises:
+            HTBFurtherAuthRequired: If 2FA is enabled.
+        """
+        with self._refreshlock:
+            if request.headers.get("Authorization") \
+                    != self.headers.get("Authorization"):
+                return self.accesstoken is not None
+            if self.refreshtoken is None:
+                return False
+            self.refreshsession()
+            return True
+
+    def retry(self, **kwargs):
         """
         Retries the last request if possible.
+        The request is sent with the current access token.
 
+        Args:
+            kwargs: Passed on to send, ie. stream=True.
         Raises:
             HTBRequestException: If the request fails.
         """
         if self._request is not None:
-            return self.send(self._request)
+            request = self._request.copy()
+            if "Authorization" in self.headers:
+                request.headers["Authorization"] = \
+                    self.headers["Authorization"]
+            return self.send(request, **kwargs)
 
 
 session = Client()
@@ -0,0 +1,403 @@
+"""Contains a crawler for walking the relationships between HTB objects.
+
+The HTBCrawler starts from a set of seed objects, loads them, and follows
+the references they expose (machine makers and bloods, profile teams,
+challenge creators and bloods). Every object is visited once, loads run
+concurrently on a bounded pool of workers, and the state of the crawl is
+periodically checkpointed to disk so an interrupted crawl can be resumed.
+Loaded objects are written to a sink.
+
+ie.
+    with SQLiteSink("htb.db") as sink:
+        crawler = HTBCrawler(sink, checkpoint="crawl.json")
+        crawler.add(findmachine("Blunder"))
+        crawler.run()
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from typing import Union
+
+from . import session
+from .challenges import HTBChallenge
+from .client import Deadline
+from .exceptions import HTBCancelled, HTBException, HTBTimeout
+from .priority import Priority
+from .machines import HTBMachine
+from .models import HTBObject
+from .profiles import HTBProfile
+from .teams import HTBTeam
+
+CHECKPOINTVERSION = 1
+
+objectclasses = {cls.__name__: cls for cls in
+                 (HTBMachine, HTBChallenge, HTBProfile, HTBTeam)}
+"""The classes the crawler can visit keyed by class name."""
+
+defaultpriorities = {
+    "HTBMachine": 0,
+    "HTBChallenge": 1,
+    "HTBProfile": 2,
+    "HTBTeam": 3,
+}
+"""The default crawl priority of each class. Lower values are visited first."""
+
+
+def references(obj: HTBObject) -> List[HTBObject]:
+    """Returns the crawlable objects referenced by :obj:.
+
+    Follows the HTBReference fields of the object, descending through
+    nested objects that can't be crawled themselves (ie. a MachineBlood
+    yields the profile of its user). Only values that are already present
+    on the object are inspected so calling this never triggers a load.
+
+    Args:
+        obj: A loaded object.
+    Returns:
+        A list of (usually unloaded) referenced objects.
+    """
+
+    found = []
+    for ref in obj.references():
+        if ref.__class__.__name__ in objectclasses:
+            found.append(ref)
+        else:
+            found += references(ref)
+    if isinstance(obj, HTBChallenge):
+        values = obj.__dict__
+        for idkey, namekey in (("creator_id", "creator_name"),
+                               ("first_blood_user_id", "first_blood_user")):
+            if values.get(idkey):
+                found.append(HTBProfile(
+                    {"id": values[idkey], "name": values.get(namekey)}))
+    return [ref for ref in found if ref.__dict__.get("id") is not None]
+
+
+def record(obj: HTBObject) -> dict:
+    """Returns a JSON serializable record for :obj:.
+
+    Args:
+        obj: The object to convert.
+    Returns:
+        A dict containing the type, id and data of the object.
+    """
+
+    data = {k: v for k, v in obj.__dict__.items() if k != "isloaded"}
+    return {"type": obj.__class__.__name__, "id": data.get("id"), "data": data}
+
+
+def _default(value):
+    if isinstance(value, HTBObject):
+        return record(value)["data"]
+    return str(value)
+
+
+class JSONLSink:
+    """Writes crawled objects to a JSON lines file.
+
+    Objects written after the last checkpoint of an interrupted crawl are
+    written again when the crawl is resumed.
+    """
+
+    def __init__(self, path: str):
+        """Opens :path: for appending."""
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, obj: HTBObject):
+        """Writes an object to the file."""
+        self.file.write(json.dumps(record(obj), default=_default) + "\n")
+
+    def flush(self):
+        """Flushes written objects to disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """Flushes and closes the file."""
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteSink:
+    """Writes crawled objects to a SQLite database.
+
+    Objects are stored in the "objects" table keyed by type and id, so
+    objects that are written again replace their previous row.
+    """
+
+    def __init__(self, path: str):
+        """Opens or creates the database at :path:."""
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "type TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, "
+            "crawled REAL NOT NULL, PRIMARY KEY (type, id))")
+
+    def write(self, obj: HTBObject):
+        """Writes an object to the database."""
+        rec = record(obj)
+        self.db.execute(
+            "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)",
+            (rec["type"], str(rec["id"]),
+             json.dumps(rec["data"], default=_default), time.time()))
+
+    def flush(self):
+        """Commits written objects."""
+        self.db.commit()
+
+    def close(self):
+        """Commits written objects and closes the database."""
+        self.flush()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTBCrawler:
+    """Crawls the graph of HTB objects reachable from a set of seeds."""
+
+    def __init__(self, sink, workers: int = 4,
+                 priorities: Optional[Dict[str, int]] = None,
+                 checkpoint: Optional[str] = None,
+                 checkpointevery: int = 100,
+                 maxdepth: Optional[int] = None,
+                 expand: Callable[[HTBObject], Iterable[HTBObject]]
+                 = references):
+        """Initializes the crawler.
+
+        If :checkpoint: points to an existing checkpoint the crawl is
+        resumed from it.
+
+        Args:
+            sink: An object with write(obj) and flush() methods that
+                receives every crawled object.
+            workers: The maximum number of concurrent loads.
+            priorities: Overrides for the crawl priority of each class name.
+            checkpoint: The path to write checkpoints to.
+            checkpointevery: The number of crawled objects between
+                checkpoints.
+            maxdepth: The maximum number of references to follow from a
+                seed. Follows all references if None.
+            expand: A function returning the references of an object.
+        """
+        self.sink = sink
+        self.workers = workers
+        self.priorities = dict(defaultpriorities)
+        self.priorities.update(priorities or {})
+        self.checkpointpath = checkpoint
+        self.checkpointevery = checkpointevery
+        self.maxdepth = maxdepth
+        self.expand = expand
+        self.crawled = 0
+        self.failed = 0
+        self._frontier: List[tuple] = []
+        self._seen: Set[Tuple[str, str]] = set()
+        self._counter = itertools.count()
+        self._deadline = Deadline()
+        self._stopped = False
+        self._stoplock = threading.Lock()
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.restore(checkpoint)
+
+    def __len__(self) -> int:
+        """The number of objects waiting in the frontier."""
+        return len(self._frontier)
+
+    def add(self, obj: HTBObject, depth: int = 0) -> bool:
+        """Adds an object to the frontier unless it was already seen.
+
+        Args:
+            obj: The object to crawl.
+            depth: The number of references followed to reach the object.
+        Returns:
+            Whether the object was added.
+        """
+        kind = obj.__class__.__name__
+        if kind not in objectclasses:
+            raise HTBException(f"Can't crawl {kind} objects.")
+        key = (kind, str(obj.__dict__.get("id")))
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        data = {k: v for k, v in obj.__dict__.items()
+                if k != "isloaded" and not isinstance(v, HTBObject)}
+        self._push(kind, depth, data)
+        return True
+
+    def _push(self, kind: str, depth: int, data: dict):
+        priority = self.priorities.get(kind, max(self.priorities.values()) + 1)
+        heapq.heappush(self._frontier,
+                       (priority, depth, next(self._counter), kind, data))
+
+    def stop(self):
+        """Stops the crawl.
+
+        Loads in progress are cancelled at their next request and put back
+        in the frontier. If no crawl is running the next run stops right
+        away.
+        """
+        with self._stoplock:
+            self._stopped = True
+            self._deadline.cancel()
+
+    def _visit(self, kind: str, data: dict) -> HTBObject:
+        cls = objectclasses[kind]
+        obj = cls(dict(data))
+        if cls.objectendpoint is not None:
+            with session.deadline(self._deadline), \
+                    session.priority(Priority.BULK):
+                self._deadline.check()
+                obj.load()
+        return obj
+
+    def run(self, limit: Optional[int] = None,
+            deadline: Union[None, float, Deadline] = None) -> int:
+        """Crawls until the frontier is empty or the crawl is stopped.
+
+        Args:
+            limit: The maximum number of objects to crawl in this run.
+            deadline: The number of seconds, or Deadline, the run may take.
+        Returns:
+            The number of objects crawled in this run.
+        """
+        with self._stoplock:
+            if isinstance(deadline, Deadline):
+                self._deadline = Deadline(None, deadline)
+            else:
+                self._deadline = Deadline(deadline)
+            if self._stopped:
+                self._deadline.cancel()
+        crawled = 0
+        sincecheckpoint = 0
+        inflight: Dict[Future, tuple] = {}
+        with ThreadPoolExecutor(self.workers,
+                                thread_name_prefix="HTBCrawler") as pool:
+            try:
+                while self._frontier or inflight:
+                    while (self._frontier and len(inflight) < self.workers
+                           and not self._deadline.cancelled
+                           and not self._deadline.expired
+                           and (limit is None
+                                or crawled + len(inflight) < limit)):
+                        entry = heapq.heappop(self._frontier)
+                        future = pool.submit(self._visit, entry[3], entry[4])
+                        inflight[future] = entry
+                    if not inflight:
+                        break
+                    done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        entry = inflight.pop(future)
+                        if self._finish(future, entry):
+                            crawled += 1
+                            sincecheckpoint += 1
+                    if sincecheckpoint >= self.checkpointevery:
+                        self.save(inflight.values())
+                        sincecheckpoint = 0
+            finally:
+                for future in inflight:
+                    future.cancel()
+                self.save(inflight.values())
+                with self._stoplock:
+                    self._stopped = False
+        return crawled
+
+    def _finish(self, future: Future, entry: tuple) -> bool:
+        _, depth, _, kind, data = entry
+        try:
+            obj = future.result()
+        except (HTBTimeout, HTBCancelled):
+            heapq.heappush(self._frontier, entry)
+            return False
+        except Exception as e:
+            # Besides request errors a malformed payload can fail a load
+            # (ie. with a KeyError), which only fails this object.
+            logging.warning(f"Failed to crawl {kind} {data.get('id')}: {e}")
+            self.failed += 1
+            return False
+        refs = []
+        if self.maxdepth is None or depth < self.maxdepth:
+            try:
+                refs = list(self.expand(obj))
+            except Exception as e:
+                logging.warning(f"Failed to crawl references of {kind} "
+                                f"{data.get('id')}: {e}")
+                self.failed += 1
+                return False
+        self.sink.write(obj)
+        self.crawled += 1
+        for ref in refs:
+            if ref.__class__.__name__ in objectclasses:
+                self.add(ref, depth + 1)
+        return True
+
+    def save(self, inflight: Iterable[tuple] = (), path: Optional[str] = None):
+        """Writes a checkpoint of the crawl.
+
+        The sink is flushed first so every object the checkpoint counts as
+        crawled has been persisted.
+
+        Args:
+            inflight: Frontier entries that are still being loaded.
+            path: The path to write to. Defaults to the checkpoint path.
+        """
+        path = path or self.checkpointpath
+        if hasattr(self.sink, "flush"):
+            self.sink.flush()
+        if path is None:
+            return
+        frontier = list(self._frontier) + list(inflight)
+        state = {
+            "version": CHECKPOINTVERSION,
+            "crawled": self.crawled,
+            "failed": self.failed,
+            "seen": sorted(self._seen),
+            "frontier": [[depth, kind, data]
+                         for _, depth, _, kind, data in sorted(frontier)],
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def restore(self, path: str):
+        """Restores the crawl from a checkpoint.
+
+        Args:
+            path: The path of the checkpoint.
+        Raises:
+            HTBException: If the checkpoint can't be used.
+        """
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != CHECKPOINTVERSION:
+            raise HTBException(f"Unsupported checkpoint version in {path}")
+        self.crawled = state["crawled"]
+        self.failed = state["failed"]
+        self._seen = {tuple(key) for key in state["seen"]}
+        self._frontier = []
+        for depth, kind, data in state["frontier"]:
+            self._push(kind, depth, data)
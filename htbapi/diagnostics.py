@@ -0,0 +1,270 @@
+"""Contains a profiling mode for lazy loads.
+
+Accessing a missing attribute of a HTBObject loads it from the API, so the
+time spent on the request shows up in profiles as an ordinary attribute
+access. When diagnostics are enabled every such implicit load is recorded
+together with the code outside htbapi that triggered it, the endpoint it
+hit and how long it took. The report groups them by call site, which
+makes N+1 patterns (a load per item of a loop) easy to spot:
+
+    127 lazy HTBProfile loads from report.py:42 in render (4.21s, 33.1ms avg)
+
+Loops that are known to be hot can be marked with hotloop. In strict mode
+an implicit load inside a hot loop raises HTBImplicitLoad instead, so the
+objects have to be loaded beforehand, ie. with models.loadall.
+
+ie.
+    with diagnostics.profile() as profiler:
+        for machine in machines:
+            print(machine.maker.points)
+    print(profiler.report())
+"""
+
+import contextlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from .exceptions import HTBImplicitLoad
+
+Site = Tuple[str, int, str]
+
+_PACKAGE = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_CONTEXTLIB = os.path.abspath(contextlib.__file__)
+
+
+def callsite(skip: int = 1) -> Site:
+    """Returns the first frame of the call stack outside htbapi.
+
+    Args:
+        skip: The number of innermost frames to skip.
+    Returns:
+        The (filename, line number, function name) of the frame.
+    """
+
+    frame = sys._getframe(skip)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if not filename.startswith(_PACKAGE) and filename != _CONTEXTLIB:
+            return (frame.f_code.co_filename, frame.f_lineno,
+                    frame.f_code.co_name)
+        frame = frame.f_back
+    return ("<unknown>", 0, "<unknown>")
+
+
+def formatsite(site: Site) -> str:
+    """Formats a call site as file:line, relative to the working directory
+    if the file is below it."""
+
+    filename, lineno, _ = site
+    try:
+        relative = os.path.relpath(filename)
+    except ValueError:
+        relative = filename
+    if relative.startswith(".."):
+        relative = os.path.basename(filename)
+    return f"{relative}:{lineno}"
+
+
+class LoadSite:
+    """The implicit loads of one class triggered from one call site.
+
+    Attributes:
+        name (str): The name of the loaded class.
+        site (Site): The (filename, line number, function) of the caller.
+        endpoint (str): The endpoint the objects were loaded from.
+        count (int): The number of loads.
+        seconds (float): The total time spent loading.
+        maxseconds (float): The time of the slowest load.
+        ids (Set): The ids of the loaded objects.
+        hot (int): The number of loads inside hot loops.
+        errors (int): The number of loads that failed.
+    """
+
+    def __init__(self, name: str, site: Site, endpoint: Optional[str]):
+        self.name = name
+        self.site = site
+        self.endpoint = endpoint
+        self.count = 0
+        self.seconds = 0.0
+        self.maxseconds = 0.0
+        self.ids: Set[Any] = set()
+        self.hot = 0
+        self.errors = 0
+
+    def __str__(self) -> str:
+        avg = self.seconds / self.count * 1000 if self.count else 0.0
+        details = [f"{self.seconds:.2f}s", f"{avg:.1f}ms avg"]
+        if self.count > len(self.ids):
+            details.append(f"{self.count - len(self.ids)} repeated")
+        if self.hot:
+            details.append(f"{self.hot} in hot loops")
+        if self.errors:
+            details.append(f"{self.errors} failed")
+        return (f"{self.count} lazy {self.name} "
+                f"load{'s' if self.count != 1 else ''} from "
+                f"{formatsite(self.site)} in {self.site[2]} "
+                f"({', '.join(details)}) {self.endpoint or ''}").rstrip()
+
+
+class LoadProfiler:
+    """Records implicit loads by class and call site."""
+
+    def __init__(self, strict: bool = False):
+        """Initializes the profiler.
+
+        Args:
+            strict: Whether implicit loads inside hot loops raise.
+        """
+        self.strict = strict
+        self._sites: Dict[Tuple[str, Site], LoadSite] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, id: Any, site: Site,
+               endpoint: Optional[str], seconds: float, hot: bool,
+               failed: bool):
+        """Records an implicit load."""
+        with self._lock:
+            entry = self._sites.get((name, site))
+            if entry is None:
+                entry = self._sites[(name, site)] = LoadSite(
+                    name, site, endpoint)
+            entry.count += 1
+            entry.seconds += seconds
+            entry.maxseconds = max(entry.maxseconds, seconds)
+            entry.ids.add(id)
+            entry.hot += hot
+            entry.errors += failed
+
+    def sites(self) -> List[LoadSite]:
+        """Returns the recorded call sites, the most expensive first."""
+        with self._lock:
+            return sorted(self._sites.values(),
+                          key=lambda s: (s.seconds, s.count), reverse=True)
+
+    @property
+    def count(self) -> int:
+        """The total number of implicit loads recorded."""
+        return sum(site.count for site in self.sites())
+
+    @property
+    def seconds(self) -> float:
+        """The total time spent on implicit loads."""
+        return sum(site.seconds for site in self.sites())
+
+    def report(self, limit: Optional[int] = 20) -> str:
+        """Returns a summary of the implicit loads by call site.
+
+        Args:
+            limit: The maximum number of call sites to list.
+        """
+        sites = self.sites()
+        lines = [f"{self.count} implicit loads took {self.seconds:.2f}s "
+                 f"from {len(sites)} call sites"]
+        lines.extend(f"  {site}" for site in sites[:limit])
+        if limit is not None and len(sites) > limit:
+            lines.append(f"  ... {len(sites) - limit} more")
+        return "\n".join(lines)
+
+    def reset(self):
+        """Forgets every recorded load."""
+        with self._lock:
+            self._sites.clear()
+
+
+profiler: Optional[LoadProfiler] = None
+"""The profiler recording implicit loads, if diagnostics are enabled."""
+
+_local = threading.local()
+
+
+def enable(strict: bool = False) -> LoadProfiler:
+    """Starts recording implicit loads.
+
+    Args:
+        strict: Whether implicit loads inside hot loops raise.
+    Returns:
+        The new profiler.
+    """
+    global profiler
+    profiler = LoadProfiler(strict)
+    return profiler
+
+
+def disable():
+    """Stops recording implicit loads."""
+    global profiler
+    profiler = None
+
+
+@contextmanager
+def profile(strict: bool = False) -> Iterator[LoadProfiler]:
+    """Records the implicit loads made inside the block.
+
+    Args:
+        strict: Whether implicit loads inside hot loops raise.
+    Returns:
+        A context manager yielding the profiler.
+    """
+    global profiler
+    outer = profiler
+    current = enable(strict)
+    try:
+        yield current
+    finally:
+        profiler = outer
+
+
+@contextmanager
+def hotloop(label: Optional[str] = None) -> Iterator[None]:
+    """Marks the block as a hot loop for the current thread.
+
+    Implicit loads inside it are counted separately, or raise
+    HTBImplicitLoad if the profiler is strict.
+
+    ie.
+        machines = loadall(findmachines("a"))
+        with diagnostics.hotloop("table"):
+            rows = [(m.name, m.points) for m in machines]
+
+    Args:
+        label: A name for the loop, for debugging.
+    """
+    outer = getattr(_local, "hotloop", None)
+    _local.hotloop = label or "hotloop"
+    try:
+        yield
+    finally:
+        _local.hotloop = outer
+
+
+@contextmanager
+def _recording(obj, current: LoadProfiler, hot: bool) -> Iterator[None]:
+    name = type(obj).__name__
+    id = obj.__dict__.get("id")
+    site = callsite(2)
+    if hot and current.strict:
+        raise HTBImplicitLoad(name, id, formatsite(site))
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        current.record(name, id, site, obj.objectendpoint,
+                       time.perf_counter() - start, hot, failed)
+
+
+def implicitload(obj):
+    """Returns a context manager wrapping an implicit load of :obj:.
+
+    Does nothing unless diagnostics are enabled.
+    """
+    current = profiler
+    if current is None:
+        return contextlib.nullcontext()
+    hot = getattr(_local, "hotloop", None) is not None
+    return _recording(obj, current, hot)
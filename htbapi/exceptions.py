@@ -29,3 +29,30 @@ class HTBRequestException(HTBException):
         except Exception:
             message = "Could not parse error message."
         super().__init__(message)
+
+
+class HTBTimeout(HTBException):
+    def __init__(self):
+        super().__init__("The deadline for the request was exceeded")
+
+
+class HTBCancelled(HTBException):
+    def __init__(self):
+        super().__init__("The request was cancelled")
+
+
+class HTBCircuitOpen(HTBException):
+    def __init__(self, family, retryafter):
+        self.family = family
+        self.retryafter = retryafter
+        super().__init__(f"The circuit for /{family} endpoints is open, "
+                         f"retry in {retryafter:.1f}s")
+
+
+class HTBImplicitLoad(HTBException):
+    def __init__(self, name, id, site):
+        self.name = name
+        self.id = id
+        self.site = site
+        super().__init__(f"Implicit load of {name} {id} at {site} inside "
+                         f"a hot loop, load it beforehand with loadall")
@@ -0,0 +1,205 @@
+"""Contains a load driver for measuring how the client behaves under load.
+
+The driver runs a scenario from a number of concurrent callers and reports
+throughput, latency percentiles and error rates. By default it runs against
+a local MockHTBServer, so no requests are sent to HTB.
+
+ie.
+    python -m htbapi.loadtest --concurrency 1 10 100 --requests 2000 \\
+        --latency 0.02 --error-rate 503=0.01 --token-lifetime 5
+"""
+
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import htbapi
+from requests.adapters import HTTPAdapter
+
+from . import challenges, client, machines, profiles
+from .mockserver import MockHTBServer
+from .priority import RequestScheduler
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Returns the :fraction: percentile of sorted :values:."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+class LoadReport:
+    """The results of a load test run."""
+
+    def __init__(self, name: str, concurrency: int, duration: float,
+                 latencies: List[float], errors: Counter):
+        self.name = name
+        self.concurrency = concurrency
+        self.duration = duration
+        self.latencies = sorted(latencies)
+        self.errors = errors
+
+    @property
+    def total(self) -> int:
+        """The number of calls made."""
+        return len(self.latencies)
+
+    @property
+    def errorcount(self) -> int:
+        """The number of calls that failed."""
+        return sum(self.errors.values())
+
+    @property
+    def throughput(self) -> float:
+        """The number of calls completed per second."""
+        return self.total / self.duration if self.duration else 0.0
+
+    @property
+    def errorrate(self) -> float:
+        """The fraction of calls that failed."""
+        return self.errorcount / self.total if self.total else 0.0
+
+    def percentile(self, fraction: float) -> float:
+        """Returns a latency percentile in seconds."""
+        return percentile(self.latencies, fraction)
+
+    def __str__(self) -> str:
+        ms = {p: self.percentile(p) * 1000 for p in (0.5, 0.9, 0.99, 1.0)}
+        lines = [
+            f"{self.name} x{self.concurrency}: {self.total} calls in "
+            f"{self.duration:.2f}s, {self.throughput:.1f} calls/s",
+            f"  latency ms: p50 {ms[0.5]:.1f}  p90 {ms[0.9]:.1f}  "
+            f"p99 {ms[0.99]:.1f}  max {ms[1.0]:.1f}",
+            f"  errors: {self.errorcount} ({self.errorrate:.2%})",
+        ]
+        for error, count in self.errors.most_common():
+            lines.append(f"    {count:>6}  {error}")
+        return "\n".join(lines)
+
+
+def run(call: Callable[[int], object], concurrency: int, requests: int,
+        name: str = "load") -> LoadReport:
+    """Runs :call: :requests: times from :concurrency: threads.
+
+    Args:
+        call: The function to measure. It is called with the call number.
+        concurrency: The number of concurrent callers.
+        requests: The total number of calls.
+        name: The name of the scenario for the report.
+    Returns:
+        The LoadReport of the run.
+    """
+
+    latencies: List[float] = []
+    errors: Counter = Counter()
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def caller():
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            start = time.perf_counter()
+            error = None
+            try:
+                call(n)
+            except Exception as e:
+                error = f"{e.__class__.__name__}: {e}"
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if error is not None:
+                    errors[error] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(caller) for _ in range(concurrency)]:
+            future.result()
+    return LoadReport(name, concurrency, time.perf_counter() - start,
+                      latencies, errors)
+
+
+def scenarios(count: int) -> Dict[str, Callable[[int], object]]:
+    """Returns the built in scenarios for objects with ids up to :count:."""
+
+    def ids(n: int) -> int:
+        return random.randint(1, count)
+
+    return {
+        "get": lambda n: htbapi.session.get("/user/info"),
+        "findmachines": lambda n: machines.findmachines(f"Machine{ids(n)}"),
+        "findprofiles": lambda n: profiles.findprofiles(f"user{ids(n)}"),
+        "loadmachine":
+            lambda n: machines.HTBMachine({"id": ids(n)}).load(),
+        "loadchallenge":
+            lambda n: challenges.HTBChallenge({"id": ids(n)}).load(),
+        "loadprofile": lambda n: profiles.HTBProfile({"id": ids(n)}).load(),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Load test htbapi against a local mock HTB API.")
+    parser.add_argument("--scenario", nargs="+", default=["loadmachine"],
+                        help="The scenarios to run: get, findmachines, "
+                             "findprofiles, loadmachine, loadchallenge, "
+                             "loadprofile")
+    parser.add_argument("--concurrency", nargs="+", type=int,
+                        default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Server latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Maximum random latency added in seconds.")
+    parser.add_argument("--error-rate", action="append", default=[],
+                        metavar="CODE=RATE",
+                        help="Inject status CODE with probability RATE.")
+    parser.add_argument("--token-lifetime", type=float, default=None,
+                        help="Seconds until access tokens expire.")
+    parser.add_argument("--otp", default=None,
+                        help="Require this one time password after login.")
+    parser.add_argument("--count", type=int, default=1000,
+                        help="The number of mocked objects of each type.")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="Connection pool size of the shared session. "
+                             "Uses the requests default if not set.")
+    parser.add_argument("--max-inflight", type=int, default=0,
+                        help="Requests the shared session sends at once. "
+                             "0, the default, disables the limit.")
+    args = parser.parse_args(argv)
+
+    errorrates = {}
+    for spec in args.error_rate:
+        code, _, rate = spec.partition("=")
+        errorrates[int(code)] = float(rate)
+
+    with MockHTBServer(latency=args.latency, jitter=args.jitter,
+                       errorrates=errorrates,
+                       tokenlifetime=args.token_lifetime, otp=args.otp,
+                       count=args.count) as server:
+        client.BASEURL = server.baseurl
+        if args.pool_size is not None:
+            adapter = HTTPAdapter(pool_connections=args.pool_size,
+                                  pool_maxsize=args.pool_size)
+            htbapi.session.mount("http://", adapter)
+        if args.max_inflight > 0:
+            htbapi.session.scheduler = RequestScheduler(args.max_inflight)
+        htbapi.initialize(server.email, server.password, args.otp)
+        available = scenarios(args.count)
+        for name in args.scenario:
+            for concurrency in args.concurrency:
+                print(run(available[name], concurrency, args.requests, name))
+        print("server responses:")
+        for (method, endpoint, code), count in sorted(server.stats.items()):
+            print(f"  {count:>6}  {code} {method} {endpoint}")
+
+
+if __name__ == "__main__":
+    main()
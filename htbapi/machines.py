@@ -5,12 +5,37 @@ on HTB.
 """
 
 
-from . import session
-from .models import HTBObject
+from . import prefetch, session
+from .models import HTBObject, HTBReference
+from .profiles import HTBProfile
 from typing import List, Optional
 import json
 
 
+class MachineBlood(HTBObject):
+    """The first blood of a machine.
+
+    Attributes:
+        user (HTBProfile): The profile of the user who got the blood.
+        blood_difference (str): The time from release it took to get blood.
+    """
+
+    user = HTBReference(HTBProfile)
+
+
+class LiveMachineInfo(HTBObject):
+    """The live info of a machine.
+
+    Attributes:
+        isSpawned (bool): Whether the machine is spawned.
+        isSpawning (bool): Whether the machine is spawning.
+        isActive (bool): Whether the machine is active for the user.
+        active_player_count (int): The number of players on the machine.
+        expires_at (str): When the machine instance expires.
+    """
+    pass
+
+
 class HTBMachine(HTBObject):
     """A machine on HTB
     
@@ -53,6 +78,12 @@ class HTBMachine(HTBObject):
     objectendpoint = "/machine/profile/"
     objectkey = "info"
 
+    playInfo = HTBReference(LiveMachineInfo)
+    maker = HTBReference(HTBProfile)
+    maker2 = HTBReference(HTBProfile)
+    userBlood = HTBReference(MachineBlood)
+    rootBlood = HTBReference(MachineBlood)
+
 def findmachines(name: str) -> List[HTBMachine]:
     """Searches for machines matchine :name.
 
@@ -70,6 +101,7 @@ def findmachines(name: str) -> List[HTBMachine]:
     results = resp.json()
     searchresults = results["machines"] if "machines" in results else []
     matches = [HTBMachine(res) for res in searchresults]
+    prefetch.results(matches)
     return matches
 
 def findmachine(name: str) -> Optional[HTBMachine]:
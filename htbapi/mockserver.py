@@ -0,0 +1,419 @@
+"""Contains a local mock of the HTB API for testing and load testing.
+
+The MockHTBServer implements the endpoints used by this library on top of
+generated machines, challenges and profiles. Latency, error responses and
+token expiry can be injected to see how clients behave under load.
+
+ie.
+    with MockHTBServer(latency=0.05, errorrates={500: 0.01}) as server:
+        htbapi.client.BASEURL = server.baseurl
+        htbapi.initialize(server.email, server.password)
+"""
+
+import base64
+import json
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Match, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+APIPREFIX = "/api/v4"
+
+
+def maketoken(lifetime: Optional[float]) -> str:
+    """Returns a random JWT shaped token that expires after :lifetime:."""
+
+    def encode(value: dict) -> str:
+        data = json.dumps(value).encode()
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+    claims = {"jti": secrets.token_hex(16), "iat": int(time.time())}
+    if lifetime is not None:
+        claims["exp"] = int(time.time() + lifetime)
+    header = encode({"typ": "JWT", "alg": "none"})
+    return f"{header}.{encode(claims)}.{secrets.token_urlsafe(16)}"
+
+
+def machine(i: int) -> dict:
+    """Returns the generated machine with id :i:."""
+    return {
+        "id": i, "name": f"Machine{i}",
+        "os": ["Linux", "Windows", "FreeBSD", "OpenBSD"][i % 4],
+        "active": i % 5 == 0, "retired": i % 5 != 0,
+        "points": [20, 30, 40, 50][i % 4], "static_points": 20,
+        "release": f"20{10 + i % 10}-0{1 + i % 9}-1{i % 10}T19:00:00.000000Z",
+        "user_owns_count": i * 13 % 5000, "root_owns_count": i * 7 % 4000,
+        "free": i % 3 == 0, "stars": round(3 + (i % 20) / 10, 1),
+        "difficulty": i % 100, "avatar": f"/storage/avatars/m{i}.png",
+        "difficultyText": ["Easy", "Medium", "Hard", "Insane"][i % 4],
+        "last_reset_time": "1 hour ago",
+        "playInfo": {"isSpawned": None, "isSpawning": None,
+                     "isActive": None, "active_player_count": i % 30,
+                     "expires_at": None},
+        "maker": {"id": i % 50 + 1, "name": f"user{i % 50 + 1}",
+                  "avatar": None, "isRespected": False},
+        "maker2": None,
+        "userBlood": {"user": {"id": i % 37 + 1, "name": f"user{i % 37 + 1}",
+                               "avatar": None},
+                      "blood_difference": "1H 2M 3S"},
+        "rootBlood": {"user": {"id": i % 41 + 1, "name": f"user{i % 41 + 1}",
+                               "avatar": None},
+                      "blood_difference": "2H 3M 4S"},
+        "userBloodAvatar": None, "rootBloodAvatar": None,
+        "recommended": 0,
+    }
+
+
+def challenge(i: int) -> dict:
+    """Returns the generated challenge with id :i:."""
+    return {
+        "id": i, "name": f"Challenge{i}", "retired": i % 4 != 0,
+        "difficulty": ["Easy", "Medium", "Hard", "Insane"][i % 4],
+        "points": [10, 20, 30, 40][i % 4], "solves": i * 11 % 3000,
+        "likes": i % 90, "dislikes": i % 7, "description": "A challenge.",
+        "category_name": ["Web", "Crypto", "Pwn", "Reversing",
+                          "Forensics"][i % 5],
+        "first_blood_user": f"user{i % 43 + 1}",
+        "first_blood_user_id": i % 43 + 1,
+        "first_blood_time": "1H 2M", "first_blood_user_avatar": None,
+        "creator_id": i % 50 + 1, "creator_name": f"user{i % 50 + 1}",
+        "creator_avatar": None, "isRespected": False, "download": True,
+        "sha256": "0" * 64, "docker": i % 2 == 0, "docker_port": None,
+        "release_date": f"20{10 + i % 10}-0{1 + i % 9}-1{i % 10}",
+        "likeByAuthUser": False, "dislikeByAuthUser": False,
+        "isTodo": False, "recommended": 0,
+    }
+
+
+def profile(i: int) -> dict:
+    """Returns the generated profile with id :i:."""
+    return {
+        "id": i, "name": f"user{i}", "timezone": "UTC", "isVip": i % 2 == 0,
+        "avatar": None, "points": i * 17 % 900, "system_owns": i % 200,
+        "user_owns": i % 220, "system_bloods": i % 5, "user_bloods": i % 6,
+        "respects": i % 40, "country_name": "United Kingdom",
+        "country_code": "GB",
+        "team": {"id": i % 10 + 1, "name": f"team{i % 10 + 1}",
+                 "ranking": i % 10 + 1, "avatar": None},
+        "university_name": None, "description": None, "github": None,
+        "linkedin": None, "twitter": None, "website": None,
+        "isRespected": False, "isFollowed": False, "rank": "Hacker",
+        "rank_id": 4, "current_rank_progress": 10.0,
+        "next_rank": "Pro Hacker", "next_rank_points": 40.0,
+        "rank_ownership": "20.0", "rank_requirement": 15, "ranking": i,
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "MockHTBServer"
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.dispatch(self, "GET")
+
+    def do_POST(self):
+        self.server.dispatch(self, "POST")
+
+    def reply(self, code: int, body: dict,
+              headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        try:
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out or went away before the reply.
+            self.close_connection = True
+
+
+Route = Callable[[_Handler, Match, dict], Tuple[int, dict]]
+
+
+class MockHTBServer(ThreadingHTTPServer):
+    """A local HTTP server mocking the HTB API."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0,
+                 errorrates: Optional[Dict[int, float]] = None,
+                 tokenlifetime: Optional[float] = None,
+                 otp: Optional[str] = None, count: int = 1000,
+                 email: str = "user@example.com",
+                 password: str = "password", seed: Optional[int] = None):
+        """Initializes the server.
+
+        Args:
+            port: The port to listen on. A free port is picked if 0.
+            latency: The number of seconds to wait before every response.
+            jitter: The maximum number of random seconds added to latency.
+            errorrates: The probability of each request failing with a
+                status code. ie. {401: 0.01, 429: 0.05, 503: 0.01}
+            tokenlifetime: The number of seconds access tokens are valid
+                for. Tokens never expire if None.
+            otp: The one time password to require after logging in.
+                Two factor authentication is disabled if None.
+            count: The number of machines, challenges and profiles.
+            email: The email that can log in.
+            password: The password that can log in.
+            seed: The seed for the random fault injection.
+        """
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.errorrates = dict(errorrates or {})
+        self.tokenlifetime = tokenlifetime
+        self.otp = otp
+        self.count = count
+        self.email = email
+        self.password = password
+        self.random = random.Random(seed)
+        self.stats: Counter = Counter()
+        self._tokens: Dict[str, Tuple[Optional[float], bool]] = {}
+        self._refreshtokens: Dict[str, str] = {}
+        self.toggled: Set[Tuple[str, int]] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._names: Dict[str, List[Tuple[int, str, Optional[str]]]] = {
+            tag: [(item["id"], item["name"], item.get("avatar"))
+                  for item in map(generator, range(1, count + 1))]
+            for tag, generator in (("machines", machine),
+                                   ("challenges", challenge),
+                                   ("users", profile))}
+        self._names["teams"] = [(i, f"team{i}", None) for i in range(1, 11)]
+        self.routes: Dict[Tuple[str, str], tuple] = {}
+        for method, pattern, route, public in (
+                ("POST", r"/login", self.login, True),
+                ("POST", r"/login/refresh", self.refresh, True),
+                ("POST", r"/2fa/login", self.twofactor, None),
+                ("POST", r"/logout", self.logout, None),
+                ("GET", r"/search/fetch", self.search, False),
+                ("GET", r"/machine/profile/(\d+)", self.machine, False),
+                ("GET", r"/challenge/info/(\d+)", self.challenge, False),
+                ("GET", r"/user/profile/basic/(\d+)", self.profile, False),
+                ("GET", r"/user/info", self.userinfo, False),
+                ("POST", r"/(user/respect|user/follow|challenge/todo/update"
+                         r"|challenge/like)/(\d+)", self.toggle, False)):
+            self.route(method, pattern, route, public)
+
+    @property
+    def baseurl(self) -> str:
+        """The URL to use as htbapi.client.BASEURL."""
+        return f"http://127.0.0.1:{self.server_port}{APIPREFIX}"
+
+    def route(self, method: str, pattern: str, route: Route,
+              public: Optional[bool] = False):
+        """Registers a handler for an endpoint.
+
+        Args:
+            method: The HTTP method.
+            pattern: A regex the full endpoint path must match.
+            route: A function taking the request handler, the match and the
+                JSON body and returning a status code and a JSON response.
+            public: Whether the endpoint can be used without a token.
+                None if a token is required but it doesn't need to have
+                completed two factor authentication.
+        """
+        self.routes[(method, pattern)] = (re.compile(pattern + "$"),
+                                          route, public)
+
+    def start(self) -> "MockHTBServer":
+        """Starts serving in a background daemon thread."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="MockHTBServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        """Ignores clients that disconnect, reports other errors."""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def __enter__(self) -> "MockHTBServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def issuetokens(self, has2fa: bool) -> dict:
+        """Creates a new access and refresh token pair."""
+        access = maketoken(self.tokenlifetime)
+        refresh = secrets.token_hex(32)
+        expires = None if self.tokenlifetime is None \
+            else time.time() + self.tokenlifetime
+        with self._lock:
+            self._tokens[access] = (expires, has2fa)
+            self._refreshtokens[refresh] = access
+        return {"access_token": access, "refresh_token": refresh,
+                "is2FAEnabled": self.otp is not None}
+
+    def authorize(self, handler: _Handler,
+                  needs2fa: bool = False) -> Optional[str]:
+        """Returns the valid access token of a request, if any.
+
+        Args:
+            handler: The request handler.
+            needs2fa: Whether the token must have completed two factor
+                authentication if it is enabled.
+        """
+        header = handler.headers.get("Authorization", "")
+        token = header[len("Bearer "):] if header.startswith("Bearer ") \
+            else None
+        with self._lock:
+            state = self._tokens.get(token)
+        if state is None:
+            return None
+        expires, has2fa = state
+        if expires is not None and time.time() >= expires:
+            return None
+        if needs2fa and self.otp is not None and not has2fa:
+            return None
+        return token
+
+    def dispatch(self, handler: _Handler, method: str):
+        url = urlparse(handler.path)
+        path = url.path[len(APIPREFIX):] \
+            if url.path.startswith(APIPREFIX) else url.path
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = None
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if not isinstance(body, dict):
+            code, response = 400, {"message": "Invalid JSON body."}
+        else:
+            body["query"] = {k: v[-1] for k, v in
+                             parse_qs(url.query).items()}
+            for (routemethod, _), (regex, route, public) in \
+                    self.routes.items():
+                match = regex.match(path)
+                if match is None or routemethod != method:
+                    continue
+                code, response = self.inject(bool(public))
+                if code is None:
+                    if not public and self.authorize(
+                            handler, public is not None) is None:
+                        code, response = 401, {"message": "Unauthenticated."}
+                    else:
+                        code, response = route(handler, match, body)
+                break
+            else:
+                code, response = 404, {"message": "Not Found"}
+        endpoint = path.rsplit("/", 1)[0] if path[-1:].isdigit() else path
+        with self._lock:
+            self.stats[(method, endpoint, code)] += 1
+        headers = {"Retry-After": "1"} if code == 429 else {}
+        handler.reply(code, response, headers)
+
+    def inject(self, public: bool) -> Tuple[Optional[int], dict]:
+        """Picks an injected error for a request, if any."""
+        for code, rate in self.errorrates.items():
+            if code == 401 and public:
+                continue
+            if self.random.random() < rate:
+                messages = {401: "Unauthenticated.",
+                            429: "Too Many Attempts."}
+                return code, {"message": messages.get(code, "Server Error")}
+        return None, {}
+
+    def login(self, handler, match, body):
+        if body.get("email") != self.email \
+                or body.get("password") != self.password:
+            return 401, {"message": "Invalid credentials."}
+        return 200, {"message": self.issuetokens(False)}
+
+    def refresh(self, handler, match, body):
+        with self._lock:
+            old = self._refreshtokens.pop(body.get("refresh_token"), None)
+            state = self._tokens.pop(old, None)
+        if old is None:
+            return 401, {"message": "Invalid refresh token."}
+        return 200, {"message": self.issuetokens(state[1] if state else False)}
+
+    def twofactor(self, handler, match, body):
+        if self.otp is None or body.get("one_time_password") != self.otp:
+            return 400, {"message": "Invalid one time password."}
+        token = self.authorize(handler)
+        with self._lock:
+            state = self._tokens.get(token)
+            if state is None:
+                return 401, {"message": "Unauthenticated."}
+            self._tokens[token] = (state[0], True)
+        return 200, {"message": "Two factor authentication successful."}
+
+    def logout(self, handler, match, body):
+        with self._lock:
+            self._tokens.pop(self.authorize(handler), None)
+        return 200, {"message": "Logged out."}
+
+    def search(self, handler, match, body):
+        query = body["query"].get("query", "").lower()
+        try:
+            tags = json.loads(body["query"].get("tags", "[]"))
+        except ValueError:
+            return 400, {"error": "Failed to parse tags."}
+        results = {}
+        for tag in tags:
+            if tag not in self._names:
+                continue
+            results[tag] = [{"id": i, "value": name, "avatar": avatar}
+                            for i, name, avatar in self._names[tag]
+                            if query in name.lower()][:100]
+        return 200, results
+
+    def _lookup(self, match, generator, key):
+        i = int(match.group(1))
+        if not 1 <= i <= self.count:
+            return 404, {"message": f"{key} not found"}
+        return 200, {key: generator(i)}
+
+    def machine(self, handler, match, body):
+        return self._lookup(match, machine, "info")
+
+    def challenge(self, handler, match, body):
+        return self._lookup(match, challenge, "challenge")
+
+    def profile(self, handler, match, body):
+        return self._lookup(match, profile, "profile")
+
+    def toggle(self, handler, match, body):
+        key = (match.group(1), int(match.group(2)))
+        with self._lock:
+            self.toggled ^= {key}
+        return 200, {"message": "Toggled."}
+
+    def userinfo(self, handler, match, body):
+        info = profile(1)
+        return 200, {"info": {
+            "id": 1, "name": info["name"], "email": self.email,
+            "timezone": "UTC", "isVip": True, "canAccessVIP": True,
+            "isServerVIP": False, "server_id": 1, "avatar": None}}
@@ -4,13 +4,58 @@ This module contains various classes and methods for working with HTB data.
 """
 
 import logging
-from typing import Any, Optional
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, Union
+from . import diagnostics
+from .client import Deadline
 from .exceptions import HTBException
 import htbapi
 
 class HTBObjectLoadFailed(HTBException):
     pass
 
+_loading: "weakref.WeakKeyDictionary[HTBObject, threading.Event]" = \
+    weakref.WeakKeyDictionary()
+"""The objects that are being loaded, and an event set when they are."""
+_loadinglock = threading.Lock()
+
+def parsetimestamp(value: Any) -> Optional[datetime]:
+    """Parses a date or timestamp returned from the API.
+
+    The API returns dates in a few different formats,
+    ie. "2020-07-22" or "2020-07-25T19:00:00.000000Z".
+    Timestamps without timezone info are assumed to be UTC.
+
+    Args:
+        value: The value to parse.
+    Returns:
+        An aware datetime or None if the value can't be parsed.
+    """
+
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str) and value:
+        text = value.strip().replace("Z", "+00:00").replace(" ", "T", 1)
+        if "." in text:
+            # fromisoformat only accepts 3 or 6 digits of fractional seconds.
+            head, _, tail = text.partition(".")
+            digits = ""
+            while tail and tail[0].isdigit():
+                digits, tail = digits + tail[0], tail[1:]
+            text = f"{head}.{digits[:6].ljust(6, '0')}{tail}"
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    else:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
 class DifficultyChart:
     """An object representing a difficulty chart.
 
@@ -48,19 +93,53 @@ class HTBObject:
                             or if an object can't be loaded.
         """
 
-        if self.objectendpoint is not None and not self.isloaded:
+        if name.startswith("__") and name.endswith("__"):
+            # Special lookups (ie. by pickle or copy) must never load.
+            raise AttributeError(name)
+        self._implicitload()
+        return self.__getattribute__(name)
+
+    def __getstate__(self) -> dict:
+        """Returns the values of this object for pickling."""
+
+        return dict(self.__dict__)
+
+    def __setstate__(self, state: dict):
+        """Restores the values of this object when unpickling."""
+
+        self.__dict__.update(state)
+
+    def _implicitload(self):
+        """Loads the object because a missing attribute was accessed."""
+
+        if self.objectendpoint is not None \
+                and not self.__dict__.get("isloaded", False):
             try:
-                logging.debug(
-                    f"Loading [{self.__class__.__name__}]: {self.id}")
-                self.load()
+                logging.debug(f"Loading [{self.__class__.__name__}]: "
+                              f"{self.__dict__.get('id')}")
+                with diagnostics.implicitload(self):
+                    self.load()
             except AttributeError:
                 """Fail silently. 
                 An AttributeError will be raised by __getattribute__.
                 """
 
                 pass
-        
-        return self.__getattribute__(name)
+
+    def references(self) -> List["HTBObject"]:
+        """Returns the nested objects referenced by this object.
+
+        Only references that are already present on the object are returned
+        so calling this never triggers a load.
+
+        Returns:
+            A list of the referenced objects.
+        """
+
+        return [attr.__get__(self, type(self))
+                for attr in _referencesof(type(self))
+                if isinstance(self.__dict__.get(attr.name),
+                              (dict, HTBObject))]
 
     @classmethod
     def fromname(cls, name):
@@ -80,24 +159,50 @@ class HTBObject:
 
         raise NotImplementedError()
 
-    def load(self, force=False):
+    def load(self, force=False, wait=True):
         """Loads this objects properties from the API.
 
         Loads all missing properties from the API if not already loaded.
         If force=True then it will reload from the API even if isloaded=True.
         Object id must already be set at the very minimum.
+        If another thread is already loading the object the call waits for
+        that load instead of sending another request.
 
         Args:
             force: Whether to force load from the API even if already loaded.
+            wait: Whether to wait for another thread loading the object.
+                If False the call returns without loading it instead.
         Raises:
             HTBObjectLoadFailed: If the object can't be loaded.
+            HTBTimeout: If the current deadline passes while waiting for
+                another thread loading the object.
         """
 
         if self.objectendpoint is None and self.objectkey is None:
             msg = (f"Couldn't load {self.__class__.__name__}. "
                    f"{self.__class__.__name__} is not configured.")
             raise HTBObjectLoadFailed(msg)
-        if not self.isloaded or force:
+        if self.isloaded and not force:
+            return
+        done = None
+        if not force:
+            # If another thread (ie. a prefetch) is already loading this
+            # object wait for it instead of sending the same request.
+            with _loadinglock:
+                pending = _loading.get(self)
+                if pending is None:
+                    done = _loading[self] = threading.Event()
+            if pending is not None:
+                if not wait:
+                    return
+                deadline = htbapi.session.currentdeadline
+                while not pending.wait(0.1):
+                    if deadline is not None:
+                        deadline.check()
+                if self.isloaded:
+                    return
+                return self.load(wait=wait)
+        try:
             endpoint = self.objectendpoint + str(self.id)
             resp = htbapi.session.get(endpoint)
             result = resp.json()
@@ -105,3 +210,146 @@ class HTBObject:
             self.__dict__.update(obj)
             self.isloaded = True
             logging.debug(f"After loading: {self.__dict__}")
+        finally:
+            if done is not None:
+                with _loadinglock:
+                    _loading.pop(self, None)
+                done.set()
+
+
+class HTBReference:
+    """A lazily hydrated reference to a nested object.
+
+    The API returns related objects (ie. the maker of a machine) as nested
+    dicts. Declaring a field as a HTBReference on a HTBObject subclass keeps
+    the raw dict untouched in the object's values, and only wraps it in
+    :cls: the first time the field is accessed. The wrapped object is cached
+    until the raw value changes, ie. when the parent object is reloaded.
+
+    ie.
+        class HTBMachine(HTBObject):
+            maker = HTBReference(HTBProfile)
+    """
+
+    _cache: "weakref.WeakKeyDictionary[HTBObject, Dict[str, tuple]]" = \
+        weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+
+    def __init__(self, cls: Type[HTBObject]):
+        """Initializes the reference.
+
+        Args:
+            cls: The HTBObject subclass to wrap nested values with.
+        """
+        self.cls = cls
+        self.name: Optional[str] = None
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, obj: Optional[HTBObject], owner=None) -> Any:
+        if obj is None:
+            return self
+        if self.name not in obj.__dict__:
+            obj._implicitload()
+            if self.name not in obj.__dict__:
+                raise AttributeError(
+                    f"'{type(obj).__name__}' object has no attribute "
+                    f"'{self.name}'")
+        raw = obj.__dict__[self.name]
+        if not isinstance(raw, dict):
+            return raw
+        with self._lock:
+            cached = self._cache.setdefault(obj, {})
+            entry = cached.get(self.name)
+            if entry is None or entry[0] is not raw:
+                entry = (raw, self.cls(dict(raw)))
+                cached[self.name] = entry
+            return entry[1]
+
+    def __set__(self, obj: HTBObject, value: Any):
+        obj.__dict__[self.name] = value
+
+    def __delete__(self, obj: HTBObject):
+        del obj.__dict__[self.name]
+
+
+def _referencesof(cls: type) -> List[HTBReference]:
+    """Returns the HTBReference fields declared on :cls: and its bases."""
+
+    found = {}
+    for klass in reversed(cls.__mro__):
+        for name, attr in vars(klass).items():
+            if isinstance(attr, HTBReference):
+                found[name] = attr
+    return list(found.values())
+
+
+def objectkey(obj: HTBObject) -> Tuple[str, Any]:
+    """Returns a key that identifies an object across instances."""
+    return (obj.__class__.__name__, obj.__dict__.get("id"))
+
+
+def loadall(objects: Iterable[HTBObject], workers: int = 8,
+            force: bool = False,
+            deadline: Union[None, float, Deadline] = None) -> List[HTBObject]:
+    """Loads many objects concurrently.
+
+    Objects of the same class with the same id are only loaded once, the
+    loaded values are then shared with the other instances.
+    Objects without an objectendpoint, and objects that are already loaded
+    unless :force: is set, are skipped. If a load fails the error is raised
+    and the loads that haven't started yet are cancelled.
+    The loads are sent with the priority of the calling thread.
+
+    Args:
+        objects: The objects to load. ie. [m.maker for m in machines]
+        workers: The maximum number of concurrent loads.
+        force: Whether to reload objects that are already loaded.
+        deadline: The number of seconds, or Deadline, all loads may take.
+    Returns:
+        The objects in the order they were given.
+    Raises:
+        HTBException: If a load fails.
+        HTBRequestException: If a request fails.
+        HTBTimeout: If the deadline passes.
+        HTBCancelled: If the deadline is cancelled.
+    """
+
+    objects = list(objects)
+    groups: Dict[tuple, List[HTBObject]] = {}
+    for obj in objects:
+        if obj.objectendpoint is None or (obj.isloaded and not force):
+            continue
+        key = (type(obj), obj.__dict__.get("id"))
+        groups.setdefault(key, []).append(obj)
+    if not groups:
+        return objects
+
+    if isinstance(deadline, Deadline):
+        batch = Deadline(None, deadline)
+    else:
+        batch = Deadline(deadline, htbapi.session.currentdeadline)
+
+    priority = htbapi.session.currentpriority
+
+    def loadgroup(group: List[HTBObject]):
+        with htbapi.session.deadline(batch), \
+                htbapi.session.priority(priority):
+            batch.check()
+            first = group[0]
+            first.load(force=force)
+        for other in group[1:]:
+            other.__dict__.update(first.__dict__)
+
+    with ThreadPoolExecutor(min(workers, len(groups))) as pool:
+        futures = [pool.submit(loadgroup, g) for g in groups.values()]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            batch.cancel()
+            for future in futures:
+                future.cancel()
+            raise
+    return objects
@@ -0,0 +1,277 @@
+"""Contains a queue for applying many write actions at once.
+
+The HTB API exposes the user's relations to objects (respecting and
+following users, liking challenges and marking them as todo) as toggle
+endpoints. The MutationQueue collects the desired state of these flags for
+many objects, collapses repeated changes of the same flag into one, skips
+flags that already have the desired value and applies the rest
+concurrently under a request budget. Applied changes are written back to
+the objects, so they don't need to be reloaded.
+
+Objects whose current value of a flag isn't known (ie. search results) are
+loaded when the queue is flushed, and those loads are counted against the
+budget as well. Queueing never sends a request.
+
+ie.
+    queue = MutationQueue(budget=2)
+    for profile in findprofiles("ippsec"):
+        queue.set(profile, "isFollowed", True)
+    for result in queue.flush():
+        print(result)
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+
+from . import session
+from .challenges import HTBChallenge
+from .client import Deadline
+from .exceptions import HTBException, HTBTimeout
+from .models import HTBObject, objectkey
+from .priority import Priority
+from .profiles import HTBProfile
+from .ratelimit import TokenBucket
+
+TOGGLES: Dict[Tuple[Type[HTBObject], str], str] = {
+    (HTBProfile, "isRespected"): "/user/respect/{id}",
+    (HTBProfile, "isFollowed"): "/user/follow/{id}",
+    (HTBChallenge, "isTodo"): "/challenge/todo/update/{id}",
+    (HTBChallenge, "likeByAuthUser"): "/challenge/like/{id}",
+}
+"""The endpoints toggling a flag, keyed by object class and field."""
+
+COUNTERS: Dict[Tuple[Type[HTBObject], str], str] = {
+    (HTBProfile, "isRespected"): "respects",
+    (HTBChallenge, "likeByAuthUser"): "likes",
+}
+"""The counters that change together with a flag."""
+
+APPLIED = "applied"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+
+def toggleendpoint(obj: HTBObject, field: str) -> str:
+    """Returns the endpoint toggling :field: of :obj:.
+
+    Raises:
+        HTBException: If the field can't be changed.
+    """
+    for cls in type(obj).__mro__:
+        endpoint = TOGGLES.get((cls, field))
+        if endpoint is not None:
+            return endpoint.format(id=obj.__dict__.get("id"))
+    raise HTBException(
+        f"{field} of {type(obj).__name__} objects can't be changed")
+
+
+class MutationResult:
+    """The outcome of a mutation.
+
+    Attributes:
+        objects (List[HTBObject]): The instances that were updated.
+        field (str): The changed field.
+        value (bool): The desired value, None if a toggle failed before
+            the current value was known.
+        status (str): APPLIED, UNCHANGED or FAILED.
+        error (Exception): Why the mutation failed, if it did.
+    """
+
+    def __init__(self, objects: List[HTBObject], field: str,
+                 value: Optional[bool], status: str,
+                 error: Optional[Exception] = None):
+        self.objects = objects
+        self.field = field
+        self.value = value
+        self.status = status
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        """Whether the field has the desired value."""
+        return self.status != FAILED
+
+    def __repr__(self) -> str:
+        obj = self.objects[0]
+        name = obj.__dict__.get("name", obj.__dict__.get("id"))
+        error = f" ({self.error})" if self.error is not None else ""
+        return (f"<{type(obj).__name__} {name} {self.field}={self.value}: "
+                f"{self.status}{error}>")
+
+
+class _Mutation:
+    __slots__ = ("objects", "field", "value")
+
+    def __init__(self, obj: HTBObject, field: str, value: Optional[bool]):
+        # A value of None flips the current value, which is only looked up
+        # when the mutation is applied.
+        self.objects = [obj]
+        self.field = field
+        self.value = value
+
+
+class MutationQueue:
+    """Collects flag changes and applies them in bulk."""
+
+    def __init__(self, budget: float = 2.0, burst: Optional[float] = None,
+                 workers: int = 4, bucket: Optional[TokenBucket] = None,
+                 priority: Priority = Priority.BULK):
+        """Initializes the queue.
+
+        Args:
+            budget: The maximum number of requests per second.
+            burst: The number of requests that may be sent at once.
+                Defaults to :budget:.
+            workers: The number of requests sent concurrently.
+            bucket: A TokenBucket to share with other components.
+                Overrides :budget: and :burst: if given.
+            priority: The priority class of the requests.
+        """
+        self.bucket = bucket or TokenBucket(budget, burst)
+        self.workers = workers
+        self.priority = priority
+        self._pending: Dict[Tuple[Tuple[str, object], str], _Mutation] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """The number of queued mutations."""
+        return len(self._pending)
+
+    def set(self, obj: HTBObject, field: str, value: bool):
+        """Queues setting :field: of :obj: to :value:.
+
+        A later change of the same field of the same object replaces this
+        one.
+
+        Args:
+            obj: The object to change.
+            field: The flag to set, ie. isRespected.
+            value: The desired value.
+        Raises:
+            HTBException: If the field can't be changed.
+        """
+        toggleendpoint(obj, field)
+        key = (objectkey(obj), field)
+        with self._lock:
+            mutation = self._pending.get(key)
+            if mutation is None:
+                self._pending[key] = _Mutation(obj, field, bool(value))
+                return
+            mutation.value = bool(value)
+            if not any(o is obj for o in mutation.objects):
+                mutation.objects.append(obj)
+
+    def toggle(self, obj: HTBObject, field: str):
+        """Queues flipping :field: of :obj:.
+
+        Toggling a field twice cancels out and no request is sent.
+        If the current value isn't known yet it is loaded by flush.
+
+        Args:
+            obj: The object to change.
+            field: The flag to flip.
+        Raises:
+            HTBException: If the field can't be changed.
+        """
+        toggleendpoint(obj, field)
+        key = (objectkey(obj), field)
+        with self._lock:
+            mutation = self._pending.get(key)
+            if mutation is None:
+                known = obj.__dict__.get(field)
+                value = None if known is None else not known
+                self._pending[key] = _Mutation(obj, field, value)
+                return
+            if mutation.value is None:
+                del self._pending[key]
+                return
+            mutation.value = not mutation.value
+            if not any(o is obj for o in mutation.objects):
+                mutation.objects.append(obj)
+
+    def respect(self, profile: HTBProfile, value: bool = True):
+        """Queues respecting, or no longer respecting, a user."""
+        self.set(profile, "isRespected", value)
+
+    def follow(self, profile: HTBProfile, value: bool = True):
+        """Queues following, or unfollowing, a user."""
+        self.set(profile, "isFollowed", value)
+
+    def todo(self, challenge: HTBChallenge, value: bool = True):
+        """Queues adding, or removing, a challenge to the todo list."""
+        self.set(challenge, "isTodo", value)
+
+    def like(self, challenge: HTBChallenge, value: bool = True):
+        """Queues liking, or unliking, a challenge."""
+        self.set(challenge, "likeByAuthUser", value)
+
+    def _spend(self, deadline: Deadline):
+        """Waits for a request token from the budget."""
+        deadline.check()
+        if not self.bucket.acquire(timeout=deadline.remaining()):
+            raise HTBTimeout()
+
+    def _current(self, obj: HTBObject, field: str,
+                 deadline: Deadline) -> bool:
+        """Returns the current value of :field:, loading :obj: under the
+        budget if the value isn't known."""
+        values = obj.__dict__
+        if field not in values and obj.objectendpoint is not None \
+                and not values.get("isloaded", False):
+            self._spend(deadline)
+            obj.load()
+        return bool(values.get(field, False))
+
+    def _apply(self, mutation: _Mutation, deadline: Deadline) \
+            -> MutationResult:
+        obj, field, value = mutation.objects[0], mutation.field, \
+            mutation.value
+        try:
+            with session.deadline(deadline), session.priority(self.priority):
+                current = self._current(obj, field, deadline)
+                if value is None:
+                    value = not current
+                elif current == value:
+                    return MutationResult(mutation.objects, field, value,
+                                          UNCHANGED)
+                self._spend(deadline)
+                session.post(toggleendpoint(obj, field))
+        except Exception as e:
+            # Any error, ie. a malformed response, only fails this mutation
+            # instead of the rest of the flush.
+            return MutationResult(mutation.objects, field, value, FAILED, e)
+        counter = next((COUNTERS[(cls, field)] for cls in type(obj).__mro__
+                        if (cls, field) in COUNTERS), None)
+        for instance in mutation.objects:
+            values = instance.__dict__
+            if counter is not None \
+                    and isinstance(values.get(counter), int) \
+                    and bool(values.get(field)) != value:
+                values[counter] += 1 if value else -1
+            values[field] = value
+        return MutationResult(mutation.objects, field, value, APPLIED)
+
+    def flush(self, deadline: Union[None, float, Deadline] = None) \
+            -> List[MutationResult]:
+        """Applies every queued mutation.
+
+        Mutations that can't be applied before the deadline fail with
+        HTBTimeout, the queue is empty afterwards either way.
+
+        Args:
+            deadline: The number of seconds, or Deadline, the flush may take.
+        Returns:
+            The result of every mutation in the order they were queued.
+        """
+        with self._lock:
+            mutations = list(self._pending.values())
+            self._pending.clear()
+        if not isinstance(deadline, Deadline):
+            deadline = Deadline(deadline, session.currentdeadline)
+        if not mutations:
+            return []
+        with ThreadPoolExecutor(min(self.workers, len(mutations))) as pool:
+            return list(pool.map(
+                lambda mutation: self._apply(mutation, deadline), mutations))
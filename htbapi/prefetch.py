@@ -0,0 +1,191 @@
+"""Contains a policy for loading search results before they are used.
+
+After a search the details of the first few hits are usually read next,
+and each first access blocks on a load. When prefetching is enabled the
+find and search functions hand their results to a Prefetcher, which loads
+the first :hits: results in the background on a small pool of workers. An
+access that happens while the prefetch request is being sent waits for it
+instead of sending a second request. Prefetches still waiting for a
+request slot don't hold up accesses, which load the object themselves.
+
+Prefetches are speculative, so they are kept cheap: they run at BULK
+priority, are dropped when the request budget is used up or too many are
+queued, and queued prefetches of an earlier search are cancelled when a
+new search comes in.
+
+ie.
+    prefetch.enable(hits=3)
+    machines = findmachines("Bl")
+    machines[0].os  # Already loaded in the background.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, List, Optional, TypeVar
+
+from requests import RequestException
+
+from . import session
+from .client import Deadline
+from .exceptions import HTBException
+from .models import HTBObject
+from .priority import Priority
+from .ratelimit import TokenBucket
+
+T = TypeVar("T")
+
+
+class Prefetcher:
+    """Loads the first results of searches in the background."""
+
+    def __init__(self, hits: int = 3, workers: int = 4, budget: float = 5.0,
+                 burst: Optional[float] = None, maxqueued: int = 16,
+                 priority: Priority = Priority.BULK,
+                 timeout: Optional[float] = 30.0):
+        """Initializes the prefetcher.
+
+        Args:
+            hits: The number of results of each search to load.
+            workers: The number of concurrent loads.
+            budget: The maximum number of prefetches started per second.
+            burst: The number of prefetches that may start at once.
+                Defaults to a single search's worth of :hits:.
+            maxqueued: The maximum number of prefetches waiting for a
+                worker. Further results aren't prefetched.
+            priority: The priority class of the loads.
+            timeout: The number of seconds a single load may take.
+        """
+        self.hits = hits
+        self.priority = priority
+        self.timeout = timeout
+        self.maxqueued = maxqueued
+        self.bucket = TokenBucket(budget, burst if burst is not None
+                                  else max(budget, hits))
+        self.submitted = 0
+        self.loaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._pool = ThreadPoolExecutor(workers,
+                                        thread_name_prefix="htbprefetch")
+        self._queued: List[Future] = []
+        self._deadline = Deadline()
+        self._lock = threading.Lock()
+
+    def _load(self, obj: HTBObject, deadline: Deadline):
+        try:
+            if obj.isloaded or deadline.cancelled:
+                return
+            # The slot is taken before the load starts, so an access to the
+            # object only waits for the prefetch once its request can be
+            # sent, instead of behind every other queued request. An object
+            # another thread is already loading is skipped rather than
+            # waited for, since that load may itself be queued for a slot.
+            with session.deadline(Deadline(self.timeout, deadline)), \
+                    session.priority(self.priority), session.slot():
+                obj.load(wait=False)
+            if not obj.isloaded:
+                return
+            with self._lock:
+                self.loaded += 1
+        except (HTBException, RequestException) as e:
+            with self._lock:
+                self.failed += 1
+            logging.debug(f"Prefetch of [{type(obj).__name__}] "
+                          f"{obj.__dict__.get('id')} failed: {e}")
+
+    def prefetch(self, objects: Iterable[T], supersede: bool = True) \
+            -> List[T]:
+        """Starts loading the first :hits: objects that aren't loaded.
+
+        Args:
+            objects: The search results.
+            supersede: Whether to cancel prefetches of earlier searches
+                that haven't started yet.
+        Returns:
+            The objects, so calls can be chained.
+        """
+        objects = list(objects)
+        with self._lock:
+            if supersede:
+                for future in self._queued:
+                    if future.cancel():
+                        self.cancelled += 1
+            self._queued = [f for f in self._queued if not f.done()]
+            deadline = self._deadline
+            for obj in objects[:self.hits]:
+                if not isinstance(obj, HTBObject) or obj.isloaded \
+                        or obj.objectendpoint is None:
+                    continue
+                if len(self._queued) >= self.maxqueued \
+                        or not self.bucket.tryacquire():
+                    self.skipped += 1
+                    continue
+                self.submitted += 1
+                self._queued.append(
+                    self._pool.submit(self._load, obj, deadline))
+        return objects
+
+    def cancel(self):
+        """Cancels every queued and running prefetch."""
+        with self._lock:
+            self._deadline.cancel()
+            self._deadline = Deadline()
+            for future in self._queued:
+                if future.cancel():
+                    self.cancelled += 1
+            self._queued = []
+
+    def shutdown(self):
+        """Cancels every prefetch and stops the workers."""
+        self.cancel()
+        self._pool.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        """Returns the number of prefetches by outcome."""
+        with self._lock:
+            return {"submitted": self.submitted, "loaded": self.loaded,
+                    "skipped": self.skipped, "failed": self.failed,
+                    "cancelled": self.cancelled}
+
+
+prefetcher: Optional[Prefetcher] = None
+"""The prefetcher used by the find and search functions, if enabled."""
+
+
+def enable(hits: int = 3, **kwargs) -> Prefetcher:
+    """Enables prefetching of search results.
+
+    Args:
+        hits: The number of results of each search to load.
+        kwargs: Passed on to Prefetcher.
+    Returns:
+        The new prefetcher.
+    """
+    global prefetcher
+    disable()
+    prefetcher = Prefetcher(hits, **kwargs)
+    return prefetcher
+
+
+def disable():
+    """Disables prefetching and cancels running prefetches."""
+    global prefetcher
+    if prefetcher is not None:
+        prefetcher.shutdown()
+        prefetcher = None
+
+
+def results(*groups: List[HTBObject]):
+    """Hands search results to the prefetcher if prefetching is enabled.
+
+    Args:
+        groups: The result lists of a search, ie. one per object type.
+            The first :hits: results of each list are prefetched.
+    """
+    current = prefetcher
+    if current is None:
+        return
+    for i, group in enumerate(groups):
+        current.prefetch(group, supersede=i == 0)
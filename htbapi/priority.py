@@ -0,0 +1,156 @@
+"""Contains the scheduler that orders requests by priority.
+
+Every request sent by a Client belongs to a priority class. When more
+requests are waiting than the client allows in flight, the
+RequestScheduler hands out the free slots with stride scheduling: each
+class gets a share of the slots proportional to its weight, so interactive
+calls jump ahead of queued bulk work without starving it. Per class caps
+keep bulk work from occupying every slot.
+
+ie.
+    with session.priority(Priority.BULK):
+        loadall(machines)
+"""
+
+import threading
+from collections import deque
+from enum import IntEnum
+from typing import Deque, Dict, Optional
+
+
+class Priority(IntEnum):
+    """The priority classes of requests."""
+
+    INTERACTIVE = 0
+    """Latency sensitive calls, ie. a user waiting on a lookup."""
+
+    NORMAL = 1
+    """The default priority."""
+
+    BULK = 2
+    """Background work such as crawls, polling and prefetching."""
+
+
+DEFAULTWEIGHTS = {Priority.INTERACTIVE: 16, Priority.NORMAL: 4,
+                  Priority.BULK: 1}
+"""The share of slots each class gets when all of them are waiting."""
+
+DEFAULTCAPS = {Priority.BULK: 8}
+"""The maximum number of requests of a class that may be in flight."""
+
+
+class _Ticket:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+
+class RequestScheduler:
+    """Limits the requests in flight and orders waiting ones by priority."""
+
+    def __init__(self, maxinflight: int = 10,
+                 caps: Optional[Dict[Priority, int]] = None,
+                 weights: Optional[Dict[Priority, float]] = None):
+        """Initializes the scheduler.
+
+        Args:
+            maxinflight: The maximum number of requests in flight.
+            caps: The maximum number of requests in flight per class.
+                Defaults to DEFAULTCAPS.
+            weights: The relative share of slots per class.
+                Defaults to DEFAULTWEIGHTS.
+        """
+        self.maxinflight = maxinflight
+        self.caps = dict(DEFAULTCAPS if caps is None else caps)
+        self.weights = dict(DEFAULTWEIGHTS if weights is None else weights)
+        self.inflight: Dict[Priority, int] = {p: 0 for p in Priority}
+        self.granted: Dict[Priority, int] = {p: 0 for p in Priority}
+        self._queues: Dict[Priority, Deque[_Ticket]] = {
+            p: deque() for p in Priority}
+        self._passes: Dict[Priority, float] = {p: 0.0 for p in Priority}
+        self._virtualtime = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def total(self) -> int:
+        """The number of requests in flight."""
+        return sum(self.inflight.values())
+
+    def waiting(self, priority: Optional[Priority] = None) -> int:
+        """The number of requests waiting, optionally of one class."""
+        with self._condition:
+            if priority is not None:
+                return len(self._queues[priority])
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _eligible(self, priority: Priority) -> bool:
+        cap = self.caps.get(priority)
+        return bool(self._queues[priority]) \
+            and (cap is None or self.inflight[priority] < cap)
+
+    def _dispatch(self):
+        while self.total < self.maxinflight:
+            eligible = [p for p in Priority if self._eligible(p)]
+            if not eligible:
+                return
+            priority = min(eligible, key=lambda p: (self._passes[p], p))
+            self._virtualtime = self._passes[priority]
+            self._passes[priority] += 1.0 / self.weights.get(priority, 1)
+            ticket = self._queues[priority].popleft()
+            ticket.granted = True
+            self.inflight[priority] += 1
+            self.granted[priority] += 1
+            self._condition.notify_all()
+
+    def acquire(self, priority: Priority = Priority.NORMAL, deadline=None):
+        """Waits for a slot to send a request.
+
+        Args:
+            priority: The priority class of the request.
+            deadline: A Deadline limiting how long to wait.
+        Raises:
+            HTBTimeout: If the deadline passes while waiting.
+            HTBCancelled: If the deadline is cancelled while waiting.
+        """
+        ticket = _Ticket()
+        with self._condition:
+            queue = self._queues[priority]
+            if not queue:
+                # A class that wasn't waiting doesn't get credit for the
+                # slots it didn't use.
+                self._passes[priority] = max(self._passes[priority],
+                                             self._virtualtime)
+            queue.append(ticket)
+            self._dispatch()
+            try:
+                while not ticket.granted:
+                    timeout = None
+                    if deadline is not None:
+                        deadline.check()
+                        remaining = deadline.remaining()
+                        # Cancellation doesn't notify, so check regularly.
+                        timeout = 0.1 if remaining is None \
+                            else min(remaining, 0.1)
+                    self._condition.wait(timeout)
+            except BaseException:
+                if ticket.granted:
+                    self.inflight[priority] -= 1
+                else:
+                    queue.remove(ticket)
+                self._dispatch()
+                raise
+
+    def release(self, priority: Priority = Priority.NORMAL):
+        """Frees the slot of a finished request."""
+        with self._condition:
+            self.inflight[priority] -= 1
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Returns the in flight, waiting and granted counts per class."""
+        with self._condition:
+            return {p.name.lower(): {"inflight": self.inflight[p],
+                                     "waiting": len(self._queues[p]),
+                                     "granted": self.granted[p]}
+                    for p in Priority}
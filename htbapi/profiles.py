@@ -4,9 +4,10 @@ This module contains classes and methods for working with user profiles
 on HTB.
 """
 
-from . import session
+from . import prefetch, session
 from typing import List, Optional
-from .models import HTBObject
+from .models import HTBObject, HTBReference
+from .teams import HTBTeam
 import json
 
 class HTBProfile(HTBObject):
@@ -48,6 +49,8 @@ class HTBProfile(HTBObject):
     objectendpoint = "/user/profile/basic/"
     objectkey = "profile"
 
+    team = HTBReference(HTBTeam)
+
 
 def findprofiles(username: str) -> List[HTBProfile]:
     """Searches for profiles matchine :username:.
@@ -66,6 +69,7 @@ def findprofiles(username: str) -> List[HTBProfile]:
     results = resp.json()
     searchresults = results["users"] if "users" in results else []
     matches = [HTBProfile(prof) for prof in searchresults]
+    prefetch.results(matches)
     return matches
 
 def findprofile(username: str) -> Optional[HTBProfile]:
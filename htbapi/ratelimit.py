@@ -0,0 +1,95 @@
+"""Contains helpers for limiting the rate of requests sent to the API.
+
+The TokenBucket class is shared by the components that issue requests
+in the background so they can agree on a global request budget.
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    """A thread safe token bucket.
+
+    Tokens are refilled continuously at :rate: tokens per second up to
+    :capacity: tokens. Every request consumes one token.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """Initializes the bucket.
+
+        Args:
+            rate: The number of tokens added per second.
+            capacity: The maximum number of tokens. Defaults to :rate:
+                (or 1 if :rate: is less than 1).
+            clock: The monotonic clock used to measure refills.
+            sleep: The function used to wait for tokens.
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    @property
+    def available(self) -> float:
+        """The number of tokens currently available."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def delay(self, tokens: float = 1) -> float:
+        """Returns how long to wait until :tokens: tokens are available."""
+        with self._lock:
+            self._refill()
+            missing = tokens - self._tokens
+            return max(0.0, missing / self.rate)
+
+    def tryacquire(self, tokens: float = 1) -> bool:
+        """Consumes :tokens: tokens if they are available.
+
+        Args:
+            tokens: The number of tokens to consume.
+        Returns:
+            Whether the tokens were consumed.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """Waits until :tokens: tokens are available and consumes them.
+
+        Args:
+            tokens: The number of tokens to consume.
+            timeout: The maximum number of seconds to wait. Waits forever
+                if None.
+        Returns:
+            Whether the tokens were consumed before the timeout.
+        """
+        start = self.clock()
+        while not self.tryacquire(tokens):
+            wait = self.delay(tokens)
+            if timeout is not None:
+                remaining = timeout - (self.clock() - start)
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            self.sleep(wait)
+        return True
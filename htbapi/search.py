@@ -8,9 +8,11 @@ from .profiles import HTBProfile
 from .machines import HTBMachine
 from .challenges import HTBChallenge
 from .teams import HTBTeam
+from .exceptions import HTBException
 from .models import HTBObject
-from typing import Dict, List
-from . import session
+from .streaming import iterresponse
+from typing import Dict, Iterator, List, Tuple
+from . import prefetch, session
 
 searchtags = ["users", "machines", "challenges", "teams"]
 objectclasses = {
@@ -45,4 +47,33 @@ def search(term: str, tags=searchtags) -> Dict[str, List[HTBObject]]:
     results = resp.json()
     # Map the results onto the proper classes according to the name of the keys.
     parsed = {objkey: [objectclasses[objkey](obj) for obj in results[objkey]] for objkey in results}
+    prefetch.results(*parsed.values())
     return parsed
+
+
+def searchiter(term: str, tags=searchtags) -> Iterator[Tuple[str, HTBObject]]:
+    """Searches HTB and yields the matches as they arrive.
+
+    Like search, but the response is parsed incrementally so the first
+    matches are available before the whole response is downloaded and
+    the raw response is never held in memory at once.
+
+    Args:
+        term: The search term to query HTB with.
+        tags: A list of object types to search for.
+            Available types: users, machines, challenges, teams
+    Returns:
+        An iterator of (object type name, matching object).
+    Raises:
+        HTBException: If the API returns an error, ie. for invalid tags.
+        HTBRequestException: If a request fails.
+        HTBStreamError: If the response isn't valid JSON.
+    """
+
+    resp = session.getstream("/search/fetch", params={"query": term, "tags": json.dumps(tags)})
+    for path, obj in iterresponse(resp, [("*",)]):
+        tag = path[0]
+        if tag == "error":
+            raise HTBException(obj)
+        if tag in objectclasses and isinstance(obj, dict):
+            yield tag, objectclasses[tag](obj)
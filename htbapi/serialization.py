@@ -0,0 +1,322 @@
+"""Contains a compact binary serialization format for HTB objects.
+
+Loaded objects can be written to caches or sent to other processes with
+dumps and read back with loads. Unlike pickle only the values returned by
+the API are stored, objects are restored without calling __init__ or
+touching the network, and only HTBObject subclasses can be instantiated
+when loading.
+
+The format starts with a magic header and a schema version, followed by a
+single tagged value. Integers are zigzag varints and repeated strings
+(ie. the keys of every object in a list) are stored once and referenced by
+index afterwards.
+
+With fast=True dumps encodes the value with msgpack instead (schema
+version 2), which is several times faster than the pure Python codec but
+larger, since object keys are repeated. HTBObjects are stored as msgpack
+extension types holding the class name and values. loads reads both
+versions, version 2 needs msgpack. The default output never depends on
+whether msgpack is installed.
+
+ie.
+    data = serialization.dumps(machines)
+    machines = serialization.loads(data)
+"""
+
+import struct
+from typing import Any, Dict, List, Optional, Type
+
+from .exceptions import HTBException
+from .models import HTBObject
+from .varint import readvarint, unzigzag, writevarint, zigzag
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MAGIC = b"HTBO"
+VERSION = 1
+"""The schema version of the built in codec."""
+
+MSGPACKVERSION = 2
+"""The schema version of values encoded with msgpack."""
+
+_MSGPACKOBJECT = 1
+"""The msgpack extension type code of HTBObjects."""
+
+_NONE = 0
+_TRUE = 1
+_FALSE = 2
+_INT = 3
+_FLOAT = 4
+_STR = 5
+_STRREF = 6
+_LIST = 7
+_DICT = 8
+_OBJECT = 9
+
+_MAXINTERNED = 64
+"""Strings longer than this are not added to the string table."""
+
+_double = struct.Struct("<d")
+
+
+class HTBSerializationError(HTBException):
+    pass
+
+
+def objectclass(name: str) -> Type[HTBObject]:
+    """Finds the HTBObject subclass named :name:.
+
+    Args:
+        name: The name of the class.
+    Returns:
+        The class.
+    Raises:
+        HTBSerializationError: If no such class exists.
+    """
+
+    pending = [HTBObject]
+    while pending:
+        cls = pending.pop()
+        if cls.__name__ == name:
+            return cls
+        pending.extend(cls.__subclasses__())
+    raise HTBSerializationError(f"Unknown object class {name}")
+
+
+def _msgpackobject(value: Any) -> "msgpack.ExtType":
+    if isinstance(value, int):
+        # msgpack only packs 64 bit integers.
+        raise OverflowError()
+    if not isinstance(value, HTBObject):
+        raise HTBSerializationError(
+            f"Can't serialize {type(value).__name__} values")
+    data = msgpack.packb([type(value).__name__, value.__dict__],
+                         default=_msgpackobject)
+    return msgpack.ExtType(_MSGPACKOBJECT, data)
+
+
+def dumps(value: Any, fast: bool = False) -> bytes:
+    """Serializes a HTBObject, or a list/dict containing them.
+
+    Args:
+        value: The value to serialize. Values may be None, bool, int,
+            float, str, list, tuple, dict with str keys or HTBObject.
+        fast: Whether to encode with msgpack, which is faster but larger
+            and needs msgpack to load.
+    Returns:
+        The serialized bytes.
+    Raises:
+        HTBSerializationError: If the value contains an unsupported type,
+            or fast is set and msgpack isn't installed.
+    """
+
+    if fast:
+        if msgpack is None:
+            raise HTBSerializationError("fast=True requires msgpack")
+        try:
+            data = msgpack.packb(value, default=_msgpackobject)
+        except (OverflowError, ValueError):
+            # Integers beyond 64 bits or nesting msgpack refuses are left
+            # to the built in codec.
+            pass
+        else:
+            return MAGIC + bytes((MSGPACKVERSION,)) + data
+
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    strings: Dict[str, int] = {}
+    append = out.append
+
+    def string(text: str):
+        index = strings.get(text)
+        if index is not None:
+            append(_STRREF)
+            writevarint(out, index)
+            return
+        if len(text) <= _MAXINTERNED:
+            strings[text] = len(strings)
+        data = text.encode("utf-8")
+        append(_STR)
+        writevarint(out, len(data))
+        out.extend(data)
+
+    def encode(value: Any):
+        # bool is checked before int since it is a subclass of int.
+        if value is None:
+            append(_NONE)
+        elif value is True:
+            append(_TRUE)
+        elif value is False:
+            append(_FALSE)
+        elif isinstance(value, str):
+            string(value)
+        elif isinstance(value, int):
+            append(_INT)
+            writevarint(out, zigzag(value))
+        elif isinstance(value, float):
+            append(_FLOAT)
+            out.extend(_double.pack(value))
+        elif isinstance(value, dict):
+            append(_DICT)
+            encodedict(value)
+        elif isinstance(value, (list, tuple)):
+            append(_LIST)
+            writevarint(out, len(value))
+            for item in value:
+                encode(item)
+        elif isinstance(value, HTBObject):
+            append(_OBJECT)
+            string(type(value).__name__)
+            encodedict(value.__dict__)
+        else:
+            raise HTBSerializationError(
+                f"Can't serialize {type(value).__name__} values")
+
+    def encodedict(values: dict):
+        writevarint(out, len(values))
+        for key, item in values.items():
+            if not isinstance(key, str):
+                raise HTBSerializationError("Dict keys must be strings")
+            string(key)
+            encode(item)
+
+    try:
+        encode(value)
+    except RecursionError as e:
+        raise HTBSerializationError("Value is nested too deeply") from e
+    return bytes(out)
+
+
+def loads(data: bytes) -> Any:
+    """Deserializes a value written by dumps.
+
+    Objects are restored with the values they had when they were dumped,
+    including whether they were loaded, without sending any requests.
+
+    Args:
+        data: The serialized bytes.
+    Returns:
+        The deserialized value.
+    Raises:
+        HTBSerializationError: If the data is invalid or was written with
+            an unsupported schema version.
+    """
+
+    view = memoryview(data)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise HTBSerializationError("Not a serialized HTB object")
+    if len(view) > len(MAGIC) and view[len(MAGIC)] == MSGPACKVERSION:
+        return _msgpackloads(view[len(MAGIC) + 1:])
+    if len(view) <= len(MAGIC) or view[len(MAGIC)] != VERSION:
+        raise HTBSerializationError("Unsupported serialization version")
+    pos = len(MAGIC) + 1
+    strings: List[str] = []
+    classes: Dict[str, Type[HTBObject]] = {}
+
+    def varint() -> int:
+        nonlocal pos
+        result, pos = readvarint(view, pos)
+        return result
+
+    def string(tag: int) -> str:
+        nonlocal pos
+        if tag == _STRREF:
+            return strings[varint()]
+        if tag != _STR:
+            raise HTBSerializationError(f"Expected a string, got tag {tag}")
+        size = varint()
+        text = str(view[pos:pos + size], "utf-8")
+        pos += size
+        if len(text) <= _MAXINTERNED:
+            strings.append(text)
+        return text
+
+    def decodedict() -> dict:
+        nonlocal pos
+        values = {}
+        for _ in range(varint()):
+            tag = view[pos]
+            pos += 1
+            key = string(tag)
+            values[key] = decode()
+        return values
+
+    def decode() -> Any:
+        nonlocal pos
+        tag = view[pos]
+        pos += 1
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _STR or tag == _STRREF:
+            return string(tag)
+        if tag == _INT:
+            return unzigzag(varint())
+        if tag == _FLOAT:
+            value = _double.unpack_from(view, pos)[0]
+            pos += 8
+            return value
+        if tag == _DICT:
+            return decodedict()
+        if tag == _LIST:
+            return [decode() for _ in range(varint())]
+        if tag == _OBJECT:
+            nametag = view[pos]
+            pos += 1
+            name = string(nametag)
+            cls = classes.get(name)
+            if cls is None:
+                cls = classes[name] = objectclass(name)
+            obj = cls.__new__(cls)
+            obj.__dict__.update(decodedict())
+            return obj
+        raise HTBSerializationError(f"Unknown tag {tag}")
+
+    try:
+        value = decode()
+    except (IndexError, UnicodeDecodeError, struct.error,
+            RecursionError) as e:
+        raise HTBSerializationError(f"Corrupt serialized data: {e}") from e
+    if pos != len(view):
+        raise HTBSerializationError("Trailing data after serialized value")
+    return value
+
+
+def _msgpackloads(data: memoryview) -> Any:
+    if msgpack is None:
+        raise HTBSerializationError("Loading this data requires msgpack")
+    classes: Dict[str, Type[HTBObject]] = {}
+
+    def extension(code: int, data: bytes) -> HTBObject:
+        if code != _MSGPACKOBJECT:
+            raise HTBSerializationError(f"Unknown extension type {code}")
+        name, values = msgpack.unpackb(data, ext_hook=extension,
+                                       strict_map_key=False)
+        cls = classes.get(name)
+        if cls is None:
+            cls = classes[name] = objectclass(name)
+        obj = cls.__new__(cls)
+        obj.__dict__.update(values)
+        return obj
+
+    try:
+        return msgpack.unpackb(data, ext_hook=extension,
+                               strict_map_key=False)
+    except (ValueError, TypeError, RecursionError,
+            msgpack.UnpackException) as e:
+        raise HTBSerializationError(f"Corrupt serialized data: {e}") from e
+
+
+def version(data: bytes) -> Optional[int]:
+    """Returns the schema version of serialized data, or None if the data
+    was not written by dumps."""
+
+    if len(data) <= len(MAGIC) or data[:len(MAGIC)] != MAGIC:
+        return None
+    return data[len(MAGIC)]
@@ -0,0 +1,374 @@
+"""Contains a pool of authenticated clients that are kept warm.
+
+Logging in (and completing two factor authentication) takes a couple of
+round trips, and restored tokens may already have expired, which costs a
+401 and a refresh on the first request. The SessionPool authenticates once
+when it starts, hands the tokens to a fixed number of Clients and opens
+their connections. A background thread refreshes the tokens shortly before
+they expire (read from the exp and iat claims of the access token, so the
+schedule doesn't depend on the local clock agreeing with the server's)
+and updates
+every client, so handing out a client is a constant time pop from the idle
+list and requests never wait on authentication.
+
+The clients share circuit breakers, and a request scheduler if
+MAXINFLIGHT is set, so the pool as a whole respects the same limits as a
+single client.
+
+ie.
+    with SessionPool(email, password, size=8) as pool:
+        with pool.client() as client:
+            client.get("/user/info")
+"""
+
+import base64
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional
+
+from requests import RequestException
+
+from .breaker import CircuitBreakers
+from . import client as clientmodule
+from .client import Client
+from .exceptions import HTBException, HTBFurtherAuthRequired, HTBTimeout
+from .priority import Priority, RequestScheduler
+
+REFRESHMARGIN = 60.0
+"""Seconds before the access token expires that it is refreshed."""
+
+RETRYDELAY = 10.0
+"""Seconds to wait before retrying a failed refresh."""
+
+
+def tokenclaim(token: Optional[str], claim: str) -> Optional[float]:
+    """Returns a numeric claim of a JWT access token, ie. exp or iat.
+
+    Args:
+        token: The access token.
+        claim: The name of the claim.
+    Returns:
+        The value of the claim, or None if the token doesn't carry it.
+    """
+
+    if not token or token.count(".") != 2:
+        return None
+    payload = token.split(".")[1]
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(
+            payload + "=" * (-len(payload) % 4)))
+    except ValueError:
+        return None
+    value = claims.get(claim) if isinstance(claims, dict) else None
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+def tokenexpiry(token: Optional[str]) -> Optional[float]:
+    """Returns the exp claim of a JWT access token as a unix timestamp.
+
+    Args:
+        token: The access token.
+    Returns:
+        When the token expires, or None if it doesn't carry an expiry.
+    """
+
+    return tokenclaim(token, "exp")
+
+
+class PooledClient(Client):
+    """A Client whose session refreshes go through its SessionPool."""
+
+    def __init__(self, pool: "SessionPool"):
+        super().__init__()
+        self.pool = pool
+
+    def refreshsession(self, ignore2fa=False):
+        """Refreshes the tokens of the whole pool, unless another client
+        already did since this client's token was rejected."""
+        self.pool.refresh(stale=self.accesstoken)
+
+
+class SessionPool:
+    """A fixed size pool of authenticated, warm clients."""
+
+    def __init__(self, email: Optional[str] = None,
+                 password: Optional[str] = None, otp: Optional[str] = None,
+                 size: int = 4, accesstoken: Optional[str] = None,
+                 refreshtoken: Optional[str] = None,
+                 margin: float = REFRESHMARGIN,
+                 refreshinterval: Optional[float] = None,
+                 warmup: bool = True):
+        """Initializes the pool. No requests are sent until start.
+
+        Either credentials or tokens from a previous session are needed.
+        Credentials are also used to log in again if a refresh fails.
+
+        Args:
+            email: The email to authenticate with.
+            password: The password to authenticate with.
+            otp: The 2fa OTP to use if 2fa is enabled.
+            size: The number of clients.
+            accesstoken: The access token from a previous session.
+            refreshtoken: The refresh token from a previous session.
+            margin: Seconds before expiry that the tokens are refreshed.
+            refreshinterval: Seconds between refreshes of tokens that don't
+                carry an expiry. They are only refreshed on a 401 if None.
+            warmup: Whether to open a connection for every client by
+                sending a request when starting.
+        """
+        if (email is None or password is None) and refreshtoken is None:
+            raise HTBException("SessionPool needs credentials or tokens")
+        self.email = email
+        self.password = password
+        self.otp = otp
+        self.size = size
+        self.margin = margin
+        self.refreshinterval = refreshinterval
+        self.warmup = warmup
+        self.refreshes = 0
+        maxinflight = clientmodule.MAXINFLIGHT
+        self.scheduler: Optional[RequestScheduler] = None \
+            if maxinflight is None else RequestScheduler(maxinflight)
+        self.breakers = CircuitBreakers()
+        self.clients: List[PooledClient] = []
+        self.attached: List[Client] = []
+        self._detached: Dict[int, Optional[object]] = {}
+        self._auth = Client()
+        self._auth.accesstoken = accesstoken
+        self._auth.refreshtoken = refreshtoken
+        self._refreshed = 0.0
+        self._lifetime: Optional[float] = None
+        # The server's clock minus the local clock, from the iat claim.
+        self._skew = 0.0
+        self._idle: Deque[PooledClient] = deque()
+        self._available = threading.Condition()
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def accesstoken(self) -> Optional[str]:
+        """The access token shared by the clients."""
+        return self._auth.accesstoken
+
+    @property
+    def expires(self) -> Optional[float]:
+        """The number of seconds until the access token expires, if known."""
+        expiry = tokenexpiry(self.accesstoken)
+        return None if expiry is None \
+            else expiry - time.time() - self._skew
+
+    def _issued(self):
+        """Reads the lifetime of a new access token and how far the local
+        clock is off from the server's."""
+        token = self.accesstoken
+        expiry, issued = tokenexpiry(token), tokenclaim(token, "iat")
+        if issued is not None:
+            self._skew = issued - time.time()
+        self._lifetime = None if expiry is None else \
+            expiry - issued if issued is not None else self.expires
+
+    def __enter__(self) -> "SessionPool":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self) -> "SessionPool":
+        """Authenticates, creates the clients and starts the upkeep thread.
+
+        Raises:
+            HTBException: If authentication fails.
+            HTBRequestException: If a request fails.
+        """
+        with self._lock:
+            if self._auth.accesstoken is None:
+                self._authenticate()
+                self._issued()
+            else:
+                expires = self.expires
+                if expires is None or expires < self.margin:
+                    self._refresh()
+            for _ in range(self.size):
+                client = PooledClient(self)
+                client.scheduler = self.scheduler
+                client.breakers = self.breakers
+                self.clients.append(client)
+            self._apply()
+        if self.warmup:
+            with ThreadPoolExecutor(self.size) as pool:
+                list(pool.map(self._warm, self.clients))
+        with self._available:
+            self._idle.extend(self.clients)
+            self._available.notify_all()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._upkeep, name="SessionPool", daemon=True)
+        self._thread.start()
+        return self
+
+    def _warm(self, client: PooledClient):
+        try:
+            client.get("/user/info", priority=Priority.INTERACTIVE)
+        except (HTBException, RequestException) as e:
+            logging.warning(f"Failed to warm up a pooled client: {e}")
+
+    def _authenticate(self):
+        if self.email is None or self.password is None:
+            raise HTBException("Can't log in again without credentials")
+        with self._auth.priority(Priority.INTERACTIVE):
+            self._auth.login(self.email, self.password, True)
+            if self._auth.needsOTP:
+                if self.otp is None:
+                    raise HTBFurtherAuthRequired()
+                self._auth.submit2fa(self.otp)
+
+    def _refresh(self):
+        try:
+            with self._auth.priority(Priority.INTERACTIVE):
+                self._auth.refreshsession()
+        except (HTBException, RequestException) as e:
+            if self.email is None:
+                raise
+            logging.warning(f"Refreshing the pool session failed, "
+                            f"logging in again: {e}")
+            self._authenticate()
+        self.refreshes += 1
+        self._refreshed = time.monotonic()
+        self._issued()
+
+    def _apply(self):
+        """Hands the current tokens to every client."""
+        auth = self._auth
+        for client in self.clients + self.attached:
+            client.refreshtoken = auth.refreshtoken
+            client.is2faEnabled = auth.is2faEnabled
+            client.tokenHas2FA = auth.tokenHas2FA
+            client.accesstoken = auth.accesstoken
+
+    def refresh(self, stale: Optional[str] = None):
+        """Refreshes the tokens and updates every client.
+
+        Args:
+            stale: The access token that was rejected. If the tokens were
+                already refreshed since, nothing is done.
+        Raises:
+            HTBException: If the session can't be refreshed.
+            HTBRequestException: If a request fails.
+        """
+        with self._lock:
+            if stale is not None and stale != self._auth.accesstoken:
+                return
+            self._refresh()
+            self._apply()
+
+    def attach(self, client: Client):
+        """Keeps the tokens of a client outside the pool up to date,
+        ie. htbapi.session so the model classes use the pool's session.
+        Refreshes triggered by the client go through the pool."""
+        with self._lock:
+            if client in self.attached:
+                return
+            self.attached.append(client)
+            self._detached[id(client)] = client.__dict__.get("refreshsession")
+            client.refreshsession = lambda ignore2fa=False: \
+                self.refresh(stale=client.accesstoken)
+            self._apply()
+
+    def detach(self, client: Client):
+        """Stops updating an attached client and restores its own session
+        refreshes. The client keeps the current tokens."""
+        with self._lock:
+            self.attached.remove(client)
+            previous = self._detached.pop(id(client))
+            if previous is None:
+                del client.refreshsession
+            else:
+                client.refreshsession = previous
+
+    def _due(self) -> Optional[float]:
+        # Scheduled refreshes are never closer together than half the
+        # token lifetime or RETRYDELAY, even if the token already looks
+        # expired (ie. the clock is off and the token has no iat claim).
+        lifetime = self._lifetime
+        floor = min(RETRYDELAY, lifetime / 2) if lifetime and lifetime > 0 \
+            else RETRYDELAY
+        floor = max(0.0, self._refreshed + floor - time.monotonic())
+        expires = self.expires
+        if expires is not None:
+            # Short lived tokens are refreshed halfway through instead.
+            margin = self.margin if not lifetime or lifetime <= 0 \
+                else min(self.margin, lifetime / 2)
+            return max(floor, expires - margin)
+        if self.refreshinterval is not None:
+            return max(floor, self._refreshed + self.refreshinterval
+                       - time.monotonic())
+        return None
+
+    def _upkeep(self):
+        self._refreshed = self._refreshed or time.monotonic()
+        while not self._stop.wait(self._due()):
+            try:
+                self.refresh()
+            except (HTBException, RequestException) as e:
+                logging.error(f"Failed to refresh the pool session: {e}")
+                if self._stop.wait(RETRYDELAY):
+                    return
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledClient:
+        """Takes an idle client out of the pool.
+
+        Args:
+            timeout: The maximum number of seconds to wait for a client.
+                Waits forever if None.
+        Returns:
+            A ready client, which must be given back with release.
+        Raises:
+            HTBTimeout: If no client became available in time.
+        """
+        with self._available:
+            if not self._available.wait_for(lambda: self._idle, timeout):
+                raise HTBTimeout()
+            return self._idle.pop()
+
+    def release(self, client: PooledClient):
+        """Gives a client back to the pool."""
+        with self._available:
+            self._idle.append(client)
+            self._available.notify()
+
+    @contextmanager
+    def client(self, timeout: Optional[float] = None) \
+            -> Iterator[PooledClient]:
+        """Lends an idle client for the duration of the block.
+
+        ie.
+            with pool.client() as client:
+                client.get("/user/info")
+        """
+        client = self.acquire(timeout)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def close(self):
+        """Stops the upkeep thread and closes every client's connections.
+        The session isn't logged out, so the tokens remain usable."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for client in list(self.attached):
+            self.detach(client)
+        with self._available:
+            self._idle.clear()
+        for client in self.clients:
+            client.close()
+        self.clients = []
+        self._auth.close()
@@ -0,0 +1,279 @@
+"""Contains an incremental JSON parser for large responses.
+
+The JSONStream parser is fed the body of a response chunk by chunk as it
+arrives and yields the elements of selected arrays as soon as each one is
+complete. Only the element being parsed is buffered, so memory stays
+bounded by the largest element instead of the whole body, and the first
+elements are available before the body has finished downloading.
+
+Arrays are selected by their path from the root of the document. A path
+is a tuple of object keys and array indexes, "*" matches any key or index.
+Any other value of an object member at a selected path (ie. an "error"
+message next to the selected arrays) is yielded whole, with its own path.
+
+ie.
+    resp = session.getstream("/search/fetch", params=...)
+    for path, element in iterresponse(resp, [("*",)]):
+        print(path[0], element["value"])
+"""
+
+import json
+import re
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from requests import Response
+
+from .exceptions import HTBException
+
+Path = Tuple[object, ...]
+
+CHUNKSIZE = 64 * 1024
+"""The number of bytes read from the socket at once."""
+
+_significant = re.compile(rb'["{}\[\],:]')
+# A whole string (the group is empty if it isn't terminated yet) or a
+# bracket, used to find the end of a captured object or array.
+_nesting = re.compile(rb'"(?:[^"\\]+|\\.)*("?)|[{}\[\]]')
+_nonspace = re.compile(rb"[^ \t\r\n]")
+
+
+class HTBStreamError(HTBException):
+    pass
+
+
+class _Frame:
+    __slots__ = ("array", "expectkey", "selected")
+
+    def __init__(self, array: bool, selected: bool):
+        self.array = array
+        self.expectkey = not array
+        self.selected = selected
+
+
+def _matches(pattern: Sequence[object], path: Sequence[object]) -> bool:
+    return len(pattern) == len(path) and all(
+        p == "*" or p == k for p, k in zip(pattern, path))
+
+
+class JSONStream:
+    """A push parser yielding the elements of selected arrays."""
+
+    def __init__(self, paths: Iterable[Path] = ((),)):
+        """Initializes the parser.
+
+        Args:
+            paths: The paths of the arrays to yield the elements of.
+                Defaults to the root of the document being an array.
+        """
+        self.paths: List[Path] = [tuple(p) for p in paths]
+        self._buffer = bytearray()
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._path: List[object] = []
+        self._instring: Optional[int] = None
+        # The start of the element being captured, its path, whether it
+        # is a scalar ending at the next delimiter and the nesting depth
+        # inside it.
+        self._capture: Optional[int] = None
+        self._capturepath: Path = ()
+        self._scalar = False
+        self._nest = 0
+        # Whether the next value is selected and, if so, whether it is an
+        # object member rather than an array element.
+        self._pending = False
+        self._member = False
+        self._done = False
+
+    def _element(self, end: int) -> Tuple[Path, object]:
+        data = bytes(self._buffer[self._capture:end])
+        self._capture = None
+        path = self._capturepath
+        try:
+            return path, json.loads(data)
+        except ValueError as e:
+            raise HTBStreamError(f"Invalid JSON element in {path}: {e}") \
+                from e
+
+    def _skip(self, buffer: bytearray, pos: int) \
+            -> Tuple[Optional[int], int]:
+        """Skips over a captured object or array.
+
+        Returns:
+            The end of the element, or None if more data is needed, and the
+            position to continue from.
+        """
+        for match in _nesting.finditer(buffer, pos):
+            c = buffer[match.start()]
+            if c == 0x22:
+                if not match.group(1):
+                    return None, match.start()
+            elif c == 0x7b or c == 0x5b:
+                self._nest += 1
+            else:
+                self._nest -= 1
+                if not self._nest:
+                    return match.end(), match.end()
+        return None, len(buffer)
+
+    def feed(self, chunk: bytes) -> Iterator[Tuple[Path, object]]:
+        """Parses the next chunk of the document.
+
+        Args:
+            chunk: The next bytes of the document.
+        Returns:
+            An iterator of (array path, element) for every element that was
+            completed by this chunk.
+        Raises:
+            HTBStreamError: If the document isn't valid JSON.
+        """
+        buffer = self._buffer
+        buffer.extend(chunk)
+        pos = self._pos
+        stack = self._stack
+        while True:
+            if self._instring is not None:
+                end = buffer.find(b'"', pos)
+                if end == -1:
+                    pos = len(buffer)
+                    break
+                pos = end + 1
+                slashes = 0
+                while buffer[end - 1 - slashes] == 0x5c:
+                    slashes += 1
+                if slashes % 2:
+                    continue
+                start, self._instring = self._instring, None
+                if self._capture is None and stack and stack[-1].expectkey:
+                    self._path[-1] = json.loads(bytes(buffer[start:pos]))
+                continue
+            if self._pending:
+                # The next value is an element of a selected array or a
+                # selected object member.
+                match = _nonspace.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                self._pending = False
+                c = buffer[match.start()]
+                # Not the end of an empty array, and selected arrays in
+                # objects are streamed rather than captured.
+                if c != 0x5d and not (self._member and c == 0x5b):
+                    self._capture = match.start()
+                    self._capturepath = tuple(self._path) if self._member \
+                        else tuple(self._path[:-1])
+                    self._scalar = c not in b"{["
+                    self._nest = 0
+            if self._capture is not None and not self._scalar:
+                end, pos = self._skip(buffer, pos)
+                if end is None:
+                    break
+                yield self._element(end)
+                continue
+            match = _significant.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            i = match.start()
+            c = buffer[i]
+            pos = i + 1
+            if c == 0x22:  # "
+                self._instring = i
+            elif c == 0x7b or c == 0x5b:  # { or [
+                if self._done:
+                    raise HTBStreamError("Trailing data after the document")
+                array = c == 0x5b
+                selected = array and any(
+                    _matches(p, self._path) for p in self.paths)
+                stack.append(_Frame(array, selected))
+                self._path.append(0 if array else None)
+                self._pending = selected
+                self._member = False
+            elif c == 0x7d or c == 0x5d:  # } or ]
+                if not stack or stack[-1].array != (c == 0x5d):
+                    raise HTBStreamError(f"Unexpected {chr(c)}")
+                if self._capture is not None:
+                    yield self._element(i)
+                stack.pop()
+                self._path.pop()
+                self._done = not stack
+            elif c == 0x2c:  # ,
+                if self._capture is not None:
+                    yield self._element(i)
+                if not stack:
+                    raise HTBStreamError("Unexpected ,")
+                frame = stack[-1]
+                if frame.array:
+                    self._path[-1] += 1
+                    self._pending = frame.selected
+                    self._member = False
+                else:
+                    frame.expectkey = True
+            elif self._capture is None and stack:  # :
+                stack[-1].expectkey = False
+                self._pending = self._member = any(
+                    _matches(p, self._path) for p in self.paths)
+        # Drop what has been consumed, keeping the element being captured.
+        keep = pos if self._capture is None else self._capture
+        if self._instring is not None:
+            keep = min(keep, self._instring)
+            self._instring -= keep
+        if self._capture is not None:
+            self._capture -= keep
+        del buffer[:keep]
+        self._pos = pos - keep
+
+    def close(self):
+        """Checks that the whole document was parsed.
+
+        Raises:
+            HTBStreamError: If the document is incomplete.
+        """
+        if self._stack or self._instring is not None:
+            raise HTBStreamError("Incomplete JSON document")
+
+
+def iterjson(chunks: Iterable[bytes], paths: Iterable[Path] = ((),)) \
+        -> Iterator[Tuple[Path, object]]:
+    """Yields the elements of selected arrays of a chunked JSON document.
+
+    Args:
+        chunks: The bytes of the document.
+        paths: The paths of the arrays to yield the elements of.
+    Returns:
+        An iterator of (array path, element).
+    Raises:
+        HTBStreamError: If the document isn't valid JSON.
+    """
+    parser = JSONStream(paths)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.close()
+
+
+def iterresponse(response: Response, paths: Iterable[Path] = ((),),
+                 deadline=None) -> Iterator[Tuple[Path, object]]:
+    """Yields the elements of selected arrays of a streamed response.
+
+    The response is closed when the iterator is exhausted or closed.
+
+    Args:
+        response: A response sent with stream=True, ie. by
+            Client.getstream.
+        paths: The paths of the arrays to yield the elements of.
+        deadline: A Deadline checked between chunks.
+    Returns:
+        An iterator of (array path, element).
+    Raises:
+        HTBStreamError: If the body isn't valid JSON.
+        HTBTimeout: If the deadline passes.
+        HTBCancelled: If the deadline is cancelled.
+    """
+    parser = JSONStream(paths)
+    try:
+        for chunk in response.iter_content(CHUNKSIZE):
+            if deadline is not None:
+                deadline.check()
+            yield from parser.feed(chunk)
+        parser.close()
+    finally:
+        response.close()
@@ -5,7 +5,7 @@ on HTB.
 """
 
 
-from . import session
+from . import prefetch, session
 from .models import HTBObject
 from typing import List, Optional
 import json
@@ -40,6 +40,7 @@ def findteams(name: str) -> List[HTBTeam]:
     results = resp.json()
     searchresults = results["teams"] if "teams" in results else []
     matches = [HTBTeam(res) for res in searchresults]
+    prefetch.results(matches)
     return matches
 
 def findteam(name: str) -> Optional[HTBTeam]:
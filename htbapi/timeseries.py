@@ -0,0 +1,469 @@
+"""Contains an append only store for the history of object stats.
+
+The TimeSeriesStore records numeric fields of objects (ie. a profile's
+points and ranking or a machine's owns and stars) each time they are
+polled, but only stores a value when it differs from the previous one.
+Recorded values are buffered in memory and flushed to immutable segment
+files. A segment is columnar: the points of each series (object and
+field) are stored together as delta encoded varint timestamps followed by
+delta encoded varint integers or raw doubles. A directory at the end of
+the segment lists the time range and location of every series, so range
+queries only decode the blocks they need straight from a memory map.
+Compaction merges segments into one and can thin out old history.
+
+ie.
+    with TimeSeriesStore("history") as store:
+        store.record(findprofile("ippsec"))
+        store.query(("HTBProfile", 3769), "points", start, end)
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from .catalog import numericvalue
+from .exceptions import HTBException
+from .models import HTBObject
+from .varint import readvarint, unzigzag, writevarint, zigzag
+
+MAGIC = b"HTBT"
+VERSION = 1
+"""The segment version written by flush and compact."""
+
+TRACKED: Dict[str, Tuple[str, ...]] = {
+    "HTBProfile": ("points", "ranking", "system_owns", "user_owns",
+                   "system_bloods", "user_bloods", "respects",
+                   "rank_ownership"),
+    "HTBMachine": ("user_owns_count", "root_owns_count", "stars", "points"),
+    "HTBChallenge": ("solves", "likes", "dislikes", "points"),
+    "HTBTeam": ("points", "ranking"),
+}
+"""The fields recorded by default, keyed by object class name."""
+
+_INT = 0
+_FLOAT = 1
+
+_header = struct.Struct("<4sB3xQQ")
+_double = struct.Struct("<d")
+
+Number = Union[int, float]
+Point = Tuple[int, Number]
+SeriesKey = Tuple[str, object, str]
+Timestamp = Union[None, int, float, datetime]
+
+
+class HTBTimeSeriesError(HTBException):
+    pass
+
+
+def _timestamp(value: Timestamp) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def _writestring(out: bytearray, text: str):
+    data = text.encode("utf-8")
+    writevarint(out, len(data))
+    out.extend(data)
+
+
+def _readstring(view, pos: int) -> Tuple[str, int]:
+    size, pos = readvarint(view, pos)
+    return str(view[pos:pos + size], "utf-8"), pos + size
+
+
+def encodeblock(points: List[Point]) -> Tuple[int, bytes]:
+    """Encodes the sorted points of a series as a columnar block.
+
+    Returns:
+        The value type of the block and the encoded bytes.
+    """
+
+    kind = _FLOAT if any(isinstance(v, float) for _, v in points) else _INT
+    out = bytearray()
+    previous = 0
+    for t, _ in points:
+        writevarint(out, zigzag(t - previous))
+        previous = t
+    if kind == _INT:
+        previous = 0
+        for _, v in points:
+            writevarint(out, zigzag(v - previous))
+            previous = v
+    else:
+        for _, v in points:
+            out.extend(_double.pack(v))
+    return kind, bytes(out)
+
+
+def decodeblock(view, pos: int, count: int, kind: int) -> List[Point]:
+    """Decodes :count: points of a block starting at :pos: in :view:."""
+
+    times = []
+    t = 0
+    for _ in range(count):
+        delta, pos = readvarint(view, pos)
+        t += unzigzag(delta)
+        times.append(t)
+    values: List[Number] = []
+    if kind == _INT:
+        v = 0
+        for _ in range(count):
+            delta, pos = readvarint(view, pos)
+            v += unzigzag(delta)
+            values.append(v)
+    else:
+        for _ in range(count):
+            values.append(_double.unpack_from(view, pos)[0])
+            pos += 8
+    return list(zip(times, values))
+
+
+class _Entry:
+    __slots__ = ("segment", "kind", "count", "start", "end", "offset",
+                 "last")
+
+    def __init__(self, segment, kind, count, start, end, offset, last):
+        self.segment = segment
+        self.kind = kind
+        self.count = count
+        self.start = start
+        self.end = end
+        self.offset = offset
+        self.last = last
+
+
+class Segment:
+    """An immutable segment file, memory mapped for reading."""
+
+    def __init__(self, path: str):
+        """Opens a segment and reads its directory.
+
+        Raises:
+            HTBTimeSeriesError: If the file isn't a valid segment.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.entries: Dict[SeriesKey, _Entry] = {}
+        try:
+            self._readdirectory()
+        except (IndexError, UnicodeDecodeError, struct.error) as e:
+            self.close()
+            raise HTBTimeSeriesError(f"Corrupt segment {path}: {e}") from e
+
+    def _readdirectory(self):
+        view = self._map
+        magic, version, offset, count = _header.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise HTBTimeSeriesError(f"{self.path} is not a segment")
+        if version != VERSION:
+            raise HTBTimeSeriesError(
+                f"Unsupported segment version in {self.path}")
+        pos = offset
+        for _ in range(count):
+            cls, pos = _readstring(view, pos)
+            id, pos = readvarint(view, pos)
+            field, pos = _readstring(view, pos)
+            kind = view[pos]
+            pos += 1
+            points, pos = readvarint(view, pos)
+            start, pos = readvarint(view, pos)
+            end, pos = readvarint(view, pos)
+            block, pos = readvarint(view, pos)
+            if kind == _INT:
+                last, pos = readvarint(view, pos)
+                last = unzigzag(last)
+            else:
+                last = _double.unpack_from(view, pos)[0]
+                pos += 8
+            self.entries[(cls, unzigzag(id), field)] = _Entry(
+                self, kind, points, unzigzag(start), unzigzag(end), block,
+                last)
+
+    def points(self, entry: _Entry) -> List[Point]:
+        return decodeblock(self._map, entry.offset, entry.count, entry.kind)
+
+    def close(self):
+        self._map.close()
+
+    @staticmethod
+    def write(path: str, series: Dict[SeriesKey, List[Point]]):
+        """Writes sorted points per series to a new segment file."""
+        out = bytearray(_header.size)
+        directory = bytearray()
+        for (cls, id, field), points in sorted(
+                series.items(), key=lambda item: repr(item[0])):
+            if not points:
+                continue
+            kind, block = encodeblock(points)
+            _writestring(directory, cls)
+            writevarint(directory, zigzag(id))
+            _writestring(directory, field)
+            directory.append(kind)
+            writevarint(directory, len(points))
+            writevarint(directory, zigzag(points[0][0]))
+            writevarint(directory, zigzag(points[-1][0]))
+            writevarint(directory, len(out))
+            last = points[-1][1]
+            if kind == _INT:
+                writevarint(directory, zigzag(last))
+            else:
+                directory.extend(_double.pack(last))
+            out.extend(block)
+        _header.pack_into(out, 0, MAGIC, VERSION, len(out),
+                          sum(1 for points in series.values() if points))
+        out.extend(directory)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(out)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+class TimeSeriesStore:
+    """Stores the changes of numeric object fields over time."""
+
+    def __init__(self, directory: str,
+                 fields: Optional[Dict[str, Iterable[str]]] = None,
+                 flushsize: int = 10000):
+        """Opens a store, creating the directory if needed.
+
+        Args:
+            directory: The directory holding the segment files.
+            fields: The fields to record per class name.
+                Defaults to TRACKED.
+            flushsize: The number of buffered points that triggers a flush.
+        """
+        self.directory = directory
+        self.fields = {cls: tuple(names) for cls, names in
+                       (TRACKED if fields is None else fields).items()}
+        self.flushsize = flushsize
+        self.segments: List[Segment] = []
+        self._buffer: Dict[SeriesKey, List[Point]] = {}
+        self._buffered = 0
+        self._last: Dict[SeriesKey, Point] = {}
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("seg-") and name.endswith(".htbts"):
+                self._open(os.path.join(directory, name))
+
+    def _open(self, path: str) -> Segment:
+        segment = Segment(path)
+        self.segments.append(segment)
+        for key, entry in segment.entries.items():
+            last = self._last.get(key)
+            if last is None or entry.end >= last[0]:
+                self._last[key] = (entry.end, entry.last)
+        return segment
+
+    def _nextpath(self) -> str:
+        number = 0
+        if self.segments:
+            name = os.path.basename(self.segments[-1].path)
+            number = int(name[4:-6]) + 1
+        return os.path.join(self.directory, f"seg-{number:08d}.htbts")
+
+    def __enter__(self) -> "TimeSeriesStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def series(self) -> List[SeriesKey]:
+        """Returns the key (class name, id, field) of every series."""
+        with self._lock:
+            return sorted(self._last, key=repr)
+
+    def append(self, key: SeriesKey, timestamp: Timestamp,
+               value: Number) -> bool:
+        """Records a value of a series if it changed.
+
+        Args:
+            key: The class name, integer object id and field of the series.
+            timestamp: When the value was observed. Defaults to now.
+                Values observed before the last recorded one are ignored.
+            value: The value.
+        Returns:
+            Whether the value was recorded.
+        """
+        t = _timestamp(time.time() if timestamp is None else timestamp)
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and (last[1] == value or t < last[0]):
+                return False
+            self._last[key] = (t, value)
+            self._buffer.setdefault(key, []).append((t, value))
+            self._buffered += 1
+            if self._buffered >= self.flushsize:
+                self.flush()
+        return True
+
+    def record(self, obj: HTBObject, timestamp: Timestamp = None) -> int:
+        """Records the tracked fields of an object that changed.
+
+        Only values already present on the object are recorded, so this
+        never triggers a load.
+
+        Args:
+            obj: The object to record.
+            timestamp: When the values were observed. Defaults to now.
+        Returns:
+            The number of values recorded.
+        """
+        cls = type(obj).__name__
+        id = obj.__dict__.get("id")
+        if not isinstance(id, int):
+            return 0
+        t = _timestamp(time.time() if timestamp is None else timestamp)
+        recorded = 0
+        for field in self.fields.get(cls, ()):
+            value = numericvalue(obj, field)
+            if value is not None:
+                recorded += self.append((cls, id, field), t, value)
+        return recorded
+
+    def recordall(self, objects: Iterable[HTBObject],
+                  timestamp: Timestamp = None) -> int:
+        """Records many objects observed at the same time."""
+        t = time.time() if timestamp is None else timestamp
+        return sum(self.record(obj, t) for obj in objects)
+
+    @staticmethod
+    def _key(obj: Union[HTBObject, Tuple[str, object]],
+             field: str) -> SeriesKey:
+        if isinstance(obj, HTBObject):
+            return (type(obj).__name__, obj.__dict__.get("id"), field)
+        return (obj[0], obj[1], field)
+
+    def query(self, obj: Union[HTBObject, Tuple[str, object]], field: str,
+              start: Timestamp = None, end: Timestamp = None) -> List[Point]:
+        """Returns the recorded changes of a field within a time range.
+
+        Since only changes are stored, the value in effect at :start: is
+        the last point before it. That point is included as the first
+        point, with its own (earlier) timestamp.
+
+        Args:
+            obj: The object, or its class name and id.
+            field: The field.
+            start: The earliest timestamp to include.
+            end: The latest timestamp to include.
+        Returns:
+            The (timestamp, value) points sorted by time.
+        """
+        key = TimeSeriesStore._key(obj, field)
+        first, last = _timestamp(start), _timestamp(end)
+        # The last point before the range, from the directory if a whole
+        # block is before it.
+        before: Optional[Point] = None
+
+        with self._lock:
+            blocks = []
+            for segment in self.segments:
+                entry = segment.entries.get(key)
+                if entry is None \
+                        or (last is not None and entry.start > last):
+                    continue
+                if first is not None and entry.end < first:
+                    if before is None or entry.end >= before[0]:
+                        before = (entry.end, entry.last)
+                    continue
+                blocks.append(segment.points(entry))
+            blocks.append(list(self._buffer.get(key, ())))
+        points = []
+        for block in blocks:
+            for p in block:
+                if first is not None and p[0] < first:
+                    if before is None or p[0] >= before[0]:
+                        before = p
+                elif last is None or p[0] <= last:
+                    points.append(p)
+        points.sort()
+        if before is not None:
+            points.insert(0, before)
+        return [p for i, p in enumerate(points)
+                if i == 0 or p != points[i - 1]]
+
+    def valueat(self, obj: Union[HTBObject, Tuple[str, object]], field: str,
+                timestamp: Timestamp) -> Optional[Number]:
+        """Returns the value a field had at a point in time, if known."""
+        points = self.query(obj, field, end=timestamp)
+        return points[-1][1] if points else None
+
+    def flush(self):
+        """Writes the buffered values to a new segment."""
+        with self._lock:
+            if not self._buffered:
+                return
+            path = self._nextpath()
+            Segment.write(path, self._buffer)
+            self._buffer = {}
+            self._buffered = 0
+            self._open(path)
+
+    def compact(self, resolution: Optional[float] = None,
+                before: Timestamp = None):
+        """Merges every segment, and the buffer, into a single segment.
+
+        Args:
+            resolution: If set, older history is thinned out to at most one
+                value (the last one) per :resolution: seconds.
+            before: Only history before this timestamp is thinned out.
+                Defaults to all history.
+        """
+        cutoff = _timestamp(before)
+        with self._lock:
+            self.flush()
+            if len(self.segments) <= 1 and resolution is None:
+                return
+            keys = {key for segment in self.segments
+                    for key in segment.entries}
+            merged: Dict[SeriesKey, List[Point]] = {}
+            for key in keys:
+                points = self.query((key[0], key[1]), key[2])
+                if resolution is not None:
+                    points = _thin(points, resolution, cutoff)
+                merged[key] = points
+            path = self._nextpath()
+            Segment.write(path, merged)
+            old, self.segments = self.segments, []
+            for segment in old:
+                segment.close()
+                os.remove(segment.path)
+            self._last = {}
+            self._open(path)
+
+    def close(self):
+        """Flushes the buffer and closes the segments."""
+        with self._lock:
+            self.flush()
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
+
+
+def _thin(points: List[Point], resolution: float,
+          cutoff: Optional[int]) -> List[Point]:
+    thinned: List[Point] = []
+    for t, v in points:
+        if cutoff is not None and t >= cutoff:
+            thinned.append((t, v))
+            continue
+        if thinned and int(thinned[-1][0] // resolution) \
+                == int(t // resolution):
+            thinned[-1] = (t, v)
+        else:
+            thinned.append((t, v))
+    # Thinning can leave neighbours with the same value.
+    return [p for i, p in enumerate(thinned)
+            if i == 0 or p[1] != thinned[i - 1][1]]
@@ -4,7 +4,8 @@ This module provides methods for accessing and modifying the user's account
 details, including profile info, connection packs, etc.
 """
 
-from .models import HTBObject
+from .models import HTBObject, HTBReference
+from .profiles import HTBProfile
 
 
 class HTBUser(HTBObject):
@@ -29,4 +30,6 @@ class HTBUser(HTBObject):
     objectendpoint = "/user/info"
     objectkey = "info"
 
+    profile = HTBReference(HTBProfile)
+
 
@@ -0,0 +1,45 @@
+"""Contains the variable length integer encoding of the binary formats.
+
+Unsigned integers are written 7 bits at a time, least significant group
+first, with the high bit of every byte but the last set. Signed integers
+are zigzag encoded first so small negative numbers stay short.
+Both the serialization format and the time series segments use it.
+"""
+
+from typing import Tuple
+
+
+def writevarint(out: bytearray, n: int):
+    """Appends the unsigned integer :n: to :out:."""
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def readvarint(view, pos: int) -> Tuple[int, int]:
+    """Reads an unsigned integer from :view: starting at :pos:.
+
+    Returns:
+        The integer and the position after it.
+    Raises:
+        IndexError: If the data ends in the middle of the integer.
+    """
+    result = shift = 0
+    while True:
+        byte = view[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(n: int) -> int:
+    """Maps a signed integer to an unsigned one, ie. 0, -1, 1 to 0, 1, 2."""
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def unzigzag(n: int) -> int:
+    """Reverses zigzag."""
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
@@ -0,0 +1,327 @@
+"""Contains a scheduler for watching HTB objects for changes.
+
+The HTBWatcher keeps a priority queue of watched objects and reloads each
+of them at an adaptive interval. Newly released content is polled often,
+retired content rarely, and objects that stop changing are backed off.
+All polls share a global request budget so the request rate stays bounded
+no matter how many objects are watched.
+
+ie.
+    watcher = HTBWatcher(budget=0.5)
+    watcher.subscribe(lambda obj, changes: print(obj.name, changes))
+    watcher.watch(findmachine("Blunder"), ["root_owns_count"])
+    watcher.run()
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from requests import RequestException
+
+from . import session
+from .client import Deadline
+from .exceptions import HTBException
+from .priority import Priority
+from .models import HTBObject, objectkey, parsetimestamp
+from .ratelimit import TokenBucket
+
+Changes = Dict[str, Tuple[object, object]]
+Subscriber = Callable[[HTBObject, Changes], None]
+
+NEWINTERVAL = 60.0
+"""Seconds between polls of content released less than a day ago."""
+
+RECENTINTERVAL = 300.0
+"""Seconds between polls of content released less than a week ago."""
+
+ACTIVEINTERVAL = 1800.0
+"""Seconds between polls of other active content."""
+
+RETIREDINTERVAL = 21600.0
+"""Seconds between polls of retired content."""
+
+
+def pollinterval(obj: HTBObject, now: Optional[datetime] = None) -> float:
+    """Returns the base poll interval for an object.
+
+    Only values that are already present on the object are inspected so
+    calling this never triggers a load.
+
+    Args:
+        obj: The object to get the interval for.
+        now: The current time. Defaults to the current UTC time.
+    Returns:
+        The number of seconds to wait between polls.
+    """
+
+    values = obj.__dict__
+    if values.get("retired"):
+        return RETIREDINTERVAL
+    released = parsetimestamp(
+        values.get("release") or values.get("release_date"))
+    if released is None:
+        return ACTIVEINTERVAL
+    now = now or datetime.now(timezone.utc)
+    age = (now - released).total_seconds()
+    if age < 86400:
+        return NEWINTERVAL
+    if age < 7 * 86400:
+        return RECENTINTERVAL
+    return ACTIVEINTERVAL
+
+
+class _Watch:
+    """The state kept for a single watched object."""
+
+    def __init__(self, obj: HTBObject, fields: Optional[List[str]],
+                 interval: Optional[float]):
+        self.obj = obj
+        self.fields = fields
+        self.interval = interval
+        self.unchanged = 0
+        self.snapshot = self.capture() if obj.isloaded else None
+        self.entry: Optional[list] = None
+
+    def capture(self) -> dict:
+        values = self.obj.__dict__
+        if self.fields is None:
+            return {k: v for k, v in values.items() if k != "isloaded"}
+        return {k: values[k] for k in self.fields if k in values}
+
+    def diff(self, snapshot: dict) -> Changes:
+        keys = set(self.snapshot) | set(snapshot)
+        return {k: (self.snapshot.get(k), snapshot.get(k))
+                for k in keys if self.snapshot.get(k) != snapshot.get(k)}
+
+
+class HTBWatcher:
+    """Polls watched objects for changes under a global request budget."""
+
+    def __init__(self, budget: float = 1.0, burst: Optional[float] = None,
+                 interval: Callable[[HTBObject], float] = pollinterval,
+                 backoff: float = 4.0,
+                 polltimeout: Optional[float] = 30.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """Initializes the watcher.
+
+        Args:
+            budget: The maximum number of polls per second across all
+                watched objects.
+            burst: The number of polls that may be sent back to back.
+            interval: A function returning the base poll interval of an
+                object in seconds.
+            backoff: The maximum factor the base interval is stretched by
+                for objects that keep coming back unchanged.
+            polltimeout: The number of seconds a single poll, including
+                retries, may take.
+            clock: The monotonic clock used for scheduling.
+            sleep: The function used to wait between polls.
+        """
+        self.budget = TokenBucket(budget, burst, clock=clock, sleep=sleep)
+        self.interval = interval
+        self.backoff = backoff
+        self.polltimeout = polltimeout
+        self.clock = clock
+        self.sleep = sleep
+        self.subscribers: List[Subscriber] = []
+        self._queue: List[list] = []
+        self._watches: Dict[Tuple[str, object], _Watch] = {}
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopped = threading.Event()
+        self._deadline = Deadline()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._watches)
+
+    def __contains__(self, obj: HTBObject) -> bool:
+        return objectkey(obj) in self._watches
+
+    def subscribe(self, callback: Subscriber) -> Subscriber:
+        """Registers a callback that receives the changes of every poll.
+
+        The callback is called with the object and a dict mapping each
+        changed field to a tuple of its old and new value.
+
+        Args:
+            callback: The function to call with the changes.
+        Returns:
+            The callback so this can be used as a decorator.
+        """
+        self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback: Subscriber):
+        """Removes a previously registered callback."""
+        self.subscribers.remove(callback)
+
+    def watch(self, obj: HTBObject, fields: Optional[Iterable[str]] = None,
+              interval: Optional[float] = None, immediate: bool = False):
+        """Starts watching an object.
+
+        Args:
+            obj: The object to watch. It must be loadable.
+            fields: The fields to compare. Compares every field if None.
+            interval: A fixed base interval that overrides the adaptive one.
+            immediate: Whether to poll the object as soon as possible.
+        """
+        key = objectkey(obj)
+        watch = _Watch(obj, list(fields) if fields is not None else None,
+                       interval)
+        with self._lock:
+            self._discard(key)
+            self._watches[key] = watch
+            delay = 0.0 if immediate or watch.snapshot is None \
+                else self._nextinterval(watch)
+            self._schedule(key, watch, delay)
+
+    def watchall(self, objects: Iterable[HTBObject], **kwargs):
+        """Starts watching every object in :objects:.
+
+        Args:
+            objects: The objects to watch.
+            kwargs: Passed on to watch.
+        """
+        for obj in objects:
+            self.watch(obj, **kwargs)
+
+    def unwatch(self, obj: HTBObject):
+        """Stops watching an object."""
+        with self._lock:
+            self._discard(objectkey(obj))
+
+    def _discard(self, key):
+        watch = self._watches.pop(key, None)
+        if watch is not None and watch.entry is not None:
+            # Lazily removed from the heap when it is popped.
+            watch.entry[-1] = None
+
+    def _nextinterval(self, watch: _Watch) -> float:
+        base = watch.interval if watch.interval is not None \
+            else self.interval(watch.obj)
+        return base * min(1.0 + watch.unchanged, self.backoff)
+
+    def _schedule(self, key, watch: _Watch, delay: float):
+        entry = [self.clock() + delay, next(self._counter), key]
+        watch.entry = entry
+        heapq.heappush(self._queue, entry)
+        self._wakeup.notify_all()
+
+    def nextdue(self) -> Optional[float]:
+        """Returns the number of seconds until the next poll is due."""
+        with self._lock:
+            while self._queue and self._queue[0][-1] is None:
+                heapq.heappop(self._queue)
+            if not self._queue:
+                return None
+            return max(0.0, self._queue[0][0] - self.clock())
+
+    def step(self) -> Optional[HTBObject]:
+        """Polls the next object if it is due and the budget allows it.
+
+        Returns:
+            The polled object, or None if nothing was polled.
+        """
+        with self._lock:
+            due = self.nextdue()
+            if due is None or due > 0 or not self.budget.tryacquire():
+                return None
+            _, _, key = heapq.heappop(self._queue)
+            watch = self._watches[key]
+            watch.entry = None
+        changes = self._poll(watch)
+        with self._lock:
+            # The object may have been unwatched while it was polled.
+            if self._watches.get(key) is watch:
+                self._schedule(key, watch, self._nextinterval(watch))
+        if changes:
+            for callback in list(self.subscribers):
+                try:
+                    callback(watch.obj, changes)
+                except Exception:
+                    logging.exception("Watch subscriber failed")
+        return watch.obj
+
+    def _poll(self, watch: _Watch) -> Changes:
+        deadline = Deadline(self.polltimeout, self._deadline)
+        try:
+            with session.deadline(deadline), session.priority(Priority.BULK):
+                watch.obj.load(force=True)
+        except (HTBException, RequestException) as e:
+            logging.debug(f"Failed to poll {objectkey(watch.obj)}: {e}")
+            watch.unchanged += 1
+            return {}
+        snapshot = watch.capture()
+        if watch.snapshot is None:
+            # The first load only establishes a baseline.
+            watch.snapshot = snapshot
+            return {}
+        changes = watch.diff(snapshot)
+        watch.snapshot = snapshot
+        watch.unchanged = 0 if changes else watch.unchanged + 1
+        return changes
+
+    def run(self, until: Optional[float] = None):
+        """Polls objects until stopped.
+
+        Args:
+            until: The number of seconds to run for. Runs until stop is
+                called if None.
+        """
+        end = None if until is None else self.clock() + until
+        try:
+            self._loop(end)
+        finally:
+            self._stopped.clear()
+            self._deadline = Deadline()
+
+    def _loop(self, end: Optional[float]):
+        while not self._stopped.is_set():
+            if end is not None and self.clock() >= end:
+                return
+            if self.step() is not None:
+                continue
+            with self._lock:
+                due = self.nextdue()
+                wait = self.budget.delay() if due == 0 else due
+                if end is not None:
+                    remaining = end - self.clock()
+                    wait = remaining if wait is None else min(wait, remaining)
+                if wait is None or wait > 0:
+                    if self.sleep is time.sleep:
+                        self._wakeup.wait(wait)
+                    else:
+                        self.sleep(wait if wait is not None else 1.0)
+
+    def start(self) -> threading.Thread:
+        """Starts polling in a background daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="HTBWatcher", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, wait: bool = True):
+        """Stops polling.
+
+        Args:
+            wait: Whether to wait for the background thread to exit.
+        """
+        self._stopped.set()
+        self._deadline.cancel()
+        with self._lock:
+            self._wakeup.notify_all()
+        if wait and self._thread is not None \
+                and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
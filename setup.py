@@ -35,4 +35,8 @@ setup(
     packages=find_packages(),
 
     install_requires=['requests'],
+
+    extras_require={
+        'msgpack': ['msgpack'],
+    },
 )
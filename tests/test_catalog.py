@@ -0,0 +1,99 @@
+"""Tests for the indexed queries of HTBCatalog.
+
+Run from the repository root: python -m unittest tests.test_catalog
+"""
+import random
+import unittest
+
+from htbapi.catalog import HTBCatalog
+from htbapi.challenges import HTBChallenge
+from htbapi.exceptions import HTBException
+from htbapi.machines import HTBMachine
+
+
+def machine(i: int, rng: random.Random) -> HTBMachine:
+    return HTBMachine({
+        "id": i, "name": f"Machine{i}",
+        "os": rng.choice(["Linux", "Windows", "FreeBSD"]),
+        "retired": rng.random() < 0.7,
+        "points": rng.choice([0, 20, 30, 40, 50]),
+        "stars": round(rng.uniform(1, 5), 1) if i % 10 else None,
+        "difficulty": rng.randint(10, 90),
+        "release": f"20{rng.randint(17, 24)}-0{rng.randint(1, 9)}-15"
+                   "T19:00:00.000000Z",
+    })
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.machines = [machine(i, rng) for i in range(1, 301)]
+        self.catalog = HTBCatalog()
+        self.catalog.addall(self.machines)
+
+    def ids(self, objects) -> list:
+        return [obj.id for obj in objects]
+
+    def test_where_and_between(self):
+        results = (self.catalog.query(HTBMachine)
+                   .where(os="Linux", retired=False)
+                   .between("points", 20, 30)
+                   .all())
+        expected = [m for m in self.machines if m.os == "Linux"
+                    and not m.retired and 20 <= m.points <= 30]
+        self.assertEqual(sorted(self.ids(results)), self.ids(expected))
+
+    def test_unindexed_fields(self):
+        results = (self.catalog.query()
+                   .where(name="Machine7")
+                   .between("difficulty", 0, 100)
+                   .all())
+        self.assertEqual(self.ids(results), [7])
+
+    def test_orderby_with_limit(self):
+        for descending in (False, True):
+            results = (self.catalog.query(HTBMachine)
+                       .where(os="Windows")
+                       .orderby("stars", descending=descending)
+                       .limit(5)
+                       .all())
+            stars = sorted((m.stars for m in self.machines
+                            if m.os == "Windows" and m.stars is not None),
+                           reverse=descending)
+            self.assertEqual([m.stars for m in results], stars[:5])
+
+    def test_missing_values_come_last(self):
+        results = self.catalog.query(HTBMachine).orderby("stars").all()
+        self.assertEqual(len(results), len(self.machines))
+        self.assertTrue(all(m.stars is None for m in results[-30:]))
+
+    def test_release_bounds_accept_dates(self):
+        results = self.catalog.query().between(
+            "release", "2020-01-01", "2020-12-31").all()
+        self.assertEqual(
+            sorted(self.ids(results)),
+            [m.id for m in self.machines if m.release.startswith("2020")])
+        with self.assertRaises(HTBException):
+            self.catalog.query().between("release", "not a date")
+
+    def test_readding_reindexes(self):
+        obj = self.machines[0]
+        obj.__dict__["os"] = "Other"
+        self.catalog.add(obj)
+        self.assertEqual(
+            self.ids(self.catalog.query().where(os="Other").all()), [obj.id])
+        self.catalog.remove(obj)
+        self.assertNotIn(obj, self.catalog)
+        self.assertEqual(self.catalog.query().where(os="Other").size(), 0)
+        self.assertEqual(len(self.catalog), len(self.machines) - 1)
+
+    def test_orderby_mixed_types(self):
+        self.catalog.add(HTBChallenge({"id": 1, "name": "chal",
+                                       "difficulty": "Hard"}))
+        results = self.catalog.query().orderby("difficulty").all()
+        self.assertIsInstance(results[-1], HTBChallenge)
+
+
+if __name__ == "__main__":
+    unittest.main()
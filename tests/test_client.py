@@ -0,0 +1,226 @@
+"""Tests for the request handling of Client against the mock HTB API.
+
+Run from the repository root: python -m unittest tests.test_client
+"""
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from htbapi import client
+from htbapi.breaker import OPEN, CLOSED, CircuitBreakers
+from htbapi.client import Client
+from htbapi.exceptions import HTBCircuitOpen, HTBRequestException, HTBTimeout
+from htbapi.mockserver import MockHTBServer
+from htbapi.priority import Priority, RequestScheduler
+
+
+class MockServerTestCase(unittest.TestCase):
+    """Starts a MockHTBServer per test and logs a fresh Client in."""
+
+    serversettings: dict = {}
+
+    def setUp(self):
+        self.server = MockHTBServer(**self.serversettings).start()
+        self.addCleanup(self.server.stop)
+        baseurl = client.BASEURL
+        client.BASEURL = self.server.baseurl
+        self.addCleanup(setattr, client, "BASEURL", baseurl)
+        self.client = Client()
+        self.addCleanup(self.client.close)
+        self.client.login(self.server.email, self.server.password)
+
+    def served(self, method: str, endpoint: str, code: int) -> int:
+        """Returns the number of responses the server sent."""
+        return self.server.stats[(method, endpoint, code)]
+
+
+class TestThreadState(MockServerTestCase):
+
+    def test_responses_are_tracked_per_thread(self):
+        def load(i):
+            resp = self.client.get(f"/machine/profile/{i}")
+            return (resp.json()["info"]["id"],
+                    self.client._response.json()["info"]["id"],
+                    self.client._request.url.endswith(f"/{i}"))
+
+        with ThreadPoolExecutor(16) as pool:
+            results = list(pool.map(load, range(1, 65)))
+        for i, (body, stored, url) in enumerate(results, 1):
+            self.assertEqual(body, i)
+            self.assertEqual(stored, i)
+            self.assertTrue(url)
+
+    def test_deadline_and_priority_are_per_thread(self):
+        entered = threading.Barrier(2)
+        seen = {}
+
+        def worker(name, seconds, priority):
+            with self.client.deadline(seconds), \
+                    self.client.priority(priority):
+                entered.wait()
+                seen[name] = (self.client.currentdeadline.remaining(),
+                              self.client.currentpriority)
+                entered.wait()
+
+        threads = [threading.Thread(target=worker, args=args) for args in
+                   (("a", 100, Priority.BULK),
+                    ("b", 5, Priority.INTERACTIVE))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreater(seen["a"][0], 50)
+        self.assertLessEqual(seen["b"][0], 5)
+        self.assertEqual(seen["a"][1], Priority.BULK)
+        self.assertEqual(seen["b"][1], Priority.INTERACTIVE)
+        self.assertIsNone(self.client.currentdeadline)
+        self.assertEqual(self.client.currentpriority, Priority.NORMAL)
+
+    def test_deadline_raises_timeout(self):
+        self.server.latency = 0.3
+        with self.assertRaises(HTBTimeout):
+            self.client.get("/machine/profile/1", deadline=0.05)
+
+
+class TestRefresh(MockServerTestCase):
+
+    serversettings = {"tokenlifetime": 1}
+
+    def test_expired_token_is_refreshed_once(self):
+        time.sleep(1.1)
+        with ThreadPoolExecutor(10) as pool:
+            codes = list(pool.map(
+                lambda i: self.client.get(
+                    f"/machine/profile/{i}").status_code,
+                range(1, 21)))
+        self.assertEqual(codes, [200] * 20)
+        self.assertEqual(self.served("POST", "/login/refresh", 200), 1)
+
+    def test_rejected_refresh_raises(self):
+        time.sleep(1.1)
+        self.client.refreshtoken = "invalid"
+        with self.assertRaises(HTBRequestException):
+            self.client.get("/machine/profile/1")
+
+
+class TestScheduler(MockServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.concurrent = 0
+        self.maxconcurrent = 0
+        self.order = []
+        lock = threading.Lock()
+
+        def slow(handler, match, body):
+            with lock:
+                self.concurrent += 1
+                self.maxconcurrent = max(self.maxconcurrent, self.concurrent)
+            time.sleep(0.05)
+            with lock:
+                self.concurrent -= 1
+                self.order.append(body["query"].get("name"))
+            return 200, {"message": "ok"}
+
+        self.server.route("GET", r"/slow", slow)
+
+    def test_no_limit_by_default(self):
+        self.assertIsNone(client.MAXINFLIGHT)
+        self.assertIsNone(self.client.scheduler)
+
+    def test_default_limit(self):
+        self.addCleanup(setattr, client, "MAXINFLIGHT", client.MAXINFLIGHT)
+        client.MAXINFLIGHT = 4
+        limited = Client()
+        self.addCleanup(limited.close)
+        self.assertEqual(limited.scheduler.maxinflight, 4)
+
+    def test_limits_requests_in_flight(self):
+        self.client.scheduler = RequestScheduler(3)
+        with ThreadPoolExecutor(12) as pool:
+            list(pool.map(lambda i: self.client.get("/slow"), range(24)))
+        self.assertEqual(self.maxconcurrent, 3)
+        self.assertEqual(self.client.scheduler.total, 0)
+
+    def test_no_limit_without_scheduler(self):
+        self.client.scheduler = None
+        with ThreadPoolExecutor(12) as pool:
+            list(pool.map(lambda i: self.client.get("/slow"), range(24)))
+        self.assertGreater(self.maxconcurrent, 3)
+
+    def test_interactive_requests_jump_the_queue(self):
+        scheduler = self.client.scheduler = RequestScheduler(1)
+        with ThreadPoolExecutor(8) as pool:
+            bulk = [pool.submit(self.client.get, "/slow",
+                                priority=Priority.BULK,
+                                params={"name": f"bulk{i}"})
+                    for i in range(6)]
+            while scheduler.waiting(Priority.BULK) < 5:
+                time.sleep(0.01)
+            interactive = pool.submit(self.client.get, "/slow",
+                                      priority=Priority.INTERACTIVE,
+                                      params={"name": "interactive"})
+            for future in bulk + [interactive]:
+                future.result()
+        self.assertLessEqual(self.order.index("interactive"), 1)
+
+
+class TestBreakers(MockServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.breakers = CircuitBreakers(minimumcalls=4, cooldown=60)
+
+    def state(self, family: str) -> str:
+        return self.client.breakerstates()[family]["state"]
+
+    def trip(self, family: str = "machine"):
+        """Sends failing requests until the circuit of :family: opens."""
+        self.server.errorrates = {503: 1.0}
+        for i in range(10):
+            with self.assertRaises(HTBRequestException):
+                self.client.get(f"/machine/profile/{i + 1}")
+            if self.state(family) == OPEN:
+                return
+        self.fail("The circuit didn't open")
+
+    def test_errors_open_the_circuit(self):
+        self.trip()
+        sent = self.served("GET", "/machine/profile", 503)
+        with self.assertRaises(HTBCircuitOpen):
+            self.client.get("/machine/profile/5")
+        self.assertEqual(self.served("GET", "/machine/profile", 503), sent)
+        self.server.errorrates = {}
+        self.assertEqual(self.client.get("/user/info").status_code, 200)
+        self.assertEqual(self.state("user"), CLOSED)
+
+    def test_open_circuit_serves_stale_responses(self):
+        self.client.servestale = True
+        fresh = self.client.get("/machine/profile/7")
+        self.trip()
+        stale = self.client.get("/machine/profile/7")
+        self.assertTrue(stale.stale)
+        self.assertFalse(getattr(fresh, "stale", False))
+        self.assertEqual(stale.json(), fresh.json())
+
+    def test_stale_responses_are_opt_in(self):
+        self.client.get("/machine/profile/7")
+        self.trip()
+        with self.assertRaises(HTBCircuitOpen):
+            self.client.get("/machine/profile/7")
+        self.assertEqual(len(self.client._stale), 0)
+
+    def test_deadline_timeouts_dont_open_the_circuit(self):
+        self.server.latency = 0.3
+        for i in range(6):
+            with self.assertRaises(HTBTimeout):
+                self.client.get(f"/machine/profile/{i + 1}", deadline=0.05)
+        self.assertEqual(self.state("machine"), CLOSED)
+        self.server.latency = 0
+        self.assertEqual(
+            self.client.get("/machine/profile/50").status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
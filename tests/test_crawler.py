@@ -0,0 +1,110 @@
+"""Tests for the HTBCrawler against the mock HTB API.
+
+Run from the repository root: python -m unittest tests.test_crawler
+"""
+import os
+import tempfile
+import unittest
+
+import htbapi
+from htbapi import client
+from htbapi.crawler import HTBCrawler
+from htbapi.machines import HTBMachine
+from htbapi.mockserver import MockHTBServer
+
+
+class ListSink:
+    """Keeps the crawled objects in a list."""
+
+    def __init__(self):
+        self.objects = []
+        self.flushes = 0
+
+    def write(self, obj):
+        self.objects.append(obj)
+
+    def flush(self):
+        self.flushes += 1
+
+    def keys(self) -> set:
+        return {(type(obj).__name__, obj.id) for obj in self.objects}
+
+
+class SessionTestCase(unittest.TestCase):
+    """Starts a MockHTBServer per test and logs the shared session in."""
+
+    def setUp(self):
+        self.server = MockHTBServer().start()
+        self.addCleanup(self.server.stop)
+        baseurl = client.BASEURL
+        client.BASEURL = self.server.baseurl
+        self.addCleanup(setattr, client, "BASEURL", baseurl)
+        htbapi.initialize(self.server.email, self.server.password)
+
+
+class TestCrawler(SessionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sink = ListSink()
+
+    def test_follows_references(self):
+        crawler = HTBCrawler(self.sink, maxdepth=2)
+        crawler.add(HTBMachine({"id": 1}))
+        self.assertEqual(crawler.run(), 3)
+        self.assertEqual(self.sink.keys(), {("HTBMachine", 1),
+                                            ("HTBProfile", 2),
+                                            ("HTBTeam", 3)})
+        self.assertTrue(all(obj.isloaded for obj in self.sink.objects
+                            if obj.objectendpoint is not None))
+
+    def test_objects_are_visited_once(self):
+        crawler = HTBCrawler(self.sink, maxdepth=1)
+        for i in (1, 2, 1):
+            crawler.add(HTBMachine({"id": i}))
+        crawler.run()
+        keys = [(type(obj).__name__, obj.id) for obj in self.sink.objects]
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(
+            self.server.stats[("GET", "/machine/profile", 200)], 2)
+
+    def test_malformed_payloads_fail_only_their_object(self):
+        machine = self.server.routes[("GET", r"/machine/profile/(\d+)")][1]
+        self.server.route(
+            "GET", r"/machine/profile/(\d+)",
+            lambda handler, match, body: (200, {}) if match.group(1) == "2"
+            else machine(handler, match, body))
+        crawler = HTBCrawler(self.sink, maxdepth=0)
+        for i in (1, 2, 3):
+            crawler.add(HTBMachine({"id": i}))
+        self.assertEqual(crawler.run(), 2)
+        self.assertEqual(crawler.failed, 1)
+        self.assertEqual(self.sink.keys(), {("HTBMachine", 1),
+                                            ("HTBMachine", 3)})
+
+    def test_stop_before_run(self):
+        crawler = HTBCrawler(self.sink)
+        crawler.add(HTBMachine({"id": 1}))
+        crawler.stop()
+        self.assertEqual(crawler.run(), 0)
+        self.assertEqual(len(crawler), 1)
+        self.assertEqual(crawler.run(limit=1), 1)
+
+    def test_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "crawl.json")
+            crawler = HTBCrawler(self.sink, checkpoint=path, maxdepth=1)
+            for i in range(1, 6):
+                crawler.add(HTBMachine({"id": i}))
+            self.assertEqual(crawler.run(limit=3), 3)
+            resumed = HTBCrawler(self.sink, checkpoint=path, maxdepth=1)
+            self.assertEqual(resumed.crawled, 3)
+            self.assertEqual(len(resumed), len(crawler))
+            resumed.run()
+        self.assertEqual(len(self.sink.objects), len(self.sink.keys()))
+        self.assertTrue({("HTBMachine", i) for i in range(1, 6)}
+                        <= self.sink.keys())
+
+
+if __name__ == "__main__":
+    unittest.main()
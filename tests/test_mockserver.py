@@ -0,0 +1,44 @@
+"""Tests for the request validation of the mock HTB API.
+
+Run from the repository root: python -m unittest tests.test_mockserver
+"""
+import unittest
+
+import requests
+
+from htbapi.mockserver import MockHTBServer
+
+
+class TestMockServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockHTBServer(otp="123456").start()
+        self.addCleanup(self.server.stop)
+        self.http = requests.Session()
+        self.addCleanup(self.http.close)
+
+    def post(self, endpoint: str, **kwargs) -> requests.Response:
+        return self.http.post(self.server.baseurl + endpoint, **kwargs)
+
+    def test_body_must_be_an_object(self):
+        for data in (b"[1, 2]", b'"text"', b"{not json"):
+            resp = self.post("/login", data=data,
+                             headers={"Content-Type": "application/json"})
+            self.assertEqual(resp.status_code, 400, data)
+        self.assertEqual(self.server.stats[("POST", "/login", 400)], 3)
+
+    def test_twofactor_without_token(self):
+        resp = self.post("/2fa/login", json={"one_time_password": "123456"})
+        self.assertEqual(resp.status_code, 401)
+
+    def test_twofactor(self):
+        token = self.post("/login", json={
+            "email": self.server.email, "password": self.server.password,
+        }).json()["message"]["access_token"]
+        resp = self.post("/2fa/login", json={"one_time_password": "123456"},
+                         headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(resp.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""Tests for the MutationQueue against the mock HTB API.
+
+Run from the repository root: python -m unittest tests.test_mutations
+"""
+import unittest
+
+import htbapi
+from htbapi import client
+from htbapi.mockserver import MockHTBServer
+from htbapi.mutations import APPLIED, FAILED, UNCHANGED, MutationQueue
+from htbapi.profiles import HTBProfile
+
+
+class SessionTestCase(unittest.TestCase):
+    """Starts a MockHTBServer per test and logs the shared session in."""
+
+    def setUp(self):
+        self.server = MockHTBServer().start()
+        self.addCleanup(self.server.stop)
+        baseurl = client.BASEURL
+        client.BASEURL = self.server.baseurl
+        self.addCleanup(setattr, client, "BASEURL", baseurl)
+        htbapi.initialize(self.server.email, self.server.password)
+
+    def served(self, method: str, endpoint: str) -> int:
+        """Returns the number of responses the server sent."""
+        return sum(count for (m, e, _), count in self.server.stats.items()
+                   if (m, e) == (method, endpoint))
+
+
+def profile(id: int, **values) -> HTBProfile:
+    return HTBProfile(dict(id=id, name=f"user{id}", **values))
+
+
+class TestMutationQueue(SessionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.queue = MutationQueue(budget=100)
+
+    def test_known_values_are_applied_without_loading(self):
+        followed, unfollowed = profile(1, isFollowed=True), \
+            profile(2, isFollowed=False)
+        self.queue.toggle(followed, "isFollowed")
+        self.queue.set(unfollowed, "isFollowed", True)
+        results = self.queue.flush()
+        self.assertEqual([r.status for r in results], [APPLIED, APPLIED])
+        self.assertFalse(followed.isFollowed)
+        self.assertTrue(unfollowed.isFollowed)
+        self.assertEqual(self.server.toggled,
+                         {("user/follow", 1), ("user/follow", 2)})
+        self.assertEqual(self.served("GET", "/user/profile/basic"), 0)
+
+    def test_repeated_toggles_cancel(self):
+        unknown, known = profile(3), profile(4, isFollowed=False)
+        for obj in (unknown, unknown, known, known):
+            self.queue.toggle(obj, "isFollowed")
+        results = self.queue.flush()
+        self.assertEqual([r.status for r in results], [UNCHANGED])
+        self.assertEqual(self.server.toggled, set())
+        self.assertEqual(self.served("GET", "/user/profile/basic"), 0)
+
+    def test_unchanged_values_arent_sent(self):
+        obj = profile(5, isRespected=True)
+        self.queue.set(obj, "isRespected", True)
+        results = self.queue.flush()
+        self.assertEqual([r.status for r in results], [UNCHANGED])
+        self.assertEqual(self.server.toggled, set())
+
+    def test_a_failure_doesnt_lose_the_batch(self):
+        # The profile endpoint answers without a profile, so loading the
+        # current value of the second object raises a KeyError.
+        self.server.route("GET", r"/user/profile/basic/(\d+)",
+                          lambda handler, match, body: (200, {}))
+        objects = [profile(6, isFollowed=False), profile(7),
+                   profile(8, isFollowed=True)]
+        for obj in objects:
+            self.queue.toggle(obj, "isFollowed")
+        results = self.queue.flush()
+        self.assertEqual([r.status for r in results],
+                         [APPLIED, FAILED, APPLIED])
+        self.assertIsInstance(results[1].error, KeyError)
+        self.assertEqual(self.server.toggled,
+                         {("user/follow", 6), ("user/follow", 8)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Tests for the binary serialization of HTB objects.
+
+Run from the repository root: python -m unittest tests.test_serialization
+"""
+import unittest
+from unittest import mock
+
+from htbapi import serialization
+from htbapi.machines import HTBMachine
+from htbapi.serialization import HTBSerializationError
+
+
+def machine(id: int) -> HTBMachine:
+    m = HTBMachine({"id": id, "name": f"Machine{id}", "os": "Linux",
+                    "retired": True, "stars": 4.5, "difficulty": 42,
+                    "maker": {"id": id * 7, "name": f"maker{id}"},
+                    "maker2": None})
+    m.isloaded = True
+    return m
+
+
+class TestBuiltinCodec(unittest.TestCase):
+
+    def test_roundtrip(self):
+        value = [machine(1), {"x": -5, "y": [1.5, None, True, -(2 ** 70)]}]
+        data = serialization.dumps(value)
+        self.assertEqual(serialization.version(data), serialization.VERSION)
+        loaded = serialization.loads(data)
+        self.assertIsInstance(loaded[0], HTBMachine)
+        self.assertEqual(loaded[0].__dict__, value[0].__dict__)
+        self.assertEqual(loaded[1], value[1])
+
+    def test_default_doesnt_depend_on_msgpack(self):
+        value = [machine(i) for i in range(5)]
+        data = serialization.dumps(value)
+        with mock.patch.object(serialization, "msgpack", None):
+            self.assertEqual(serialization.dumps(value), data)
+            self.assertEqual(len(serialization.loads(data)), 5)
+
+    def test_unsupported_values_raise(self):
+        with self.assertRaises(HTBSerializationError):
+            serialization.dumps(object())
+        with self.assertRaises(HTBSerializationError):
+            serialization.dumps({1: "not a str key"})
+
+    def test_corrupt_data_raises(self):
+        data = serialization.dumps([machine(1)])
+        with self.assertRaises(HTBSerializationError):
+            serialization.loads(data[:-3])
+        self.assertIsNone(serialization.version(b"not serialized"))
+
+
+@unittest.skipIf(serialization.msgpack is None, "msgpack isn't installed")
+class TestFastCodec(unittest.TestCase):
+
+    def test_roundtrip(self):
+        value = {"machines": [machine(1), machine(2)], "total": 2}
+        data = serialization.dumps(value, fast=True)
+        self.assertEqual(serialization.version(data),
+                         serialization.MSGPACKVERSION)
+        loaded = serialization.loads(data)
+        self.assertEqual([m.__dict__ for m in loaded["machines"]],
+                         [m.__dict__ for m in value["machines"]])
+        self.assertEqual(loaded["total"], 2)
+
+    def test_big_integers_use_the_builtin_codec(self):
+        data = serialization.dumps([2 ** 70], fast=True)
+        self.assertEqual(serialization.version(data), serialization.VERSION)
+        self.assertEqual(serialization.loads(data), [2 ** 70])
+
+    def test_fast_requires_msgpack(self):
+        with mock.patch.object(serialization, "msgpack", None):
+            with self.assertRaises(HTBSerializationError):
+                serialization.dumps([machine(1)], fast=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
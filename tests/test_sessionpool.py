@@ -0,0 +1,111 @@
+"""Tests for the SessionPool against the mock HTB API.
+
+Run from the repository root: python -m unittest tests.test_sessionpool
+"""
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from htbapi import client
+from htbapi.client import Client
+from htbapi.exceptions import HTBTimeout
+from htbapi.mockserver import MockHTBServer
+from htbapi.sessionpool import SessionPool, tokenclaim, tokenexpiry
+
+
+class SessionPoolTestCase(unittest.TestCase):
+    """Starts a MockHTBServer and a SessionPool per test."""
+
+    serversettings: dict = {}
+
+    def setUp(self):
+        self.server = MockHTBServer(**self.serversettings).start()
+        self.addCleanup(self.server.stop)
+        baseurl = client.BASEURL
+        client.BASEURL = self.server.baseurl
+        self.addCleanup(setattr, client, "BASEURL", baseurl)
+        self.pool = SessionPool(self.server.email, self.server.password,
+                                size=2).start()
+        self.addCleanup(self.pool.close)
+
+    def served(self, method: str, endpoint: str, code: int) -> int:
+        """Returns the number of responses the server sent."""
+        return self.server.stats[(method, endpoint, code)]
+
+    def get(self, endpoint: str = "/user/info") -> int:
+        """Sends a request with a pooled client."""
+        with self.pool.client() as pooled:
+            return pooled.get(endpoint).status_code
+
+
+class TestSessionPool(SessionPoolTestCase):
+
+    def test_token_claims(self):
+        token = self.pool.accesstoken
+        self.assertAlmostEqual(tokenclaim(token, "iat"), time.time(),
+                               delta=5)
+        self.assertIsNone(tokenexpiry(token))
+        self.assertIsNone(self.pool.expires)
+        self.assertIsNone(tokenexpiry("not.a.token"))
+        self.assertIsNone(tokenexpiry(None))
+
+    def test_clients_are_warm_and_authenticated(self):
+        self.assertEqual(self.served("POST", "/login", 200), 1)
+        self.assertEqual(self.served("GET", "/user/info", 200), 2)
+        with ThreadPoolExecutor(4) as executor:
+            codes = list(executor.map(
+                lambda i: self.get(f"/machine/profile/{i}"), range(1, 21)))
+        self.assertEqual(codes, [200] * 20)
+        self.assertEqual(self.served("POST", "/login", 200), 1)
+
+    def test_acquire_times_out(self):
+        clients = [self.pool.acquire(), self.pool.acquire()]
+        with self.assertRaises(HTBTimeout):
+            self.pool.acquire(timeout=0.05)
+        for pooled in clients:
+            self.pool.release(pooled)
+        self.pool.release(self.pool.acquire(timeout=0.05))
+
+    def test_attach_and_detach(self):
+        outside = Client()
+        self.addCleanup(outside.close)
+        self.pool.attach(outside)
+        self.pool.attach(outside)
+        self.assertEqual(self.pool.attached, [outside])
+        self.assertEqual(outside.accesstoken, self.pool.accesstoken)
+        self.pool.refresh()
+        self.assertEqual(outside.accesstoken, self.pool.accesstoken)
+        self.pool.detach(outside)
+        self.assertNotIn("refreshsession", outside.__dict__)
+        self.assertEqual(outside.get("/user/info").status_code, 200)
+
+
+class TestRefresh(SessionPoolTestCase):
+
+    serversettings = {"tokenlifetime": 2}
+
+    def test_tokens_are_refreshed_before_they_expire(self):
+        token = self.pool.accesstoken
+        self.assertEqual(tokenexpiry(token) - tokenclaim(token, "iat"), 2)
+        time.sleep(2.5)
+        self.assertNotEqual(self.pool.accesstoken, token)
+        self.assertGreaterEqual(self.pool.refreshes, 1)
+        self.assertEqual(self.get(), 200)
+        self.assertEqual(self.served("GET", "/user/info", 401), 0)
+
+    def test_rejected_token_refreshes_once(self):
+        self.pool.close()
+        self.pool = SessionPool(self.server.email, self.server.password,
+                                size=4, margin=0, warmup=False).start()
+        self.addCleanup(self.pool.close)
+        # Stop the upkeep thread so the token expires.
+        self.pool._stop.set()
+        time.sleep(2.1)
+        with ThreadPoolExecutor(4) as executor:
+            codes = list(executor.map(lambda i: self.get(), range(8)))
+        self.assertEqual(codes, [200] * 8)
+        self.assertEqual(self.served("POST", "/login/refresh", 200), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
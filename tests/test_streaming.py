@@ -0,0 +1,62 @@
+"""Tests for the incremental JSON parser.
+
+Run from the repository root: python -m unittest tests.test_streaming
+"""
+import json
+import random
+import unittest
+
+from htbapi.streaming import HTBStreamError, JSONStream, iterjson
+
+
+def chunked(data: bytes, rng: random.Random):
+    """Splits :data: into chunks of random sizes."""
+    pos = 0
+    while pos < len(data):
+        size = rng.randint(1, 7)
+        yield data[pos:pos + size]
+        pos += size
+
+
+class TestJSONStream(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(5)
+
+    def test_root_array(self):
+        elements = [1, "a\"b\\", None, {"x": [1, {"y": "é{[,:]}"}]}, [], True]
+        data = json.dumps(elements).encode()
+        for _ in range(20):
+            self.assertEqual(
+                [e for _, e in iterjson(chunked(data, self.rng))], elements)
+
+    def test_selected_arrays_and_members(self):
+        doc = {"machines": [{"id": 1}, {"id": 2}], "users": [{"id": 3}],
+               "error": {"message": "partial"}, "total": 3,
+               "nested": {"machines": [4]}}
+        data = json.dumps(doc, indent=1).encode()
+        results = list(iterjson(chunked(data, self.rng), [("*",)]))
+        self.assertEqual(results, [
+            (("machines",), {"id": 1}), (("machines",), {"id": 2}),
+            (("users",), {"id": 3}), (("error",), {"message": "partial"}),
+            (("total",), 3), (("nested",), {"machines": [4]})])
+        self.assertEqual(list(iterjson([data], [("nested", "machines")])),
+                         [(("nested", "machines"), 4)])
+
+    def test_elements_are_yielded_as_they_complete(self):
+        parser = JSONStream([("machines",)])
+        self.assertEqual(list(parser.feed(b'{"machines": [{"id": 1}, ')),
+                         [(("machines",), {"id": 1})])
+        self.assertEqual(list(parser.feed(b'{"id": 2')), [])
+        self.assertEqual(list(parser.feed(b'}]}')),
+                         [(("machines",), {"id": 2})])
+        parser.close()
+
+    def test_invalid_documents_raise(self):
+        for data in (b'{"a": [1, 2', b'[1, 2]]', b'{"a": [1,}'):
+            with self.assertRaises(HTBStreamError, msg=data):
+                list(iterjson([data], [("a",)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
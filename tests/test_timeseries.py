@@ -0,0 +1,97 @@
+"""Tests for the TimeSeriesStore.
+
+Run from the repository root: python -m unittest tests.test_timeseries
+"""
+import tempfile
+import time
+import unittest
+
+from htbapi.timeseries import TimeSeriesStore
+
+KEY = ("HTBProfile", 1, "points")
+OBJ = ("HTBProfile", 1)
+
+
+class TimeSeriesTestCase(unittest.TestCase):
+    """Opens a TimeSeriesStore in a temporary directory."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.store = TimeSeriesStore(self.directory)
+        self.addCleanup(self.store.close)
+
+    def reopen(self) -> TimeSeriesStore:
+        self.store.close()
+        self.store = TimeSeriesStore(self.directory)
+        return self.store
+
+
+class TestAppend(TimeSeriesTestCase):
+
+    def test_only_changes_are_recorded(self):
+        results = [self.store.append(KEY, t, v) for t, v in
+                   ((10, 1), (20, 1), (30, 2), (25, 3), (40, 2))]
+        self.assertEqual(results, [True, False, True, False, False])
+        self.assertEqual(self.store.query(OBJ, "points"), [(10, 1), (30, 2)])
+
+    def test_missing_timestamp_defaults_to_now(self):
+        before = int(time.time())
+        self.assertTrue(self.store.append(KEY, None, 5))
+        self.store.flush()
+        points = self.reopen().query(OBJ, "points")
+        self.assertEqual(len(points), 1)
+        self.assertGreaterEqual(points[0][0], before)
+        self.assertEqual(points[0][1], 5)
+
+    def test_values_survive_reopening(self):
+        for t in range(100):
+            self.store.append(KEY, t, t // 10)
+        self.store.append(("HTBProfile", 1, "ranking"), 5, 0.5)
+        self.store.close()
+        store = self.reopen()
+        self.assertEqual(store.query(OBJ, "points"),
+                         [(t, t // 10) for t in range(0, 100, 10)])
+        self.assertEqual(store.query(OBJ, "ranking"), [(5, 0.5)])
+
+
+class TestQuery(TimeSeriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for t, v in ((10, 1), (20, 2)):
+            self.store.append(KEY, t, v)
+        self.store.flush()
+        for t, v in ((30, 3), (40, 4)):
+            self.store.append(KEY, t, v)
+        self.store.flush()
+        self.store.append(KEY, 50, 5)
+
+    def test_range_includes_value_in_effect_at_start(self):
+        self.assertEqual(self.store.query(OBJ, "points", 35, 50),
+                         [(30, 3), (40, 4), (50, 5)])
+        self.assertEqual(self.store.query(OBJ, "points", 25, 25), [(20, 2)])
+        self.assertEqual(self.store.query(OBJ, "points", 45),
+                         [(40, 4), (50, 5)])
+
+    def test_range_before_first_point(self):
+        self.assertEqual(self.store.query(OBJ, "points", 0, 5), [])
+        self.assertEqual(self.store.query(OBJ, "points", 0, 10), [(10, 1)])
+
+    def test_valueat(self):
+        self.assertIsNone(self.store.valueat(OBJ, "points", 5))
+        self.assertEqual(self.store.valueat(OBJ, "points", 35), 3)
+        self.assertEqual(self.store.valueat(OBJ, "points", 100), 5)
+
+    def test_compact_keeps_history(self):
+        points = self.store.query(OBJ, "points")
+        self.store.compact()
+        self.assertEqual(len(self.store.segments), 1)
+        self.assertEqual(self.store.query(OBJ, "points"), points)
+        self.assertEqual(self.store.query(OBJ, "points", 35, 45),
+                         [(30, 3), (40, 4)])
+
+
+if __name__ == "__main__":
+    unittest.main()